@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""Run both ends of a proxied QEMU migration from one process and time each phase.
+
+Replaces the four-terminal procedure in README.md: the destination proxy,
+migrate-incoming, the source proxy and migrate are started by one asyncio
+loop, each step gated on the previous one reporting ready instead of sleeps.
+Both QEMU instances and both proxies must be reachable from this host.
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import logging
+import os
+import sys
+import time
+from qemu.qmp import QMPClient, Runstate
+from qmp_migration import MigrationAutotuner, MigrationMonitor, PostcopyPolicy
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Proxy scripts per transport: (directory, server script, client script, default port)
+TRANSPORTS = {
+    'tcp': (SCRIPT_DIR, 'tcp-migration-server.py', 'tcp-migration-client.py', 9999),
+    'websocket': (os.path.join(SCRIPT_DIR, '..', 'migrate-websocket'),
+                  'websocket-migration-server.py', 'websocket-migration-client.py', 8766),
+}
+
+# Source status changes that mark the switchover (stop-and-copy) phase
+SWITCHOVER_STATES = ('pre-switchover', 'device', 'postcopy-active')
+
+def load_script(path):
+    """Import a script by path; the scripts here have dashes in their names."""
+    name = os.path.splitext(os.path.basename(path))[0].replace('-', '_')
+    # Let the script import the modules next to it
+    directory = os.path.dirname(os.path.abspath(path))
+    if directory not in sys.path:
+        sys.path.append(directory)
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+class FirstByteReader:
+    """Wrap a StreamReader and call on_data once, when the first data arrives."""
+    def __init__(self, reader, on_data):
+        self.reader = reader
+        self.on_data = on_data
+
+    async def read(self, n=-1):
+        data = await self.reader.read(n)
+        if data and self.on_data:
+            self.on_data()
+            self.on_data = None
+        return data
+
+class MigrationOrchestrator:
+    def __init__(self, source_qmp, destination_qmp, transport='tcp', host='127.0.0.1', port=None,
+                 source_socket='/tmp/qemu_migration_source.sock',
+                 destination_socket='/tmp/qemu_migration_dest.sock',
+                 cert_dir=None, tls_profile='default', multifd_channels=1,
+                 sample_interval=0.1, autotune=None, postcopy=None, max_bandwidth=None, label=None,
+                 pool=None):
+        self.source_qmp = source_qmp
+        self.destination_qmp = destination_qmp
+        self.transport = transport
+        self.host = host
+        self.port = port or TRANSPORTS[transport][3]
+        self.source_socket = source_socket
+        self.destination_socket = destination_socket
+        self.cert_dir = cert_dir or os.path.join(TRANSPORTS['websocket'][0], 'certs')
+        self.tls_profile = tls_profile
+        self.multifd_channels = multifd_channels
+        self.sample_interval = sample_interval
+        self.autotune = autotune  # MigrationAutotuner keyword arguments, or None
+        self.postcopy = postcopy  # PostcopyPolicy keyword arguments, or None
+        self.policy = None
+        self.max_bandwidth = max_bandwidth  # Bytes/s cap set on the source, or None for QEMU's own
+        self.label = label  # Prefixes log lines when several migrations run at once
+        self.pool = pool  # QMPSessionPool to take the QMP connections from, left open afterwards
+        self.source_client = None
+        self.start_time = None
+        self.timeline = []  # (seconds since start, phase)
+        self.tuner = None
+        self.connections = 0  # QEMU connections seen by the source proxy
+        self.first_byte = False
+
+    def mark(self, phase, at=None):
+        """Record a phase at monotonic time `at`; only live phases (at=None) are logged."""
+        elapsed = (at if at is not None else time.monotonic()) - self.start_time
+        self.timeline.append((elapsed, phase))
+        if at is None:
+            logger.info(f"{self.label + ' ' if self.label else ''}[{elapsed:8.3f}s] {phase}")
+
+    def create_proxies(self):
+        directory, server_file, client_file, _ = TRANSPORTS[self.transport]
+        server_module = load_script(os.path.join(directory, server_file))
+        client_module = load_script(os.path.join(directory, client_file))
+        if self.transport == 'tcp':
+            server = server_module.MigrationTCPServer(self.host, self.port, self.destination_socket)
+            client = client_module.MigrationTCPClient(self.host, self.port, self.source_socket)
+            serve, forward, handler = server.start, client.connect_and_forward, 'handle_new_qemu_connection'
+        else:
+            server = server_module.MigrationWebSocketServer(self.host, self.port, self.destination_socket,
+                                                            self.cert_dir, self.tls_profile)
+            client = client_module.MigrationWebSocketClient(f"wss://{self.host}:{self.port}", self.source_socket,
+                                                            self.cert_dir, self.tls_profile)
+            serve, forward, handler = server.start, client.start_unix_server, 'handle_qemu_connection'
+
+        # Time the first QEMU connection and the first migration byte on the source proxy
+        original = getattr(client, handler)
+        async def handle_connection(unix_reader, unix_writer):
+            self.connections += 1
+            if self.connections == 1:
+                self.mark('first-connection')
+            await original(FirstByteReader(unix_reader, self.mark_first_byte), unix_writer)
+        setattr(client, handler, handle_connection)
+        return server, client, serve, forward
+
+    async def wait_ready(self, proxy, task):
+        """Wait for a proxy's ready event, failing fast if its task exits first."""
+        ready = asyncio.create_task(proxy.ready.wait())
+        await asyncio.wait((ready, task), return_when=asyncio.FIRST_COMPLETED)
+        if not ready.done():
+            ready.cancel()
+            raise RuntimeError(f"{type(proxy).__name__} exited before it was ready")
+
+    def mark_first_byte(self):
+        # Every channel reports its first read; only the earliest is a phase
+        if not self.first_byte:
+            self.first_byte = True
+            self.mark('first-byte')
+
+    async def configure_source(self, qmp):
+        """Apply the autotuner plan or the fixed multifd setup; return what the destination must match."""
+        if self.autotune is not None:
+            self.tuner = MigrationAutotuner(qmp, **self.autotune)
+            plan = await self.tuner.plan()
+            await self.tuner.apply(plan)
+            return plan['multifd-channels'], plan['multifd-compression']
+        await qmp.execute('migrate-set-capabilities', {
+            'capabilities': [{'capability': 'multifd', 'state': True},
+                             {'capability': 'events', 'state': True}]
+        })
+        parameters = {'multifd-channels': self.multifd_channels}
+        if self.max_bandwidth:
+            parameters['max-bandwidth'] = int(self.max_bandwidth)
+        await qmp.execute('migrate-set-parameters', parameters)
+        return self.multifd_channels, 'none'
+
+    async def set_max_bandwidth(self, rate):
+        """Change the source's max-bandwidth, now if connected, otherwise when it is configured."""
+        self.max_bandwidth = rate
+        if self.source_client and self.source_client.runstate == Runstate.RUNNING:
+            try:
+                await self.source_client.execute('migrate-set-parameters', {'max-bandwidth': int(rate)})
+            except Exception as e:
+                logger.warning(f"{self.label or 'source'}: max-bandwidth not changed: {e}")
+
+    async def configure_destination(self, qmp, channels, compression):
+        capabilities = [{'capability': 'multifd', 'state': True},
+                        {'capability': 'events', 'state': True}]
+        if self.policy:
+            capabilities.append({'capability': 'postcopy-ram', 'state': True})
+        await qmp.execute('migrate-set-capabilities', {'capabilities': capabilities})
+        await qmp.execute('migrate-set-parameters', {
+            'multifd-channels': channels,
+            'multifd-compression': compression
+        })
+
+    def side_label(self, side):
+        return f"{self.label} {side}" if self.label else side
+
+    def mark_events(self, monitor, side):
+        """Turn a monitor's QMP events into timeline phases."""
+        switchover_seen = False
+        for offset, name, data in monitor.events:
+            at = monitor.start_time + offset
+            if name == 'MIGRATION_PASS':
+                self.mark(f"{side} pass {data.get('pass')}", at)
+            elif side == 'source' and data.get('status') in SWITCHOVER_STATES and not switchover_seen:
+                switchover_seen = True
+                self.mark(f"switchover ({data['status']})", at)
+            elif data.get('status') in monitor.TERMINAL:
+                self.mark(f"{side} {data['status']}", at)
+
+    async def run(self):
+        self.start_time = time.monotonic()
+        self.mark('start')
+        server, client, serve, forward = self.create_proxies()
+        proxy_tasks = [asyncio.create_task(serve()), asyncio.create_task(forward())]
+        clients = []
+        try:
+            if self.pool:
+                connect = [self.pool.get(self.source_qmp, self.side_label('source')),
+                           self.pool.get(self.destination_qmp, self.side_label('destination'))]
+            else:
+                clients = [QMPClient('source'), QMPClient('destination')]
+                connect = [clients[0].connect(self.source_qmp), clients[1].connect(self.destination_qmp)]
+            # Everything without a dependency comes up concurrently
+            connected = await asyncio.gather(*connect, self.wait_ready(server, proxy_tasks[0]),
+                                             self.wait_ready(client, proxy_tasks[1]))
+            source, destination = connected[:2] if self.pool else clients
+            self.source_client = source
+            self.mark('proxies and QMP ready')
+
+            channels, compression = await self.configure_source(source)
+            if self.postcopy is not None:
+                self.policy = PostcopyPolicy(source, **self.postcopy)
+                if not await self.policy.enable():
+                    self.policy = None
+            await self.configure_destination(destination, channels, compression)
+            self.mark('setup')
+
+            destination_monitor = MigrationMonitor(destination, self.sample_interval,
+                                                           label=self.side_label('destination'))
+            destination_monitor.start()
+            if os.path.exists(self.destination_socket):
+                os.unlink(self.destination_socket)  # Stale; would pass the readiness check below
+            await destination.execute('migrate-incoming', {'uri': f"unix:{self.destination_socket}"})
+            # QEMU binds the socket before migrate-incoming returns
+            if not os.path.exists(self.destination_socket):
+                raise RuntimeError(f"destination QEMU is not listening on {self.destination_socket}")
+            self.mark('tunnel-ready')
+
+            source_monitor = MigrationMonitor(source, self.sample_interval, label=self.side_label('source'))
+            source_monitor.start()
+            await source.execute('migrate', {'uri': f"unix:{self.source_socket}"})
+            self.mark('migrate issued')
+            tune_task = asyncio.create_task(self.tuner.follow(source_monitor)) if self.tuner else None
+            policy_task = asyncio.create_task(self.policy.follow(source_monitor)) if self.policy else None
+
+            source_snapshot, destination_snapshot = await asyncio.gather(
+                source_monitor.wait(), destination_monitor.wait())
+            if tune_task:
+                await tune_task
+            if policy_task:
+                await policy_task
+            self.mark_events(source_monitor, 'source')
+            self.mark_events(destination_monitor, 'destination')
+            self.mark('done')
+            self.timeline.sort()
+            return {
+                'transport': self.transport,
+                'timeline': [{'time': t, 'phase': phase} for t, phase in self.timeline],
+                'source': source_snapshot,
+                'destination': destination_snapshot,
+                'autotune': self.tuner.log if self.tuner else None,
+                'postcopy': self.policy.log if self.policy else None,
+            }
+        finally:
+            for qmp in clients:
+                await qmp.disconnect()
+            for task in proxy_tasks:
+                task.cancel()
+            await asyncio.gather(*proxy_tasks, return_exceptions=True)
+
+    def log_summary(self):
+        logger.info("=" * 60)
+        logger.info(f"MIGRATION PHASES ({self.transport}):")
+        previous = 0.0
+        for elapsed, phase in self.timeline:
+            logger.info(f"{elapsed:9.3f}s  +{(elapsed - previous) * 1000:9.1f} ms  {phase}")
+            previous = elapsed
+        logger.info("=" * 60)
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a proxied QEMU migration end to end and time each phase')
+    parser.add_argument('--source-qmp', default='/tmp/qemu-monitor-source.sock', help='Source QMP socket')
+    parser.add_argument('--destination-qmp', default='/tmp/qemu-monitor-dest.sock', help='Destination QMP socket')
+    parser.add_argument('--transport', choices=TRANSPORTS, default='tcp', help='Tunnel between the proxies')
+    parser.add_argument('--host', default='127.0.0.1', help='Address the destination proxy listens on')
+    parser.add_argument('--port', type=int, help='Destination proxy port (default 9999 tcp, 8766 websocket)')
+    parser.add_argument('--cert-dir', help='Certificates for the websocket transport')
+    parser.add_argument('--tls-profile', default='default', help='TLS profile for the websocket transport')
+    parser.add_argument('--multifd-channels', type=int, default=1, help='Channels when not autotuning')
+    parser.add_argument('--sample-interval', type=float, default=0.1, help='Seconds between query-migrate samples')
+    parser.add_argument('--autotune', action='store_true', help='Let MigrationAutotuner pick the parameters')
+    parser.add_argument('--link-rate', type=float, help='Link throughput in MB/s for the autotuner')
+    parser.add_argument('--probe', help='host:port of a TCP sink for the autotuner link probe')
+    parser.add_argument('--postcopy', action='store_true', help='Switch to postcopy if precopy stops converging')
+    parser.add_argument('--max-passes', type=int, default=10, help='Precopy passes before postcopy (with --postcopy)')
+    parser.add_argument('--max-precopy', type=float, help='Seconds of precopy before postcopy (with --postcopy)')
+    parser.add_argument('--export', help='Write the timeline and statistics to this JSON file')
+    args = parser.parse_args()
+
+    autotune = None
+    if args.autotune:
+        autotune = {}
+        if args.link_rate:
+            autotune['link_rate'] = args.link_rate * 1024 * 1024
+        if args.probe:
+            probe_host, probe_port = args.probe.rsplit(':', 1)
+            autotune['probe_address'] = (probe_host, int(probe_port))
+
+    postcopy = None
+    if args.postcopy:
+        postcopy = {'max_passes': args.max_passes, 'max_precopy_seconds': args.max_precopy}
+
+    orchestrator = MigrationOrchestrator(args.source_qmp, args.destination_qmp, args.transport, args.host,
+                                         args.port, cert_dir=args.cert_dir, tls_profile=args.tls_profile,
+                                         multifd_channels=args.multifd_channels,
+                                         sample_interval=args.sample_interval, autotune=autotune,
+                                         postcopy=postcopy)
+    result = asyncio.run(orchestrator.run())
+    orchestrator.log_summary()
+    if args.export:
+        with open(args.export, 'w') as f:
+            json.dump(result, f, indent=2)
+        logger.info(f"Timeline and statistics written to {args.export}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,747 @@
+#!/usr/bin/env python3
+"""QMP migration helpers shared by the unix-send-*/unix-receive-* scripts and the orchestrator.
+
+The migrate-websocket scripts import this module from ../migrate-proxy.
+"""
+import asyncio
+import json
+import array
+import bisect
+import math
+import os
+import socket
+import time
+from qemu.qmp import EventListener, QMPClient, Runstate
+
+class MigrationMonitor:
+    """Follow a migration through QMP events and high-rate query-migrate samples.
+
+    MIGRATION and MIGRATION_PASS events (needs the 'events' capability) report
+    status changes and new passes as they happen. In between, query-migrate is
+    sampled every sample_interval seconds into array-backed columns, from which
+    throughput, dirty rate and ETA are derived.
+    """
+    COLUMNS = ('time', 'transferred', 'remaining', 'total', 'throughput',
+               'dirty_rate', 'passes', 'expected_downtime')
+    TERMINAL = ('completed', 'failed', 'cancelled')
+
+    def __init__(self, qmp_client, sample_interval=0.1, report_interval=1.0, window=1.0, use_events=True,
+                 label=None):
+        self.qmp_client = qmp_client
+        self.prefix = f"{label} " if label else ''  # Tells monitors apart when several print
+        self.use_events = use_events  # False if the 'events' capability is not enabled
+        self.sample_interval = sample_interval
+        self.report_interval = report_interval
+        self.window = window  # Seconds of samples the throughput is averaged over
+        self.series = {name: array.array('d') for name in self.COLUMNS}
+        self.events = []  # (seconds since start, event name, event data)
+        self.status = 'none'
+        self.passes = 0
+        self.last_info = {}
+        self.start_time = time.monotonic()
+        self.done = asyncio.Event()
+        self.listener = EventListener(('MIGRATION', 'MIGRATION_PASS'))
+        self.tasks = []
+
+    def start(self):
+        """Register for events before 'migrate'/'migrate-incoming' so none are missed."""
+        self.qmp_client.register_listener(self.listener)
+        self.tasks = [asyncio.create_task(self.watch_events()), asyncio.create_task(self.watch_stats())]
+
+    async def wait(self):
+        """Wait for a terminal status, then return the final snapshot."""
+        await self.done.wait()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.qmp_client.remove_listener(self.listener)
+        self.log_summary()
+        return self.snapshot()
+
+    def elapsed(self):
+        return time.monotonic() - self.start_time
+
+    def set_status(self, status):
+        if status != self.status:
+            self.status = status
+            print(f"{self.prefix}[{self.elapsed():7.2f}s] Migration status: {status}")
+        if status in self.TERMINAL:
+            self.done.set()
+
+    async def watch_events(self):
+        waiter = asyncio.create_task(self.done.wait())
+        try:
+            while not self.done.is_set():
+                getter = asyncio.create_task(self.listener.get())
+                await asyncio.wait((getter, waiter), return_when=asyncio.FIRST_COMPLETED)
+                if not getter.done():
+                    getter.cancel()
+                    break
+                event = getter.result()
+                data = event.get('data', {})
+                self.events.append((self.elapsed(), event['event'], data))
+                if event['event'] == 'MIGRATION_PASS':
+                    self.passes = max(self.passes, data.get('pass', 0))
+                    print(f"{self.prefix}[{self.elapsed():7.2f}s] Pass {self.passes} started")
+                else:
+                    self.set_status(data.get('status', self.status))
+        finally:
+            waiter.cancel()
+
+    async def watch_stats(self):
+        next_report = 0.0
+        while not self.done.is_set():
+            await self.sample()
+            if self.elapsed() >= next_report:
+                self.report()
+                next_report = self.elapsed() + self.report_interval
+            try:
+                await asyncio.wait_for(self.done.wait(), self.sample_interval)
+            except asyncio.TimeoutError:
+                pass
+        # One more sample picks up total-time and downtime
+        await self.sample()
+
+    async def sample(self):
+        try:
+            info = await self.qmp_client.execute('query-migrate')
+        except Exception as e:
+            print(f"query-migrate failed: {e}")
+            if self.qmp_client.runstate != Runstate.RUNNING:
+                self.done.set()
+            return
+        self.last_info = info
+        now = self.elapsed()
+        ram = info.get('ram')
+        if ram:
+            series = self.series
+            transferred = ram.get('transferred', 0)
+            # Average over the window instead of QEMU's per-iteration 'mbps'
+            first = bisect.bisect_left(series['time'], now - self.window)
+            if first < len(series['time']) and now > series['time'][first]:
+                throughput = (transferred - series['transferred'][first]) / (now - series['time'][first])
+            else:
+                throughput = 0.0
+            self.passes = max(self.passes, ram.get('dirty-sync-count', 0))
+            row = (now, transferred, ram.get('remaining', 0), ram.get('total', 0), throughput,
+                   ram.get('dirty-pages-rate', 0) * ram.get('page-size', 4096),
+                   self.passes, info.get('expected-downtime', 0))
+            for name, value in zip(self.COLUMNS, row):
+                series[name].append(value)
+        # Events give the exact transitions; samples stand in without them
+        # and catch a terminal state whose event was missed
+        status = info.get('status', self.status)
+        if not self.use_events or status in self.TERMINAL:
+            self.set_status(status)
+
+    def latest(self, name):
+        column = self.series[name]
+        return column[-1] if column else 0.0
+
+    def eta(self):
+        """Seconds until remaining RAM reaches zero, or None if dirtying keeps up with sending."""
+        net_rate = self.latest('throughput') - self.latest('dirty_rate')
+        if net_rate <= 0:
+            return None
+        return self.latest('remaining') / net_rate
+
+    def converging(self):
+        """False once dirty rate has matched throughput across a full pass."""
+        return not (self.passes >= 2 and self.latest('dirty_rate') > 0 and self.eta() is None)
+
+    def report(self):
+        if self.status in ('none', 'setup') or not self.series['time']:
+            return
+        total = self.latest('total')
+        progress = (self.latest('transferred') / total * 100) if total else 0.0
+        eta = self.eta()
+        line = (f"{self.prefix}[{self.elapsed():7.2f}s] {progress:6.2f}% | "
+                f"{self.latest('throughput') / (1024 * 1024):8.2f} MB/s | "
+                f"dirty {self.latest('dirty_rate') / (1024 * 1024):8.2f} MB/s | "
+                f"pass {self.passes} | "
+                f"expected downtime {self.latest('expected_downtime'):.0f} ms | "
+                f"ETA {f'{eta:.1f}s' if eta is not None else 'n/a'}")
+        if not self.converging():
+            line += " | NOT CONVERGING"
+        print(line)
+
+    def snapshot(self):
+        """Summary plus the full time series, ready for json.dump()."""
+        info = self.last_info
+        return {
+            'status': self.status,
+            'elapsed': self.elapsed(),
+            'passes': self.passes,
+            'total_time_ms': info.get('total-time'),
+            'setup_time_ms': info.get('setup-time'),
+            'downtime_ms': info.get('downtime'),
+            'expected_downtime_ms': info.get('expected-downtime'),
+            'eta_s': self.eta(),
+            'converging': self.converging(),
+            'events': [{'time': t, 'event': name, 'data': data} for t, name, data in self.events],
+            'series': {name: column.tolist() for name, column in self.series.items()},
+        }
+
+    def export_json(self, path, extra=None):
+        snapshot = self.snapshot()
+        snapshot.update(extra or {})
+        with open(path, 'w') as f:
+            json.dump(snapshot, f, indent=2)
+        print(f"Migration statistics written to {path}")
+
+    def log_summary(self):
+        info = self.last_info
+        print("=" * 60)
+        print(f"{self.prefix}Migration {self.status} after {self.elapsed():.2f}s, {self.passes} passes")
+        if 'total-time' in info:
+            print(f"QEMU total time: {info['total-time']} ms | setup {info.get('setup-time', 0)} ms | "
+                  f"downtime {info.get('downtime', 'n/a')} ms")
+        if len(self.series['time']) > 1:
+            duration = self.series['time'][-1] - self.series['time'][0]
+            moved = self.series['transferred'][-1] - self.series['transferred'][0]
+            if duration > 0:
+                print(f"Average throughput: {moved / duration / (1024 * 1024):.2f} MB/s | "
+                      f"peak dirty rate: {max(self.series['dirty_rate']) / (1024 * 1024):.2f} MB/s")
+        print("=" * 60)
+
+def probe_link(address, seconds=3.0):
+    """Write to a TCP sink for `seconds` and return bytes/s over the second half, after buffers fill."""
+    chunk = memoryview(bytearray(1024 * 1024))
+    with socket.create_connection(address, timeout=10) as sock:
+        start_time = time.monotonic()
+        deadline = start_time + seconds
+        halfway = start_time + seconds / 2
+        bytes_sent = 0
+        mark = None
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            if mark is None and now >= halfway:
+                mark = (now, bytes_sent)
+            sock.sendall(chunk)
+            bytes_sent += len(chunk)
+    mark_time, mark_bytes = mark or (start_time, 0)
+    return (bytes_sent - mark_bytes) / (now - mark_time)
+
+async def measure_dirty_rate(qmp_client, seconds=1):
+    """Dirty rate in bytes/s from calc-dirty-rate, or 0 if this QEMU lacks it."""
+    try:
+        await qmp_client.execute('calc-dirty-rate', {'calc-time': seconds})
+        while True:
+            await asyncio.sleep(0.1)
+            result = await qmp_client.execute('query-dirty-rate')
+            if result.get('status') == 'measured':
+                return result.get('dirty-rate', 0) * 1024 * 1024  # Reported in MiB/s
+    except Exception as e:
+        print(f"calc-dirty-rate unavailable, assuming an idle guest: {e}")
+        return 0
+
+class MigrationAutotuner:
+    """Choose migration parameters from measurements, then keep adjusting them.
+
+    Before 'migrate', plan() combines link throughput (given, or probed against
+    a TCP sink), the guest dirty rate from calc-dirty-rate and the RAM size
+    into multifd-channels, multifd-compression, max-bandwidth and
+    downtime-limit. follow() then watches a MigrationMonitor and changes the
+    parameters QEMU accepts at runtime: max-bandwidth, downtime-limit and
+    avail-switchover-bandwidth. The channel count and compression are fixed
+    once the migration starts and must match on the destination.
+    """
+    CHANNEL_RATE = 1024 * 1024 * 1024  # Bytes/s one uncompressed multifd channel sustains
+    ZSTD_CHANNEL_RATE = 300 * 1024 * 1024  # Bytes/s of input one zstd channel compresses
+    COMPRESSION_LINK_RATE = 256 * 1024 * 1024  # Compress only on links slower than this
+    DEFAULT_LINK_RATE = 1250 * 1000 * 1000  # 10 Gbit/s when nothing is known
+    MAX_PASSES = 30  # Passes the downtime-limit is sized to converge within
+
+    def __init__(self, qmp_client, link_rate=None, probe_address=None, probe_seconds=3.0,
+                 dirty_rate_seconds=1, min_downtime=300, max_downtime=2000, max_channels=None):
+        self.qmp_client = qmp_client
+        self.link_rate = link_rate  # Bytes/s; probed or defaulted when None
+        self.probe_address = probe_address  # (host, port) of a TCP sink on the destination
+        self.probe_seconds = probe_seconds
+        self.dirty_rate_seconds = dirty_rate_seconds
+        self.min_downtime = min_downtime  # ms
+        self.max_downtime = max_downtime  # ms
+        self.max_channels = max_channels or os.cpu_count() or 1
+        self.parameters = {}  # Current values of the parameters we set
+        self.switchover_bandwidth = True  # Cleared if QEMU rejects avail-switchover-bandwidth
+        self.warned_postcopy = False
+        self.log = []  # {time since start, action, parameters, reason}
+        self.start_time = time.monotonic()
+
+    def record(self, action, parameters, reason):
+        elapsed = time.monotonic() - self.start_time
+        self.log.append({'time': elapsed, 'action': action, 'parameters': parameters, 'reason': reason})
+        print(f"[autotune {elapsed:7.2f}s] {action} {parameters}: {reason}")
+
+    async def plan(self):
+        """Measure the inputs and return the parameters to start the migration with."""
+        if self.link_rate is None and self.probe_address:
+            self.link_rate = await asyncio.get_running_loop().run_in_executor(
+                None, probe_link, self.probe_address, self.probe_seconds)
+            print(f"Probed link throughput: {self.link_rate / (1024 * 1024):.2f} MB/s")
+        link_rate = self.link_rate or self.DEFAULT_LINK_RATE
+        dirty_rate = await measure_dirty_rate(self.qmp_client, self.dirty_rate_seconds)
+        memory = await self.qmp_client.execute('query-memory-size-summary')
+        ram = memory.get('base-memory', 0) + memory.get('plugged-memory', 0)
+
+        # Compression trades CPU for wire bytes, which only pays on a slow link
+        compression = 'zstd' if link_rate < self.COMPRESSION_LINK_RATE else 'none'
+        channel_rate = self.ZSTD_CHANNEL_RATE if compression == 'zstd' else self.CHANNEL_RATE
+        channels = max(1, min(self.max_channels, math.ceil(link_rate / channel_rate)))
+
+        # Downtime that lets precopy converge within MAX_PASSES: each pass resends
+        # what was dirtied during the previous one, so pass n is ram * (dirty/link)^n
+        ratio = dirty_rate / link_rate
+        if ratio >= 1:
+            downtime = self.max_downtime
+        else:
+            final_pass = ram * ratio ** self.MAX_PASSES
+            downtime = min(self.max_downtime, max(self.min_downtime, math.ceil(final_pass / link_rate * 1000)))
+
+        plan = {
+            'multifd-channels': channels,
+            'multifd-compression': compression,
+            # Leave headroom above the measured rate; follow() raises it if it binds
+            'max-bandwidth': int(link_rate * 1.1),
+            'downtime-limit': downtime,
+        }
+        self.record('plan', plan,
+                    f"link {link_rate / (1024 * 1024):.1f} MB/s{'' if self.link_rate else ' (assumed)'}, "
+                    f"dirty {dirty_rate / (1024 * 1024):.1f} MB/s, RAM {ram / 2 ** 30:.1f} GiB"
+                    f"{', will not converge in precopy' if ratio >= 1 else ''}")
+        return plan
+
+    async def apply(self, plan):
+        """Enable multifd and the migration events, then set the planned parameters."""
+        await self.qmp_client.execute('migrate-set-capabilities', {
+            'capabilities': [{'capability': 'multifd', 'state': True},
+                             {'capability': 'events', 'state': True}]
+        })
+        await self.qmp_client.execute('migrate-set-parameters', plan)
+        self.parameters.update(plan)
+        print(f"Destination must use multifd-channels {plan['multifd-channels']} and "
+              f"multifd-compression {plan['multifd-compression']}")
+
+    async def set_parameters(self, parameters, reason):
+        try:
+            await self.qmp_client.execute('migrate-set-parameters', parameters)
+        except Exception as e:
+            print(f"migrate-set-parameters {parameters} failed: {e}")
+            return False
+        self.parameters.update(parameters)
+        self.record('adjust', parameters, reason)
+        return True
+
+    async def follow(self, monitor, interval=2.0):
+        """Adjust runtime parameters every interval seconds until the migration ends."""
+        while True:
+            try:
+                await asyncio.wait_for(monitor.done.wait(), interval)
+                return
+            except asyncio.TimeoutError:
+                pass
+            if monitor.status != 'active':
+                continue
+            await self.adjust(monitor)
+
+    async def adjust(self, monitor):
+        throughput = monitor.latest('throughput')
+        dirty_rate = monitor.latest('dirty_rate')
+        cap = self.parameters.get('max-bandwidth', 0)
+
+        # The link did better than probed: lift the cap so it is not the bottleneck
+        if cap and throughput >= 0.9 * cap:
+            await self.set_parameters({'max-bandwidth': int(cap * 1.5)},
+                                      f"throughput {throughput / (1024 * 1024):.1f} MB/s at the cap")
+
+        # QEMU estimates switchover time from its own bandwidth sample, which is
+        # skewed when multifd channels run through a proxy; give it the real rate
+        if self.switchover_bandwidth and monitor.passes >= 2 and throughput > 0:
+            current = self.parameters.get('avail-switchover-bandwidth', 0)
+            if abs(throughput - current) > 0.1 * throughput:
+                if not await self.set_parameters({'avail-switchover-bandwidth': int(throughput)},
+                                                 "measured throughput for the switchover estimate"):
+                    self.switchover_bandwidth = False
+
+        # Not converging: allow a longer final pass instead of looping forever
+        if not monitor.converging():
+            downtime = self.parameters.get('downtime-limit', self.min_downtime)
+            if downtime < self.max_downtime:
+                await self.set_parameters({'downtime-limit': min(self.max_downtime, int(downtime * 1.5))},
+                                          f"dirty {dirty_rate / (1024 * 1024):.1f} MB/s >= "
+                                          f"throughput {throughput / (1024 * 1024):.1f} MB/s")
+            elif not self.warned_postcopy:
+                self.warned_postcopy = True
+                self.record('warn', {'downtime-limit': downtime},
+                            "still not converging at the maximum downtime; consider postcopy")
+
+class PostcopyPolicy:
+    """Switch a precopy migration that will not converge to postcopy.
+
+    Precopy only finishes once a pass is small enough for the downtime limit;
+    a guest that dirties memory faster than the link sends it never gets
+    there. follow() watches a MigrationMonitor and issues
+    migrate-start-postcopy when one of these holds:
+      - the pass count reaches max_passes
+      - the dirty set at the start of each pass stopped shrinking over the
+        last trend_passes passes
+      - the dirty rate stayed at or above dirty_ratio x throughput for
+        sustain seconds
+      - precopy has run for max_precopy_seconds
+    The destination must have the postcopy-ram capability enabled as well.
+    """
+    def __init__(self, qmp_client, min_passes=2, max_passes=10, trend_passes=3, min_shrink=0.1,
+                 dirty_ratio=1.0, sustain=5.0, max_precopy_seconds=None):
+        self.qmp_client = qmp_client
+        self.min_passes = min_passes  # Never switch before this many passes
+        self.max_passes = max_passes
+        self.trend_passes = trend_passes
+        self.min_shrink = min_shrink  # Fraction the dirty set must shrink by per pass
+        self.dirty_ratio = dirty_ratio
+        self.sustain = sustain  # Seconds
+        self.max_precopy_seconds = max_precopy_seconds
+        self.enabled = False
+        self.triggered = False
+        self.saturated_since = None
+        self.log = []  # (seconds since migrate, decision, inputs, reason)
+
+    def record(self, decision, inputs, reason, elapsed):
+        self.log.append({'time': elapsed, 'decision': decision, 'inputs': inputs, 'reason': reason})
+        print(f"[postcopy {elapsed:7.2f}s] {decision}: {reason} {inputs}")
+
+    async def enable(self):
+        """Set the postcopy-ram capability; migrate in precopy only if QEMU refuses it."""
+        try:
+            await self.qmp_client.execute('migrate-set-capabilities', {
+                'capabilities': [{'capability': 'postcopy-ram', 'state': True}]
+            })
+        except Exception as e:
+            # QEMU before 10.0 rejects postcopy-ram together with multifd
+            print(f"postcopy-ram unavailable, migrating in precopy only: {e}")
+            return False
+        self.enabled = True
+        print("Postcopy enabled; switchover will be triggered if precopy stops converging")
+        return True
+
+    async def follow(self, monitor, interval=0.5):
+        """Evaluate the signals every interval seconds until postcopy starts or the migration ends."""
+        while self.enabled and not self.triggered:
+            try:
+                await asyncio.wait_for(monitor.done.wait(), interval)
+                return
+            except asyncio.TimeoutError:
+                pass
+            if monitor.status != 'active':
+                continue
+            reason = self.evaluate(monitor)
+            if reason:
+                await self.start_postcopy(monitor, reason)
+
+    def inputs(self, monitor):
+        return {
+            'passes': monitor.passes,
+            'remaining': int(monitor.latest('remaining')),
+            'throughput': int(monitor.latest('throughput')),
+            'dirty_rate': int(monitor.latest('dirty_rate')),
+            'pass_starts': [int(r) for r in self.pass_starts(monitor)[-self.trend_passes - 1:]],
+        }
+
+    def pass_starts(self, monitor):
+        """Remaining bytes at the first sample of each pass from pass 2; pass 1 sends all RAM."""
+        passes = monitor.series['passes']  # Never decreases, so it can be bisected
+        starts = []
+        for n in range(2, int(monitor.latest('passes')) + 1):
+            index = bisect.bisect_left(passes, n)
+            if index < len(passes) and passes[index] == n:
+                starts.append(monitor.series['remaining'][index])
+        return starts
+
+    def evaluate(self, monitor):
+        """Return why postcopy should start now, or None to keep precopy running."""
+        now = monitor.elapsed()
+        passes = monitor.passes
+
+        # Dirty rate against throughput, with hysteresis so one noisy sample does not count
+        throughput = monitor.latest('throughput')
+        dirty_rate = monitor.latest('dirty_rate')
+        if throughput > 0 and dirty_rate >= self.dirty_ratio * throughput:
+            if self.saturated_since is None:
+                self.saturated_since = now
+        else:
+            self.saturated_since = None
+
+        if self.max_precopy_seconds is not None and now >= self.max_precopy_seconds:
+            return f"precopy ran {now:.1f}s, limit {self.max_precopy_seconds}s"
+        if passes < self.min_passes:
+            return None
+        if passes >= self.max_passes:
+            return f"pass {passes} reached the limit of {self.max_passes}"
+
+        starts = self.pass_starts(monitor)
+        if len(starts) > self.trend_passes:
+            recent = starts[-self.trend_passes - 1:]
+            if all(later > earlier * (1 - self.min_shrink) for earlier, later in zip(recent, recent[1:])):
+                return (f"dirty set not shrinking by {self.min_shrink:.0%} per pass over "
+                        f"the last {self.trend_passes} passes")
+
+        if self.saturated_since is not None and now - self.saturated_since >= self.sustain:
+            return (f"dirty rate {dirty_rate / (1024 * 1024):.1f} MB/s >= {self.dirty_ratio:g} x throughput "
+                    f"{throughput / (1024 * 1024):.1f} MB/s for {now - self.saturated_since:.1f}s")
+        return None
+
+    async def start_postcopy(self, monitor, reason):
+        self.triggered = True
+        inputs = self.inputs(monitor)
+        try:
+            await self.qmp_client.execute('migrate-start-postcopy')
+        except Exception as e:
+            self.record('failed', inputs, f"migrate-start-postcopy: {e}", monitor.elapsed())
+            return
+        self.record('start-postcopy', inputs, reason, monitor.elapsed())
+
+class ConvergencePredictor:
+    """Predict how precopy will go before 'migrate', and decide whether to start it.
+
+    Precopy sends all RAM, then on every pass resends what the guest dirtied
+    during the previous one, until a pass fits in downtime-limit at the
+    migration's throughput. From the RAM size, the dirty rate (calc-dirty-rate)
+    and the link throughput (given, or probed against a TCP sink), preflight()
+    predicts pass count, transfer volume, total time and downtime for the
+    current parameters and each candidate. It applies the converging candidate
+    with the shortest downtime-limit (then the fastest), and otherwise returns
+    on_nonconvergence:
+      'postcopy'   - start in postcopy right away (destination needs postcopy-ram)
+      'reschedule' - do not migrate now; retry when the guest is quieter
+      'migrate'    - migrate in precopy anyway
+    """
+    ACTIONS = ('postcopy', 'reschedule', 'migrate')
+
+    def __init__(self, qmp_client, link_rate=None, probe_address=None, probe_seconds=3.0,
+                 dirty_rate_seconds=1, max_passes=30, candidates=None, on_nonconvergence='postcopy'):
+        if on_nonconvergence not in self.ACTIONS:
+            raise ValueError(f"on_nonconvergence must be one of {self.ACTIONS}")
+        self.qmp_client = qmp_client
+        self.link_rate = link_rate  # Bytes/s; probed or defaulted when None
+        self.probe_address = probe_address
+        self.probe_seconds = probe_seconds
+        self.dirty_rate_seconds = dirty_rate_seconds
+        self.max_passes = max_passes  # Passes after which precopy counts as not converging
+        # Parameter overrides to evaluate on top of the current ones; None picks a default set
+        self.candidates = candidates
+        self.on_nonconvergence = on_nonconvergence
+        self.report = {}
+
+    def default_candidates(self, current, link_rate):
+        """Lift a binding max-bandwidth, then trade longer downtime for convergence."""
+        uncapped = {}
+        if current.get('max-bandwidth') and current['max-bandwidth'] < link_rate:
+            uncapped = {'max-bandwidth': int(link_rate * 1.1)}
+        candidates = [uncapped] if uncapped else []
+        for downtime in (1000, 2000, 5000):
+            if downtime > current.get('downtime-limit', 300):
+                candidates.append({**uncapped, 'downtime-limit': downtime})
+        return candidates
+
+    def rate(self, link_rate, parameters):
+        """Throughput the parameters allow on this link; max-bandwidth 0 is unlimited."""
+        rate = min(link_rate, parameters.get('multifd-channels', 1) * MigrationAutotuner.CHANNEL_RATE)
+        if parameters.get('max-bandwidth'):
+            rate = min(rate, parameters['max-bandwidth'])
+        return rate
+
+    def predict(self, memory, dirty_rate, link_rate, parameters):
+        """Simulate the precopy passes for one set of parameters."""
+        rate = self.rate(link_rate, parameters)
+        switchover = rate * parameters.get('downtime-limit', 300) / 1000  # Bytes the final pass may hold
+        remaining, volume, elapsed = memory, 0.0, 0.0
+        for passes in range(1, self.max_passes + 1):
+            duration = remaining / rate
+            volume += remaining
+            elapsed += duration
+            remaining = min(memory, dirty_rate * duration)
+            if remaining <= switchover:
+                return {'parameters': parameters, 'converges': True, 'passes': passes + 1,
+                        'volume': volume + remaining, 'time': elapsed + remaining / rate,
+                        'downtime': remaining / rate * 1000}
+        return {'parameters': parameters, 'converges': False, 'passes': self.max_passes,
+                'volume': volume, 'time': elapsed, 'downtime': remaining / rate * 1000}
+
+    def predict_postcopy(self, memory, dirty_rate, link_rate, parameters):
+        """One precopy pass, then the pages dirtied during it once, with the guest already moved."""
+        rate = self.rate(link_rate, parameters)
+        volume = memory + min(memory, dirty_rate * memory / rate)
+        return {'parameters': parameters, 'converges': True, 'passes': 1, 'volume': volume,
+                'time': volume / rate, 'downtime': 0.0, 'postcopy': True}
+
+    def print_prediction(self, label, prediction):
+        print(f"  {label:<48} {'yes' if prediction['converges'] else 'NO ':>3} | "
+              f"{prediction['passes']:3d} passes | {prediction['volume'] / 2 ** 30:8.2f} GiB | "
+              f"{prediction['time']:8.1f}s | downtime {prediction['downtime']:8.0f} ms")
+
+    async def preflight(self):
+        """Measure, predict, apply the best candidate; return 'precopy' or the non-convergence action."""
+        if self.link_rate is None and self.probe_address:
+            self.link_rate = await asyncio.get_running_loop().run_in_executor(
+                None, probe_link, self.probe_address, self.probe_seconds)
+        link_rate = self.link_rate or MigrationAutotuner.DEFAULT_LINK_RATE
+        dirty_rate = await measure_dirty_rate(self.qmp_client, self.dirty_rate_seconds)
+        memory = await self.qmp_client.execute('query-memory-size-summary')
+        ram = memory.get('base-memory', 0) + memory.get('plugged-memory', 0)
+        current = await self.qmp_client.execute('query-migrate-parameters')
+
+        print(f"Pre-flight: RAM {ram / 2 ** 30:.2f} GiB | link {link_rate / (1024 * 1024):.1f} MB/s"
+              f"{'' if self.link_rate else ' (assumed)'} | dirty {dirty_rate / (1024 * 1024):.1f} MB/s")
+        candidates = self.candidates if self.candidates is not None else self.default_candidates(current, link_rate)
+        parameter_sets = [current] + [{**current, **c} for c in candidates]
+        predictions = [self.predict(ram, dirty_rate, link_rate, p) for p in parameter_sets]
+        # Postcopy needs no convergence, only the most throughput
+        fastest = max(parameter_sets, key=lambda p: self.rate(link_rate, p))
+        postcopy = self.predict_postcopy(ram, dirty_rate, link_rate, fastest)
+        self.print_prediction('current parameters', predictions[0])
+        for candidate, prediction in zip(candidates, predictions[1:]):
+            self.print_prediction(', '.join(f"{k} {v}" for k, v in candidate.items()), prediction)
+        self.print_prediction('postcopy after one pass', postcopy)
+
+        converging = [p for p in predictions if p['converges']]
+        best = min(converging, key=lambda p: (p['parameters'].get('downtime-limit', 300), p['time']), default=None)
+        self.report = {'memory': ram, 'link_rate': link_rate, 'dirty_rate': dirty_rate,
+                       'predictions': predictions, 'postcopy': postcopy, 'choice': best}
+        if best is None:
+            self.report['action'] = self.on_nonconvergence
+            print(f"Pre-flight: precopy is not predicted to converge within {self.max_passes} passes; "
+                  f"action: {self.on_nonconvergence}")
+            if self.on_nonconvergence == 'postcopy':
+                await self.apply(current, fastest)
+            return self.on_nonconvergence
+
+        await self.apply(current, best['parameters'])
+        print(f"Pre-flight: expect {best['passes']} passes, {best['volume'] / 2 ** 30:.2f} GiB, "
+              f"{best['time']:.1f}s, {best['downtime']:.0f} ms downtime")
+        self.report['action'] = 'precopy'
+        return 'precopy'
+
+    async def apply(self, current, parameters):
+        changes = {k: v for k, v in parameters.items() if current.get(k) != v}
+        if changes:
+            await self.qmp_client.execute('migrate-set-parameters', changes)
+            print(f"Pre-flight: applied {changes}")
+
+async def execute_and_monitor_migration(qmp_client, destination_uri, sample_interval=0.1, stats_path=None, tuner=None,
+                                        policy=None):
+    """
+    Execute the migration command and monitor its progress.
+    
+    Args:
+        qmp_client: An instance of QMPClient connected to the QEMU QMP socket.
+        destination_uri: The destination URI for migration.
+        sample_interval: Seconds between query-migrate samples.
+        stats_path: Optional path to export the statistics to as JSON.
+        tuner: Optional MigrationAutotuner that already applied its plan.
+        policy: Optional PostcopyPolicy; enabled here, after multifd, and followed.
+    """
+    if policy and not await policy.enable():
+        policy = None
+
+    # Listen for events before 'migrate' so the setup transition is not missed
+    monitor = MigrationMonitor(qmp_client, sample_interval)
+    monitor.start()
+
+    # Start migration
+    print(f"Starting migration to: {destination_uri}")
+    try:
+        migrate_result = await qmp_client.execute('migrate', {
+            'uri': destination_uri
+        })
+    except Exception:
+        monitor.done.set()
+        raise
+    print(f"Migration command result: {migrate_result}")
+    if tuner:
+        tune_task = asyncio.create_task(tuner.follow(monitor))
+    if policy:
+        policy_task = asyncio.create_task(policy.follow(monitor))
+    
+    # Monitor migration progress
+    snapshot = await monitor.wait()
+    if tuner:
+        await tune_task
+    if policy:
+        await policy_task
+    if snapshot['status'] == 'completed':
+        print("Migration completed successfully!")
+    elif snapshot['status'] == 'failed':
+        print("Migration failed!")
+    elif snapshot['status'] == 'cancelled':
+        print("Migration was cancelled!")
+    if stats_path:
+        monitor.export_json(stats_path, {'autotune': tuner.log if tuner else None,
+                                         'postcopy': policy.log if policy else None})
+
+async def migrate_vm(qmp_socket_path, destination_uri, multifd_channels=1, sample_interval=0.1, stats_path=None,
+                     autotune=None, postcopy=None, preflight=None):
+    """
+    Migrate a QEMU VM to destination_uri: configure multifd, run the pre-flight
+    prediction against those parameters, then migrate and monitor.
+    
+    Args:
+        qmp_socket_path: Path to QEMU QMP socket
+        destination_uri: The destination URI for migration
+        multifd_channels: multifd-channels for the fixed setup; must match the destination
+        sample_interval: Seconds between query-migrate samples
+        stats_path: Optional path to export migration statistics to as JSON
+        autotune: MigrationAutotuner keyword arguments, or None for the fixed multifd setup
+        postcopy: PostcopyPolicy keyword arguments, or None to migrate in precopy only
+        preflight: ConvergencePredictor keyword arguments, or None to skip the prediction
+    """
+    qmp_client = QMPClient()
+    
+    try:
+        # Connect to QEMU QMP socket
+        await qmp_client.connect(qmp_socket_path)
+        
+        print(f"Connected to QMP socket: {qmp_socket_path}")
+        
+        # Check VM status
+        result = await qmp_client.execute('query-status')
+        print(f"VM Status: {result}")
+        
+        tuner = None
+        if autotune is None:
+            # Enable multifd migration capability
+            print("Enabling multifd migration capability and migration events")
+            await qmp_client.execute('migrate-set-capabilities', {
+                'capabilities': [{'capability': 'multifd', 'state': True},
+                                 {'capability': 'events', 'state': True}]
+            })
+
+            # Configure migration parameters; must match the destination
+            print(f"Setting migration multifd channels to {multifd_channels}...")
+            await qmp_client.execute('migrate-set-parameters', {
+                'multifd-channels': multifd_channels
+            })
+        else:
+            tuner = MigrationAutotuner(qmp_client, **autotune)
+            await tuner.apply(await tuner.plan())
+        
+        print("Migration parameters configured successfully")
+        
+        policy = PostcopyPolicy(qmp_client, **postcopy) if postcopy is not None else None
+        
+        if preflight is not None:
+            if tuner and tuner.link_rate:
+                preflight = {'link_rate': tuner.link_rate, **preflight}
+            action = await ConvergencePredictor(qmp_client, **preflight).preflight()
+            if action == 'reschedule':
+                print("Migration not started; reschedule it when the guest dirties less memory")
+                return
+            if action == 'postcopy':
+                # Switch as soon as the first pass is under way
+                policy = PostcopyPolicy(qmp_client, **{**(postcopy or {}), 'min_passes': 1, 'max_passes': 1})
+        
+        # Execute and monitor migration
+        await execute_and_monitor_migration(qmp_client, destination_uri, sample_interval, stats_path, tuner, policy)
+            
+    except Exception as e:
+        print(f"Error during migration: {e}")
+    finally:
+        await qmp_client.disconnect()
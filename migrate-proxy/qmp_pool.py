@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""Long-lived QMP connections shared by everything that talks to the same VMs.
+
+A QMPSession keeps one QMPClient per VM socket and can be passed wherever the
+migration scripts take a connected QMPClient: MigrationMonitor,
+MigrationAutotuner, PostcopyPolicy, ConvergencePredictor and the
+orchestrator all only use execute(), register_listener(), remove_listener()
+and runstate. Commands from several consumers are multiplexed on the one
+connection, event listeners survive reconnects, and a token bucket per
+session (plus an optional one for the whole pool) caps the command rate each
+QEMU monitor sees. QMPSessionPool hands out one session per socket path.
+"""
+import asyncio
+import logging
+import time
+from qemu.qmp import QMPClient, Runstate, ExecInterruptedError, StateError
+
+logger = logging.getLogger(__name__)
+
+class RateLimiter:
+    """Token bucket: `rate` acquisitions per second, bursts of up to `burst`."""
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()  # Waiters are served in order
+        self.throttled = 0.0  # Seconds callers spent waiting
+
+    async def acquire(self):
+        async with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                delay = (1 - self.tokens) / self.rate
+                self.throttled += delay
+                await asyncio.sleep(delay)
+                self.tokens = 1
+                self.updated = time.monotonic()
+            self.tokens -= 1
+
+class QMPSession:
+    """One QMP connection to a VM, kept open, shared and reconnected on loss."""
+    RETRY_PREFIXES = ('query-',)  # Read-only; safe to send again after a reconnect
+
+    def __init__(self, address, name=None, rate=20.0, burst=None, pool_limiter=None,
+                 connect_timeout=30.0, reconnect_delay=0.1, max_reconnect_delay=5.0):
+        self.address = address
+        self.name = name or address
+        self.client = QMPClient(self.name)
+        self.limiter = RateLimiter(rate, burst) if rate else None
+        self.pool_limiter = pool_limiter
+        self.connect_timeout = connect_timeout  # Seconds execute() waits for a reconnect
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.connected = asyncio.Event()
+        self.closed = False
+        self.tasks = []
+        self.commands = 0
+        self.retries = 0
+        self.events = 0
+        self.reconnects = 0
+
+    @property
+    def runstate(self):
+        """RUNNING for as long as the session is open, including while it reconnects."""
+        return Runstate.IDLE if self.closed else Runstate.RUNNING
+
+    async def start(self):
+        """Connect for the first time; failures here are raised, later ones are retried."""
+        await self.client.connect(self.address)
+        self.connected.set()
+        self.tasks = [asyncio.create_task(self.supervise()), asyncio.create_task(self.drain_events())]
+
+    async def supervise(self):
+        while not self.closed:
+            if self.client.runstate != Runstate.DISCONNECTING:
+                await self.client.runstate_changed()
+                continue
+            self.connected.clear()
+            try:
+                await self.client.disconnect()
+            except Exception as e:
+                logger.warning(f"{self.name}: QMP connection lost: {e!r}")
+            await self.reconnect()
+
+    async def reconnect(self):
+        delay = self.reconnect_delay
+        while not self.closed:
+            try:
+                await self.client.connect(self.address)
+            except Exception as e:
+                logger.warning(f"{self.name}: reconnect failed, retrying in {delay:.1f}s: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+                continue
+            self.reconnects += 1
+            self.connected.set()
+            logger.info(f"{self.name}: QMP reconnected")
+            return
+
+    async def drain_events(self):
+        """Empty the client's catch-all event queue, which would otherwise grow for the whole session."""
+        while True:
+            await self.client.events.get()
+            self.events += 1
+
+    async def wait_connected(self):
+        if self.closed:
+            raise StateError(f"QMP session {self.name} is closed", self.client.runstate, Runstate.RUNNING)
+        try:
+            await asyncio.wait_for(self.connected.wait(), self.connect_timeout)
+        except asyncio.TimeoutError:
+            raise ConnectionError(f"{self.name}: not reconnected within {self.connect_timeout}s") from None
+
+    async def execute(self, cmd, arguments=None):
+        for attempt in (1, 2):
+            if self.pool_limiter:
+                await self.pool_limiter.acquire()
+            if self.limiter:
+                await self.limiter.acquire()
+            await self.wait_connected()
+            self.commands += 1
+            try:
+                return await self.client.execute(cmd, arguments)
+            except (ExecInterruptedError, StateError, ConnectionError, EOFError):
+                if self.client.runstate != Runstate.RUNNING:
+                    self.connected.clear()  # Before supervise() notices, so the retry waits
+                if attempt == 2 or self.closed or not cmd.startswith(self.RETRY_PREFIXES):
+                    raise
+                self.retries += 1
+                logger.info(f"{self.name}: {cmd} interrupted by a disconnect, retrying")
+
+    def register_listener(self, listener):
+        # Listeners belong to the client object, which is reused across reconnects
+        self.client.register_listener(listener)
+
+    def remove_listener(self, listener):
+        self.client.remove_listener(listener)
+
+    def send_fd_scm(self, fd):
+        self.client.send_fd_scm(fd)
+
+    async def close(self):
+        self.closed = True
+        self.connected.clear()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        try:
+            await self.client.disconnect()
+        except Exception:
+            pass
+
+    def stats(self):
+        return {
+            'address': self.address,
+            'commands': self.commands,
+            'retries': self.retries,
+            'events': self.events,
+            'reconnects': self.reconnects,
+            'throttled_s': self.limiter.throttled if self.limiter else 0.0,
+        }
+
+class QMPSessionPool:
+    """One QMPSession per socket path, created on first use and kept until close()."""
+    def __init__(self, rate=20.0, burst=None, max_rate=None, **session_options):
+        self.rate = rate  # Commands/s per VM; None for no limit
+        self.burst = burst
+        self.limiter = RateLimiter(max_rate) if max_rate else None  # Commands/s over all VMs
+        self.session_options = session_options
+        self.sessions = {}
+        self.starting = {}
+
+    async def get(self, address, name=None):
+        """Return the session for `address`, connecting it if this is the first request."""
+        if address not in self.sessions:
+            self.sessions[address] = QMPSession(address, name, self.rate, self.burst, self.limiter,
+                                                **self.session_options)
+            self.starting[address] = asyncio.create_task(self.sessions[address].start())
+        try:
+            # Concurrent first requests share the one connect
+            await asyncio.shield(self.starting[address])
+        except Exception:
+            self.sessions.pop(address, None)
+            self.starting.pop(address, None)
+            raise
+        return self.sessions[address]
+
+    async def close(self):
+        await asyncio.gather(*(session.close() for session in self.sessions.values()))
+        self.sessions.clear()
+        self.starting.clear()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def stats(self):
+        return {
+            'sessions': [session.stats() for session in self.sessions.values()],
+            'throttled_s': self.limiter.throttled if self.limiter else 0.0,
+        }
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""Evacuate many VMs through the migration tunnel under a shared bandwidth budget.
+
+Each VM is migrated by a MigrationOrchestrator with its own proxy pair, so
+both QEMU instances of every VM must be reachable from this host. Before
+anything moves, every source is measured (RAM, dirty rate) and
+ConvergencePredictor estimates its precopy time at its share of the budget;
+the VMs are then queued by policy and run `concurrency` at a time. Whenever a
+migration starts or finishes, max-bandwidth is rebalanced so the active
+migrations split the budget between them. All QMP traffic for a VM, from
+measurement through monitoring and rebalancing, shares one pooled session.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+from orchestrate import MigrationOrchestrator, TRANSPORTS
+from qmp_migration import ConvergencePredictor, measure_dirty_rate
+from qmp_pool import QMPSessionPool
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Queue orders: predicted precopy time ascending (small, idle VMs first),
+# descending (longest first, to keep the tail short), or the order given
+POLICIES = ('smallest-first', 'largest-first', 'given')
+
+class ScheduledVM:
+    def __init__(self, index, spec):
+        self.index = index
+        self.name = spec['name']
+        self.source_qmp = spec['source_qmp']
+        self.destination_qmp = spec['destination_qmp']
+        self.multifd_channels = spec.get('multifd_channels', 1)
+        self.memory = 0
+        self.dirty_rate = 0
+        self.parameters = {}
+        self.prediction = None
+        self.orchestrator = None
+        self.result = None
+        self.status = 'queued'
+        self.started = None  # Seconds since the evacuation started
+        self.finished = None
+
+class MigrationScheduler:
+    def __init__(self, vms, bandwidth, concurrency=2, policy='smallest-first', transport='tcp',
+                 host='127.0.0.1', base_port=None, cert_dir=None, tls_profile='default',
+                 sample_interval=0.5, postcopy=False, qmp_rate=20.0):
+        if policy not in POLICIES:
+            raise ValueError(f"policy must be one of {POLICIES}")
+        self.vms = [ScheduledVM(i, spec) for i, spec in enumerate(vms)]
+        self.bandwidth = bandwidth  # Bytes/s shared by all active migrations
+        self.concurrency = max(1, concurrency)
+        self.policy = policy
+        self.transport = transport
+        self.host = host
+        self.base_port = base_port or TRANSPORTS[transport][3]
+        self.cert_dir = cert_dir
+        self.tls_profile = tls_profile
+        self.sample_interval = sample_interval
+        self.postcopy = postcopy  # Start non-converging VMs in postcopy instead of skipping them
+        self.predictor = ConvergencePredictor(None)
+        self.pool = QMPSessionPool(rate=qmp_rate)
+        self.active = []
+        self.start_time = None
+
+    def elapsed(self):
+        return time.monotonic() - self.start_time
+
+    async def measure(self, vm):
+        qmp = await self.pool.get(vm.source_qmp, f"{vm.name} source")
+        vm.dirty_rate = await measure_dirty_rate(qmp)
+        memory = await qmp.execute('query-memory-size-summary')
+        vm.memory = memory.get('base-memory', 0) + memory.get('plugged-memory', 0)
+        vm.parameters = await qmp.execute('query-migrate-parameters')
+
+    async def plan(self):
+        """Measure every source concurrently, predict each at its budget share, and order the queue."""
+        await asyncio.gather(*(self.measure(vm) for vm in self.vms))
+        share = self.bandwidth / min(self.concurrency, len(self.vms))
+        for vm in self.vms:
+            parameters = {**vm.parameters, 'multifd-channels': vm.multifd_channels, 'max-bandwidth': int(share)}
+            vm.prediction = self.predictor.predict(vm.memory, vm.dirty_rate, share, parameters)
+            if not vm.prediction['converges']:
+                vm.prediction = {**self.predictor.predict_postcopy(vm.memory, vm.dirty_rate, share, parameters),
+                                 'converges': False}
+
+        if self.policy == 'given':
+            order = list(self.vms)
+        else:
+            reverse = self.policy == 'largest-first'
+            # Non-converging VMs go last either way, so they cannot hold up the others
+            order = sorted(self.vms, key=lambda vm: vm.prediction['time'], reverse=reverse)
+            order.sort(key=lambda vm: not vm.prediction['converges'])
+
+        logger.info(f"Plan: {len(self.vms)} VMs, {self.bandwidth / (1024 * 1024):.1f} MB/s, "
+                    f"{self.concurrency} at a time, {self.policy}")
+        for position, vm in enumerate(order, 1):
+            p = vm.prediction
+            logger.info(f"  {position:3d}. {vm.name:<20} RAM {vm.memory / 2 ** 30:6.2f} GiB | "
+                        f"dirty {vm.dirty_rate / (1024 * 1024):7.1f} MB/s | "
+                        f"{'precopy' if p['converges'] else 'no convergence'} {p['time']:7.1f}s")
+        return order
+
+    async def rebalance(self):
+        """Split the budget evenly over the active migrations."""
+        if not self.active:
+            return
+        share = int(self.bandwidth / len(self.active))
+        await asyncio.gather(*(vm.orchestrator.set_max_bandwidth(share) for vm in self.active))
+        logger.info(f"[{self.elapsed():8.2f}s] {len(self.active)} active, max-bandwidth "
+                    f"{share / (1024 * 1024):.1f} MB/s each")
+
+    async def migrate(self, vm):
+        postcopy = None
+        if self.postcopy:
+            # Non-converging VMs switch during their first pass; the rest keep it as a fallback
+            postcopy = {} if vm.prediction['converges'] else {'min_passes': 1, 'max_passes': 1}
+        elif not vm.prediction['converges']:
+            vm.status = 'rescheduled'
+            logger.info(f"{vm.name}: not predicted to converge; skipped, rerun with --postcopy or later")
+            return
+
+        vm.orchestrator = MigrationOrchestrator(
+            vm.source_qmp, vm.destination_qmp, self.transport, self.host, self.base_port + vm.index,
+            source_socket=f"/tmp/qemu_migration_source-{vm.name}.sock",
+            destination_socket=f"/tmp/qemu_migration_dest-{vm.name}.sock",
+            cert_dir=self.cert_dir, tls_profile=self.tls_profile, multifd_channels=vm.multifd_channels,
+            sample_interval=self.sample_interval, postcopy=postcopy, label=vm.name,
+            pool=self.pool)
+        vm.started = self.elapsed()
+        vm.status = 'migrating'
+        self.active.append(vm)
+        await self.rebalance()
+        try:
+            vm.result = await vm.orchestrator.run()
+            vm.status = vm.result['source']['status']
+        except Exception as e:
+            logger.error(f"{vm.name}: migration failed: {e}")
+            vm.status = 'error'
+        finally:
+            vm.finished = self.elapsed()
+            self.active.remove(vm)
+            logger.info(f"[{vm.finished:8.2f}s] {vm.name} {vm.status} after {vm.finished - vm.started:.1f}s")
+            await self.rebalance()
+
+    async def worker(self, queue):
+        while not queue.empty():
+            await self.migrate(queue.get_nowait())
+
+    async def run(self):
+        async with self.pool:
+            order = await self.plan()
+            queue = asyncio.Queue()
+            for vm in order:
+                queue.put_nowait(vm)
+            self.start_time = time.monotonic()
+            await asyncio.gather(*(self.worker(queue) for _ in range(min(self.concurrency, len(order)))))
+            total = self.elapsed()
+            qmp_stats = self.pool.stats()
+        return {
+            'bandwidth': self.bandwidth,
+            'concurrency': self.concurrency,
+            'policy': self.policy,
+            'evacuation_time': total,
+            'qmp': qmp_stats,
+            'vms': [{
+                'name': vm.name,
+                'order': order.index(vm) + 1,
+                'memory': vm.memory,
+                'dirty_rate': vm.dirty_rate,
+                'prediction': vm.prediction,
+                'status': vm.status,
+                'started': vm.started,
+                'finished': vm.finished,
+                'downtime_ms': vm.result['source']['downtime_ms'] if vm.result else None,
+                'migration': vm.result,
+            } for vm in order],
+        }
+
+    def log_summary(self, result):
+        logger.info("=" * 60)
+        logger.info(f"EVACUATION ({result['policy']}, {result['concurrency']} at a time): "
+                    f"{result['evacuation_time']:.1f}s")
+        for entry in result['vms']:
+            duration = (f"{entry['finished'] - entry['started']:7.1f}s" if entry['started'] is not None
+                        else '      -')
+            logger.info(f"  {entry['order']:3d}. {entry['name']:<20} {entry['status']:<12} {duration} "
+                        f"(predicted {entry['prediction']['time']:7.1f}s) "
+                        f"downtime {entry['downtime_ms'] if entry['downtime_ms'] is not None else '-'} ms")
+        logger.info("=" * 60)
+
+def main():
+    parser = argparse.ArgumentParser(description='Migrate a list of VMs under a shared bandwidth and concurrency budget')
+    parser.add_argument('vms', help='JSON list of {"name", "source_qmp", "destination_qmp"[, "multifd_channels"]}')
+    parser.add_argument('--bandwidth', type=float, required=True, help='Host bandwidth budget in MB/s')
+    parser.add_argument('--concurrency', type=int, default=2, help='Migrations in flight at once (default: 2)')
+    parser.add_argument('--policy', choices=POLICIES, default='smallest-first', help='Queue order')
+    parser.add_argument('--postcopy', action='store_true',
+                        help='Start non-converging VMs in postcopy (and fall back to it for the rest) '
+                             'instead of skipping them')
+    parser.add_argument('--transport', choices=TRANSPORTS, default='tcp', help='Tunnel between the proxies')
+    parser.add_argument('--host', default='127.0.0.1', help='Address the destination proxies listen on')
+    parser.add_argument('--base-port', type=int, help='First proxy port; VM n uses base + n')
+    parser.add_argument('--cert-dir', help='Certificates for the websocket transport')
+    parser.add_argument('--tls-profile', default='default', help='TLS profile for the websocket transport')
+    parser.add_argument('--qmp-rate', type=float, default=20.0, help='QMP commands/s per VM (default: 20)')
+    parser.add_argument('--sample-interval', type=float, default=0.5, help='Seconds between query-migrate samples')
+    parser.add_argument('--export', help='Write the plan, timings and statistics to this JSON file')
+    args = parser.parse_args()
+
+    with open(args.vms) as f:
+        vms = json.load(f)
+    scheduler = MigrationScheduler(vms, args.bandwidth * 1024 * 1024, args.concurrency, args.policy,
+                                   args.transport, args.host, args.base_port, args.cert_dir, args.tls_profile,
+                                   args.sample_interval, args.postcopy, args.qmp_rate)
+    result = asyncio.run(scheduler.run())
+    scheduler.log_summary(result)
+    if args.export:
+        with open(args.export, 'w') as f:
+            json.dump(result, f, indent=2)
+        logger.info(f"Plan and statistics written to {args.export}")
+
+if __name__ == "__main__":
+    main()
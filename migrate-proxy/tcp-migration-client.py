@@ -39,6 +39,7 @@ class MigrationTCPClient:
         self.unix_socket_path = unix_socket_path or '/tmp/qemu_migration_source.sock'
         self.connection_counter = 0
         self.read_histogram = defaultdict(int)  # Track histogram of bytes read
+        self.ready = asyncio.Event()  # Set once QEMU can connect to the unix socket
         
     async def connect_and_forward(self):
         """Create unix socket server and handle multiple QEMU connections."""
@@ -56,6 +57,7 @@ class MigrationTCPClient:
             
             logger.info(f"Unix socket server started at {self.unix_socket_path}")
             logger.info("Waiting for QEMU connections...")
+            self.ready.set()
             
             # Serve the unix socket
             async with unix_server:
@@ -42,6 +42,7 @@ class MigrationTCPServer:
         self.server = None
         self.connection_counter = 0
         self.read_histogram = defaultdict(int)  # Track histogram of bytes read
+        self.ready = asyncio.Event()  # Set once the server is listening
         
     async def handle_client(self, reader, writer):
         """Handle incoming TCP connection and forward to unix socket."""
@@ -205,6 +206,7 @@ class MigrationTCPServer:
         addr = self.server.sockets[0].getsockname()
         logger.info(f"Migration TCP server listening on {addr[0]}:{addr[1]}")
         logger.info(f"Will connect to unix socket at: {self.unix_socket_path}")
+        self.ready.set()
         
         async with self.server:
             await self.server.serve_forever()
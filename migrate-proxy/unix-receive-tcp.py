@@ -2,53 +2,43 @@ import asyncio
 import tempfile
 import os
 from qemu.qmp import QMPClient
+from qmp_migration import MigrationMonitor
 
 #!/usr/bin/env python3
 
-async def monitor_incoming_migration(qmp_client):
+async def monitor_incoming_migration(monitor, stats_path=None):
     """
     Monitor the incoming migration progress.
     
     Args:
-        qmp_client: An instance of QMPClient connected to the QEMU QMP socket.
+        monitor: A MigrationMonitor started before migrate-incoming was issued.
+        stats_path: Optional path to export the statistics to as JSON.
     """
     print("Monitoring incoming migration...")
     
-    while True:
-        migration_info = await qmp_client.execute('query-migrate')
-        status = migration_info.get('status', 'unknown')
-        
-        print(f"Migration status: {status}")
-        
-        if status == 'completed':
-            print("Migration received successfully!")
-            break
-        elif status == 'failed':
-            print("Migration reception failed!")
-            break
-        elif status == 'cancelled':
-            print("Migration was cancelled!")
-            break
-        elif status == 'active':
-            # Show progress if available
-            if 'ram' in migration_info:
-                ram_info = migration_info['ram']
-                transferred = ram_info.get('transferred', 0)
-                total = ram_info.get('total', 0)
-                if total > 0:
-                    progress = (transferred / total) * 100
-                    print(f"Migration progress: {progress:.2f}%")
-        
-        # Wait before checking again
-        await asyncio.sleep(1)
+    snapshot = await monitor.wait()
+    if snapshot['status'] == 'completed':
+        print("Migration received successfully!")
+    elif snapshot['status'] == 'failed':
+        print("Migration reception failed!")
+    elif snapshot['status'] == 'cancelled':
+        print("Migration was cancelled!")
+    if stats_path:
+        monitor.export_json(stats_path)
 
-async def setup_incoming_migration_tcp_forwarded(qmp_socket_path, tcp_unix_socket_path=None):
+async def setup_incoming_migration_tcp_forwarded(qmp_socket_path, tcp_unix_socket_path=None, sample_interval=0.1, stats_path=None,
+                                                 multifd_channels=1, multifd_compression='none', postcopy=False):
     """
     Setup QEMU VM to receive incoming migration over TCP-forwarded unix socket.
     
     Args:
         qmp_socket_path: Path to QEMU QMP socket
         tcp_unix_socket_path: Path to unix socket that receives from TCP
+        sample_interval: Seconds between query-migrate samples
+        stats_path: Optional path to export migration statistics to as JSON
+        multifd_channels: Must match the source (its autotune plan, if used)
+        multifd_compression: Must match the source as well
+        postcopy: Enable postcopy-ram, required when the source may switch to postcopy
     """
     
     if tcp_unix_socket_path is None:
@@ -71,29 +61,46 @@ async def setup_incoming_migration_tcp_forwarded(qmp_socket_path, tcp_unix_socke
         print(f"VM Status: {result}")
 
          # Enable multifd migration capability
-        print("Enabling multifd migration capability")
+        print("Enabling multifd migration capability and migration events")
         await qmp_client.execute('migrate-set-capabilities', {
-            'capabilities': [{'capability': 'multifd', 'state': True}]
+            'capabilities': [{'capability': 'multifd', 'state': True},
+                             {'capability': 'events', 'state': True}]
         })
         
         # Configure migration parameters for destination
-        print("Setting migration multfd channels to 2 on destination...")
+        print(f"Setting migration multifd channels to {multifd_channels} "
+              f"and compression to {multifd_compression} on destination...")
         await qmp_client.execute('migrate-set-parameters', {
-            'multifd-channels': 1
+            'multifd-channels': multifd_channels,
+            'multifd-compression': multifd_compression
         })
         
         
         print("Migration parameters configured on destination")
         
+        if postcopy:
+            print("Enabling postcopy-ram capability")
+            await qmp_client.execute('migrate-set-capabilities', {
+                'capabilities': [{'capability': 'postcopy-ram', 'state': True}]
+            })
+        
+        # Listen for events before 'migrate-incoming' so the setup transition is not missed
+        monitor = MigrationMonitor(qmp_client, sample_interval)
+        monitor.start()
+        
         # Setup incoming migration
         print(f"Setting up incoming migration from: {incoming_uri}")
-        migrate_incoming_result = await qmp_client.execute('migrate-incoming', {
-            'uri': incoming_uri
-        })
+        try:
+            migrate_incoming_result = await qmp_client.execute('migrate-incoming', {
+                'uri': incoming_uri
+            })
+        except Exception:
+            monitor.done.set()
+            raise
         print(f"Migrate-incoming command result: {migrate_incoming_result}")
         
         # Monitor the incoming migration
-        await monitor_incoming_migration(qmp_client)
+        await monitor_incoming_migration(monitor, stats_path)
             
     except Exception as e:
         print(f"Error during incoming migration setup: {e}")
@@ -107,7 +114,19 @@ async def main():
     # TCP-forwarded unix socket path (created by tcp-migration-server.py)
     tcp_unix_socket = "/tmp/qemu_migration_dest.sock"
     
-    await setup_incoming_migration_tcp_forwarded(qmp_socket, tcp_unix_socket)
+    # query-migrate sampling period, and where to export the statistics (None to skip)
+    sample_interval = 0.1
+    stats_path = None
+    
+    # Must match the source; copy them from its autotune plan when autotuning
+    multifd_channels = 1
+    multifd_compression = 'none'
+    
+    # True when the source sets postcopy
+    postcopy = False
+    
+    await setup_incoming_migration_tcp_forwarded(qmp_socket, tcp_unix_socket, sample_interval, stats_path,
+                                                 multifd_channels, multifd_compression, postcopy)
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -14,11 +14,42 @@ SERVER_CSR="x509-server.csr"
 # Certificate validity period (in days)
 VALIDITY_DAYS=365
 
+# Key algorithm: rsa2048, rsa3072, rsa4096 (default), ecdsa-p256, ecdsa-p384, ed25519
+# Usage: ./cert-gen.sh [key-type]   or   KEY_TYPE=ecdsa-p256 ./cert-gen.sh
+KEY_TYPE="${1:-${KEY_TYPE:-rsa4096}}"
+case "$KEY_TYPE" in
+    rsa2048|rsa3072|rsa4096)
+        GENPKEY_OPTS="-algorithm RSA -pkeyopt rsa_keygen_bits:${KEY_TYPE#rsa}"
+        DIGEST_OPT="-sha256"
+        KEY_USAGE="digitalSignature, keyEncipherment"
+        ;;
+    ecdsa-p256)
+        GENPKEY_OPTS="-algorithm EC -pkeyopt ec_paramgen_curve:P-256"
+        DIGEST_OPT="-sha256"
+        KEY_USAGE="digitalSignature"
+        ;;
+    ecdsa-p384)
+        GENPKEY_OPTS="-algorithm EC -pkeyopt ec_paramgen_curve:P-384"
+        DIGEST_OPT="-sha384"
+        KEY_USAGE="digitalSignature"
+        ;;
+    ed25519)
+        # Ed25519 signs the message directly and takes no digest option
+        GENPKEY_OPTS="-algorithm ED25519"
+        DIGEST_OPT=""
+        KEY_USAGE="digitalSignature"
+        ;;
+    *)
+        echo "Unknown key type: $KEY_TYPE" >&2
+        exit 1
+        ;;
+esac
+
 # Certificate subject information
 CA_SUBJECT="/C=US/ST=CA/L=San Francisco/O=Test CA/CN=Test CA"
 SERVER_SUBJECT="/C=US/ST=CA/L=San Francisco/O=Test Server/CN=localhost"
 
-echo "Generating certificates and keys for TLS server..."
+echo "Generating $KEY_TYPE certificates and keys for TLS server..."
 
 # Clean up existing certificates
 echo "Cleaning up existing certificates..."
@@ -26,26 +57,26 @@ rm -f $CA_KEY $CA_CERT $SERVER_KEY $SERVER_CERT $SERVER_CSR
 
 # Generate CA private key
 echo "Generating CA private key..."
-openssl genrsa -out $CA_KEY 4096
+openssl genpkey $GENPKEY_OPTS -out $CA_KEY
 
 # Generate CA certificate
 echo "Generating CA certificate..."
-openssl req -new -x509 -days $VALIDITY_DAYS -key $CA_KEY -out $CA_CERT \
+openssl req -new -x509 -days $VALIDITY_DAYS -key $CA_KEY $DIGEST_OPT -out $CA_CERT \
     -subj "$CA_SUBJECT"
 
 # Generate server private key
 echo "Generating server private key..."
-openssl genrsa -out $SERVER_KEY 4096
+openssl genpkey $GENPKEY_OPTS -out $SERVER_KEY
 
 # Generate server certificate signing request
 echo "Generating server certificate signing request..."
-openssl req -new -key $SERVER_KEY -out $SERVER_CSR \
+openssl req -new -key $SERVER_KEY $DIGEST_OPT -out $SERVER_CSR \
     -subj "$SERVER_SUBJECT"
 
 # Create extensions file for server certificate
 cat > server_extensions.conf << EOF
 [v3_req]
-keyUsage = keyEncipherment, dataEncipherment
+keyUsage = critical, $KEY_USAGE
 extendedKeyUsage = serverAuth
 subjectAltName = @alt_names
 
@@ -59,7 +90,7 @@ EOF
 # Generate server certificate signed by CA
 echo "Generating server certificate signed by CA..."
 openssl x509 -req -in $SERVER_CSR -CA $CA_CERT -CAkey $CA_KEY \
-    -CAcreateserial -out $SERVER_CERT -days $VALIDITY_DAYS \
+    -CAcreateserial -out $SERVER_CERT -days $VALIDITY_DAYS $DIGEST_OPT \
     -extensions v3_req -extfile server_extensions.conf
 
 # Clean up temporary files
@@ -83,7 +114,7 @@ echo "CA Certificate:"
 openssl x509 -in $CA_CERT -text -noout | grep -E "(Subject:|Not Before|Not After)"
 echo ""
 echo "Server Certificate:"
-openssl x509 -in $SERVER_CERT -text -noout | grep -E "(Subject:|Issuer:|Not Before|Not After|DNS:|IP Address:)"
+openssl x509 -in $SERVER_CERT -text -noout | grep -E "(Subject:|Issuer:|Not Before|Not After|Public Key Algorithm|DNS:|IP Address:)"
 echo ""
 echo "To verify the server certificate against the CA:"
 echo "openssl verify -CAfile $CA_CERT $SERVER_CERT"
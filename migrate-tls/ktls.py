@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""kTLS helpers shared by qemu-send.py, qemu-rec.py and tls-bench.py: the kTLS probe and the relays."""
+import fcntl
+import os
+import socket
+import ssl
+import struct
+
+RELAY_CHUNK = 1 << 20  # Bytes per splice or recv in the relays
+
+# Not exported by Python's socket module (linux/socket.h, linux/tls.h)
+SOL_TLS = 282
+TLS_TX = 1
+TLS_RX = 2
+TCP_ULP = 31
+TLS_CIPHER_TYPES = {
+    51: 'AES-GCM-128', 52: 'AES-GCM-256', 53: 'AES-CCM-128', 54: 'CHACHA20-POLY1305',
+    55: 'SM4-GCM', 56: 'SM4-CCM', 57: 'ARIA-GCM-128', 58: 'ARIA-GCM-256',
+}
+
+# return the kernel cipher for one direction of the socket, or None while the
+# keys are still in userspace; the tls_crypto_info header (version, cipher
+# type) is only readable once the kernel holds them
+def ktls_cipher(sock, direction):
+    try:
+        _, cipher_type = struct.unpack('HH', sock.getsockopt(SOL_TLS, direction, 4))
+    except OSError:
+        return None
+    return TLS_CIPHER_TYPES.get(cipher_type, f"cipher {cipher_type}")
+
+def ktls_active(sock, direction):
+    return ktls_cipher(sock, direction) is not None
+
+# kernel-wide kTLS counters; empty if the tls module is not loaded
+def read_tls_stat():
+    try:
+        with open('/proc/net/tls_stat') as f:
+            return {name: int(value) for name, value in (line.split() for line in f)}
+    except OSError:
+        return {}
+
+# report the negotiated TLS session and whether the kernel took each direction.
+# A socket whose direction is still in userspace must not be handed to QEMU:
+# QEMU would read or write the raw fd and bypass the TLS session.
+def probe_ktls(sock):
+    try:
+        ulp = sock.getsockopt(socket.IPPROTO_TCP, TCP_ULP, 16).rstrip(b'\0').decode()
+    except OSError:
+        ulp = ''
+    cipher = sock.cipher() if isinstance(sock, ssl.SSLSocket) else None
+    status = {
+        'version': cipher[1] if cipher else None,
+        'cipher': cipher[0] if cipher else None,
+        'ulp': ulp,
+        'tx': ktls_cipher(sock, TLS_TX),
+        'rx': ktls_cipher(sock, TLS_RX),
+        'tls_stat': read_tls_stat(),
+    }
+    counters = ' '.join(f"{name}={value}" for name, value in status['tls_stat'].items()
+                        if name.startswith('TlsCurr'))
+    print(f"kTLS probe fd {sock.fileno()}: {status['version'] or '-'} {status['cipher'] or '-'} | "
+          f"ULP {ulp or 'none'} | TX {status['tx'] or 'userspace'} | RX {status['rx'] or 'userspace'} | "
+          f"{counters or '/proc/net/tls_stat unavailable'}")
+    return status
+
+# probe a socket known only by its fd, e.g. one passed in over /tmp/fd_socket
+def probe_ktls_fd(fd):
+    with socket.socket(fileno=os.dup(fd)) as sock:
+        return probe_ktls(sock)
+
+# copy source_fd to destination_fd through a pipe until EOF, without the data
+# entering userspace; kTLS encrypts on the way into a TLS socket and decrypts
+# on the way out of one
+def splice_relay(source_fd, destination_fd):
+    read_end, write_end = os.pipe()
+    try:
+        fcntl.fcntl(write_end, fcntl.F_SETPIPE_SZ, RELAY_CHUNK)
+    except OSError:
+        pass  # Above /proc/sys/fs/pipe-max-size; the default pipe size still works
+    total = 0
+    try:
+        while True:
+            count = os.splice(source_fd, write_end, RELAY_CHUNK)
+            if count == 0:
+                return total
+            total += count
+            while count:
+                count -= os.splice(read_end, destination_fd, count)
+    finally:
+        os.close(read_end)
+        os.close(write_end)
+
+# userspace fallback: recv/sendall through the socket objects, so an SSLSocket
+# without kTLS still encrypts and decrypts
+def copy_relay(source, destination):
+    buffer = bytearray(RELAY_CHUNK)
+    view = memoryview(buffer)
+    total = 0
+    while True:
+        count = source.recv_into(buffer)
+        if count == 0:
+            return total
+        destination.sendall(view[:count])
+        total += count
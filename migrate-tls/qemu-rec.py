@@ -1,56 +1,129 @@
 import asyncio
 import socket
+from socket import SHUT_RDWR  # upgrade_to_tls() shadows the socket module
 from qemu.qmp import QMPClient
 import json
 import ssl
 import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from ktls import TLS_RX, copy_relay, ktls_active, probe_ktls, probe_ktls_fd, splice_relay
+# TLS profiles shared with the migrate-websocket proxies
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'migrate-websocket'))
+from websocket_common import apply_tls_profile
 MIGRATE_URI = "tcp:0:4444"
 SERVER_PORT = 4444
+TLS_PROFILE = "default"  # See TLS_PROFILES in ../migrate-websocket/websocket_common.py; kTLS supports AES-GCM and ChaCha20-Poly1305
+# multifd channels, must match the sender; 0 hands a single kTLS socket to QEMU
+# as fd:migfd. With N > 0, 1 + N kTLS connections are accepted and spliced onto
+# QEMU's main and multifd channels in the kernel (see migrate_incoming_multifd)
+MULTIFD_CHANNELS = 0
+RELAY_SOCKET = "/tmp/qemu-ktls-relay.sock"  # Where QEMU listens for its channels in multifd mode
+ACCEPT_TIMEOUT = 30  # Seconds to accept and handshake all expected channels
 
-# upgrade a tcp socket.socket object to tls and enable ktls
-async def upgrade_to_tls(socket):
+# create the server TLS context with kTLS requested
+def create_tls_context():
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    # ssl context set option SSL_OP_ENABLE_KTLS
+    # Python < 3.12 cannot ask OpenSSL for kTLS; probe_ktls reports the fallback
+    context.options |= getattr(ssl, 'OP_ENABLE_KTLS', 0)  # Enable KTLS support
+    # load the certificate and key files
+    context.load_cert_chain("/etc/pki/qemu/server-cert.pem", "/etc/pki/qemu/server-key.pem")
+    print("Loaded default certificates for TLS context")
+    apply_tls_profile(context, TLS_PROFILE)
+    # No TLS 1.3 session tickets: nothing resumes these sessions, and a sender
+    # closing with a ticket unread resets the connection, dropping data in flight
+    context.num_tickets = 0
+    return context
+
+# upgrade an accepted tcp socket.socket object to tls and enable ktls. The
+# handshake blocks, so it runs in the executor while the event loop goes on
+# accepting the other channels; it may take until deadline (loop time)
+async def upgrade_to_tls(socket, context, executor, deadline):
+    loop = asyncio.get_running_loop()
+    handshake = None
     try:
-        # Upgrade the socket to TLS
-        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
-        # ssl context set option SSL_OP_ENABLE_KTLS
-        context.options |= ssl.OP_ENABLE_KTLS  # Enable KTLS support
-        # load the certificate and key files
-        context.load_cert_chain("/etc/pki/qemu/server-cert.pem", "/etc/pki/qemu/server-key.pem")
-        print("Loaded default certificates for TLS context")
-        # Wrap the socket with SSL
-        socket = context.wrap_socket(socket)
-        print(f"Upgraded socket to TLS with KTLS enabled")
-        # ssl wrap socket with 
+        # sock_accept hands out non-blocking sockets; the handshake thread needs a blocking one
+        socket.settimeout(max(deadline - loop.time(), 0.001))
+        socket = context.wrap_socket(socket, server_side=True, do_handshake_on_connect=False)
+        handshake = executor.submit(socket.do_handshake)
+        await asyncio.wrap_future(handshake)
+        socket.settimeout(None)
+        print(f"Upgraded socket fd {socket.fileno()} to TLS")
+        probe_ktls(socket)
         return socket  # Return the upgraded socket
+    except asyncio.CancelledError:
+        # server() gave up: wake the handshake thread, and close the socket once it lets go
+        try:
+            socket.shutdown(SHUT_RDWR)
+        except OSError:
+            pass
+        if handshake is None:
+            socket.close()
+        else:
+            handshake.add_done_callback(lambda _: socket.close())
+        raise
     except Exception as e:
         print(f"Error upgrading socket to TLS: {e}")
+        socket.close()
         return None
 
-# create a tcp sever to listen on the port 4444
-async def server(host="0", port=SERVER_PORT):
+# create a tcp sever to listen on the port 4444 and accept count TLS connections
+# concurrently, returned in the order they were accepted. Gives up after
+# timeout seconds unless every connection has been accepted and handshaked.
+async def server(host="0", port=SERVER_PORT, count=1, timeout=ACCEPT_TIMEOUT):
+    loop = asyncio.get_running_loop()
     # Create a TCP socket
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     server_socket.set_inheritable(True)
-    
+    accepted = []
+    handshakes = []
+    deadline = loop.time() + timeout
+    # Outside the timed region: shutting it down must not wait for stalled handshakes
+    executor = ThreadPoolExecutor(max_workers=count)
+
+    async def accept_all(context):
+        for _ in range(count):
+            client_socket, client_address = await loop.sock_accept(server_socket)
+            print(f"Accepted connection from {client_address}, socketfd {client_socket.fileno()}")
+            accepted.append(client_socket)
+            handshakes.append(asyncio.ensure_future(upgrade_to_tls(client_socket, context, executor, deadline)))
+        return await asyncio.gather(*handshakes)
+
+    client_sockets = None
     try:
+        context = create_tls_context()
         # Bind the socket to address and port
         server_socket.bind((host, port))
-        
-        # Start listening (max 1 pending connections)
-        server_socket.listen(1)
-        print(f"Server listening on {host}:{port}")
-        # Upgrade the client socket to TLS
-        server_socket = await upgrade_to_tls(server_socket)
-        client_socket, client_address = server_socket.accept()
-        print(f"Accepted connection from {client_address}, socketfd {client_socket}")
-        return client_socket
+        # Start listening (one pending connection per expected channel)
+        server_socket.listen(count)
+        server_socket.setblocking(False)
+        print(f"Server listening on {host}:{port} for {count} channel(s)")
+        client_sockets = await asyncio.wait_for(accept_all(context), deadline - loop.time())
+    except asyncio.TimeoutError:
+        ready = [h for h in handshakes if h.done() and not h.cancelled() and h.result()]
+        print(f"Within {timeout}s: accepted {len(handshakes)} of {count} channel(s), "
+              f"{len(ready)} finished the TLS handshake")
     except Exception as e:
         print(f"Error creating server socket: {e}")
+    finally:
         print("Closing server socket")
         server_socket.close()
+        executor.shutdown(wait=False)
+
+    if client_sockets is None or None in client_sockets:
+        # A channel is missing; the rest are useless to QEMU. Handshakes cut off
+        # by the timeout close their own sockets; accepted sockets whose
+        # handshake never started are closed here (wrapped ones are detached)
+        for handshake in handshakes:
+            if handshake.done() and not handshake.cancelled() and handshake.result():
+                handshake.result().close()
+        for client_socket in accepted:
+            client_socket.close()
         return None
-        
+    return client_sockets
+
 
 # functtion to add fd to qemu using qmp command
 async def qemu_add_fd(qemp, socketfd):
@@ -94,6 +167,76 @@ async def migrate_incoming_fd(qemp, socket_fd):
         print(f"Error during migration: {e}")
         await qemp.disconnect()
 
+# forward one TLS connection into its QEMU migration channel until the sender closes it
+def relay_channel(index, tls_socket, qemu_socket):
+    if ktls_active(tls_socket, TLS_RX):
+        total = splice_relay(tls_socket.fileno(), qemu_socket.fileno())
+    else:
+        # Splicing from the raw fd would hand QEMU ciphertext; decrypt in userspace instead
+        print(f"Channel {index}: kTLS RX not active, relaying through userspace TLS")
+        total = copy_relay(tls_socket, qemu_socket)
+    qemu_socket.shutdown(socket.SHUT_WR)
+    return total
+
+# receive over 1 + N TLS connections. QEMU only listens for multifd channels on
+# inet/unix/vsock addresses, not on fd: sockets, so the kTLS sockets cannot be
+# given to QEMU directly. Instead QEMU listens on RELAY_SOCKET and one
+# connection per TLS connection is made to it, in accept order, so the main
+# channel (the sender's first connection) reaches QEMU first. Each pair is
+# spliced in its own thread.
+async def migrate_incoming_multifd(qemp, tls_channels):
+    loop = asyncio.get_running_loop()
+    await qemp.execute('migrate-set-capabilities', {
+        'capabilities': [{'capability': 'multifd', 'state': True}]
+    })
+    await qemp.execute('migrate-set-parameters', {'multifd-channels': len(tls_channels) - 1})
+
+    if os.path.exists(RELAY_SOCKET):
+        os.unlink(RELAY_SOCKET)
+    margs = {"channels": [{
+        "channel-type": "main",
+        "addr": {"transport": "socket", "type": "unix", "path": RELAY_SOCKET},
+    }]}
+    print(f"Executing migrate-incoming with payload: {margs}")
+    totals = None
+    qemu_sockets = []
+    executor = ThreadPoolExecutor(max_workers=len(tls_channels))
+    try:
+        # QEMU is listening on RELAY_SOCKET once this returns
+        res = await qemp.execute("migrate-incoming", margs)
+        print(res)
+        relays = []
+        for index, tls_socket in enumerate(tls_channels):
+            qemu_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            qemu_socket.connect(RELAY_SOCKET)
+            qemu_sockets.append(qemu_socket)
+            print(f"Channel {index} connected, relaying from TLS connection fd {tls_socket.fileno()}")
+            relays.append(loop.run_in_executor(executor, relay_channel, index, tls_socket, qemu_socket))
+        totals = await asyncio.gather(*relays)
+    except Exception as e:
+        print(f"Error during migration: {e}")
+    finally:
+        if totals is None:
+            # Relays still running only end when their sockets do, so wake them
+            for channel in qemu_sockets + tls_channels:
+                try:
+                    channel.shutdown(SHUT_RDWR)
+                except OSError:
+                    pass
+        executor.shutdown(wait=True)
+        for channel in qemu_sockets + tls_channels:
+            channel.close()
+
+    if totals:
+        for index, total in enumerate(totals):
+            print(f"Channel {index} ({'main' if index == 0 else 'multifd'}): {total} bytes")
+        # QEMU is still loading the last data the relays handed it
+        res = await qemp.execute('query-migrate')
+        while res.get('status') in ('setup', 'active', 'postcopy-active'):
+            await asyncio.sleep(0.5)
+            res = await qemp.execute('query-migrate')
+        print(f"Migration status: {res.get('status')}")
+
 
 async def main(fd):
     qemp = QMPClient("test-vm")
@@ -111,15 +254,33 @@ async def main(fd):
         'max-bandwidth': 107374182400  # 100GB/s in bytes per second
     })
     
+    if MULTIFD_CHANNELS:
+        tls_channels = await server("0", SERVER_PORT, 1 + MULTIFD_CHANNELS)
+        if not tls_channels:
+            print("Failed to accept the TLS channels.")
+        else:
+            await migrate_incoming_multifd(qemp, tls_channels)
+        await qemp.disconnect()
+        return
+
     if fd is None:
-        socket = await server("0", SERVER_PORT)
-        if not socket:
+        sockets = await server("0", SERVER_PORT)
+        if not sockets:
             print("Failed to create server socket.")
-        else:
-            socket = socket.fileno()
+            await qemp.disconnect()
+            return
+        socket = sockets[0].fileno()
+        ktls_rx = ktls_active(sockets[0], TLS_RX)  # Probed in server
     else:
         socket = fd
         print(f"Using provided file descriptor: {socket}")
+        ktls_rx = probe_ktls_fd(socket)['rx']
+
+    # QEMU reads the migration stream straight from the socket
+    if not ktls_rx:
+        print("kTLS RX is not active on the migration socket; QEMU would read TLS records, exiting.")
+        await qemp.disconnect()
+        return
 
     fdset = await qemu_add_fd(qemp, socket)
     await migrate_incoming_fd(qemp, fdset)
@@ -163,9 +324,12 @@ def receive_fd():
         os.unlink(socket_path)
 
 if __name__ == "__main__":
-    fd = receive_fd()
-    if fd is not None:
-        print(f"Received file descriptor: {fd}")
-    else:
-        print("Failed to receive file descriptor.")
+    fd = None
+    # A single passed-in socket cannot carry multifd; the channels are accepted here instead
+    if not MULTIFD_CHANNELS:
+        fd = receive_fd()
+        if fd is not None:
+            print(f"Received file descriptor: {fd}")
+        else:
+            print("Failed to receive file descriptor.")
     asyncio.run(main(fd))
\ No newline at end of file
@@ -4,11 +4,24 @@ import json
 import socket
 import ssl
 import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from ktls import TLS_TX, copy_relay, ktls_active, probe_ktls, probe_ktls_fd, splice_relay
+# TLS profiles shared with the migrate-websocket proxies
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'migrate-websocket'))
+from websocket_common import apply_tls_profile
 
 MIGRATE_URI = "tcp:10.117.28.118:4444"
 DESTINATION_IP = "10.117.28.118"
 DESTION_PORT = 4444
 DESTINATION_HOST = "nested-ahv"
+TLS_PROFILE = "default"  # See TLS_PROFILES in ../migrate-websocket/websocket_common.py; kTLS supports AES-GCM and ChaCha20-Poly1305
+# multifd channels; 0 hands a single kTLS socket to QEMU as fd:migfd. With N > 0,
+# 1 + N kTLS connections are opened and QEMU's main and multifd channels are
+# spliced onto them in the kernel (see migrate_multifd)
+MULTIFD_CHANNELS = 0
+RELAY_SOCKET = "/tmp/qemu-ktls-relay.sock"  # Where QEMU connects its channels in multifd mode
+ACCEPT_TIMEOUT = 30  # Seconds to wait for each of QEMU's channel connections
 
 
 # upgrade a tcp socket.socket object to tls and enable ktls
@@ -18,8 +31,10 @@ async def upgrade_to_tls(socket):
         context = ssl.create_default_context()
         context.check_hostname = False  # Disable hostname checking for simplicity
         # ssl context set option SSL_OP_ENABLE_KTLS
-        context.options |= ssl.OP_ENABLE_KTLS  # Enable KTLS support
+        # Python < 3.12 cannot ask OpenSSL for kTLS; probe_ktls reports the fallback
+        context.options |= getattr(ssl, 'OP_ENABLE_KTLS', 0)  # Enable KTLS support
         context.verify_mode = ssl.CERT_NONE  # Disable certificate verification for simplicity
+        apply_tls_profile(context, TLS_PROFILE)
         # Wrap the socket with SSL
         socket = context.wrap_socket(socket, server_hostname=DESTINATION_HOST)
         print(f"Upgraded socket to TLS with KTLS enabled")
@@ -40,11 +55,101 @@ async def create_tcp_client(host=DESTINATION_IP, port=DESTION_PORT):
     try:
         client_socket.connect((host, port))
         print(f"Connected to {host}:{port}")
+        probe_ktls(client_socket)
         return client_socket
     except Exception as e:
         print(f"Error connecting to {host}:{port}: {e}")
         return None
 
+# open count TLS connections to the destination, in order: the main channel first
+async def create_tls_channels(count, host=DESTINATION_IP, port=DESTION_PORT):
+    channels = []
+    for index in range(count):
+        client_socket = await create_tcp_client(host, port)
+        if not client_socket:
+            print(f"Failed to open TLS channel {index}")
+            for channel in channels:
+                channel.close()
+            return None
+        channels.append(client_socket)
+    return channels
+
+# forward one QEMU migration channel into its TLS connection until QEMU closes it
+def relay_channel(index, qemu_socket, tls_socket):
+    if ktls_active(tls_socket, TLS_TX):
+        total = splice_relay(qemu_socket.fileno(), tls_socket.fileno())
+    else:
+        # Splicing into the raw fd would send plaintext; encrypt in userspace instead
+        print(f"Channel {index}: kTLS TX not active, relaying through userspace TLS")
+        total = copy_relay(qemu_socket, tls_socket)
+    tls_socket.shutdown(socket.SHUT_WR)
+    qemu_socket.close()
+    return total
+
+# migrate over 1 + N TLS connections. QEMU only opens multifd channels to
+# inet/unix/vsock addresses, not to fd: sockets, and fdsets are only usable
+# for file: migration, so the kTLS sockets cannot be given to QEMU directly.
+# Instead QEMU connects its main and multifd channels to RELAY_SOCKET, and each
+# accepted connection is spliced onto its own kTLS connection in its own thread.
+# The main channel connects first and is paired with the first TLS connection,
+# which the destination also accepts first.
+async def migrate_multifd(qemp, tls_channels):
+    loop = asyncio.get_running_loop()
+    await qemp.execute('migrate-set-capabilities', {
+        'capabilities': [{'capability': 'multifd', 'state': True}]
+    })
+    await qemp.execute('migrate-set-parameters', {'multifd-channels': len(tls_channels) - 1})
+
+    if os.path.exists(RELAY_SOCKET):
+        os.unlink(RELAY_SOCKET)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(RELAY_SOCKET)
+    listener.listen(len(tls_channels))
+    listener.setblocking(False)
+
+    margs = {"channels": [{
+        "channel-type": "main",
+        "addr": {"transport": "socket", "type": "unix", "path": RELAY_SOCKET},
+    }]}
+    print(f"Executing migrate with payload: {margs}")
+    totals = None
+    qemu_sockets = []
+    executor = ThreadPoolExecutor(max_workers=len(tls_channels))
+    try:
+        res = await qemp.execute("migrate", margs)
+        print(res)
+        relays = []
+        for index, tls_socket in enumerate(tls_channels):
+            qemu_socket, _ = await asyncio.wait_for(loop.sock_accept(listener), ACCEPT_TIMEOUT)
+            qemu_socket.setblocking(True)
+            qemu_sockets.append(qemu_socket)
+            print(f"Channel {index} connected, relaying to TLS connection fd {tls_socket.fileno()}")
+            relays.append(loop.run_in_executor(executor, relay_channel, index, qemu_socket, tls_socket))
+        totals = await asyncio.gather(*relays)
+    except asyncio.TimeoutError:
+        print(f"QEMU opened fewer than {len(tls_channels)} channels within {ACCEPT_TIMEOUT}s")
+    except Exception as e:
+        print(f"Error during migration: {e}")
+    finally:
+        if totals is None:
+            # A migration missing a channel never closes the others, so wake their relays
+            for channel in qemu_sockets + tls_channels:
+                try:
+                    channel.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        executor.shutdown(wait=True)
+        listener.close()
+        os.unlink(RELAY_SOCKET)
+        for channel in qemu_sockets + tls_channels:
+            channel.close()
+
+    if totals:
+        for index, total in enumerate(totals):
+            print(f"Channel {index} ({'main' if index == 0 else 'multifd'}): {total} bytes")
+        res = await qemp.execute('query-migrate')
+        print(f"Migration status: {res.get('status')}")
+
 # run the qmp migrate command with payload-
 # {
 #   "execute": "migrate",
@@ -106,16 +211,33 @@ async def main(fd = None):
         'max-bandwidth': 107374182400  # 100GB/s in bytes per second
     })
 
+    if MULTIFD_CHANNELS:
+        tls_channels = await create_tls_channels(1 + MULTIFD_CHANNELS, DESTINATION_IP, DESTION_PORT)
+        if not tls_channels:
+            print("Failed to open the TLS channels, exiting.")
+        else:
+            await migrate_multifd(qemp, tls_channels)
+        await qemp.disconnect()
+        return
+
     if fd is None:
-        client_socket = await create_tcp_client(DESTINATION_IP, DESTION_PORT)
-        if not client_socket:
+        tls_socket = await create_tcp_client(DESTINATION_IP, DESTION_PORT)
+        if not tls_socket:
             print("Failed to create TCP client, exiting.")
             return
         else:
-            client_socket = client_socket.fileno()
+            client_socket = tls_socket.fileno()
+            ktls_tx = ktls_active(tls_socket, TLS_TX)  # Probed in create_tcp_client
     else:
         client_socket = fd
         print(f"Using provided file descriptor: {client_socket}")
+        ktls_tx = probe_ktls_fd(client_socket)['tx']
+
+    # QEMU writes the migration stream straight into the socket
+    if not ktls_tx:
+        print("kTLS TX is not active on the migration socket; QEMU would send plaintext, exiting.")
+        await qemp.disconnect()
+        return
 
     fdset = await qemu_add_fd(qemp, client_socket)
     # Now perform the migration
@@ -164,9 +286,12 @@ def receive_fd():
 
 
 if __name__ == "__main__":
-    fd = receive_fd()
-    if fd is not None:
-        print(f"Received file descriptor: {fd}")
-    else:
-        print("Failed to receive file descriptor.")
+    fd = None
+    # A single passed-in socket cannot carry multifd; the channels are opened here instead
+    if not MULTIFD_CHANNELS:
+        fd = receive_fd()
+        if fd is not None:
+            print(f"Received file descriptor: {fd}")
+        else:
+            print("Failed to receive file descriptor.")
     asyncio.run(main(fd))
\ No newline at end of file
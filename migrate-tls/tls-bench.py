@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+"""Compare QEMU native TLS, userspace Python TLS and kTLS fd hand-off over loopback.
+
+Every run starts a fresh source and destination QEMU (or mock-qemu.py with
+--mock) on this host and migrates once:
+  native     QEMU encrypts itself: tls-creds-x509 objects and the tls-creds parameter
+  userspace  QEMU migrates over unix sockets and this process relays the stream
+             through an SSLSocket pair, encrypting and decrypting in userspace
+  ktls       a kTLS socket pair is handed to the two QEMUs with getfd and used
+             as fd:migfd, as qemu-send.py/qemu-rec.py do
+Throughput comes from the source's query-migrate. CPU is counted per GB sent
+for both QEMU processes, for this process (the userspace relay) and for the
+whole host (/proc/stat), which also catches softirq and kworker time.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import shutil
+import socket
+import ssl
+import sys
+import tempfile
+import time
+from qemu.qmp import QMPClient
+from ktls import copy_relay, probe_ktls, read_tls_stat
+# TLS profiles shared with the migrate-websocket proxies
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'migrate-websocket'))
+from websocket_common import TLS_PROFILES, apply_tls_profile
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MODES = ('native', 'userspace', 'ktls')
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+def process_cpu(pid):
+    """utime + stime of a process and all its threads, in seconds."""
+    with open(f'/proc/{pid}/stat') as f:
+        # The command name may contain spaces; the fields after it are fixed
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+def host_busy():
+    """Busy CPU seconds of the whole host since boot."""
+    with open('/proc/stat') as f:
+        ticks = [int(value) for value in f.readline().split()[1:]]
+    idle = ticks[3] + ticks[4]  # idle + iowait
+    return (sum(ticks[:8]) - idle) / CLOCK_TICKS
+
+def self_cpu():
+    times = os.times()
+    return times.user + times.system
+
+class VM:
+    """One QEMU (or mock) process and its QMP connection."""
+    def __init__(self, name, command, qmp_path, log_path):
+        self.name = name
+        self.command = command
+        self.qmp_path = qmp_path
+        self.log_path = log_path
+        self.process = None
+        self.qmp = QMPClient(name)
+
+    async def start(self, timeout=30):
+        with open(self.log_path, 'w') as log:
+            self.process = await asyncio.create_subprocess_exec(
+                *self.command, stdin=asyncio.subprocess.DEVNULL, stdout=log, stderr=log)
+        deadline = time.monotonic() + timeout
+        while True:
+            if self.process.returncode is not None:
+                with open(self.log_path) as log:
+                    raise RuntimeError(f"{self.name} exited: {log.read()[-500:]}")
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"{self.name}: no QMP on {self.qmp_path} after {timeout}s")
+            if os.path.exists(self.qmp_path):
+                await self.qmp.connect(self.qmp_path)
+                return
+            await asyncio.sleep(0.1)
+
+    def cpu(self):
+        return process_cpu(self.process.pid)
+
+    async def stop(self):
+        try:
+            await self.qmp.disconnect()
+        except Exception:
+            pass
+        if self.process and self.process.returncode is None:
+            self.process.terminate()
+            try:
+                await asyncio.wait_for(self.process.wait(), 10)
+            except asyncio.TimeoutError:
+                self.process.kill()
+                await self.process.wait()
+
+class TLSMigrationBenchmark:
+    def __init__(self, qemu='qemu-system-x86_64', memory=1.0, qemu_args=(), mock=None, mock_args=(),
+                 cert_dir='/etc/pki/qemu', tls_profile='default', timeout=300):
+        self.qemu = qemu
+        self.memory = memory  # GiB
+        self.qemu_args = list(qemu_args)
+        self.mock = mock  # Path to mock-qemu.py; replaces QEMU
+        self.mock_args = list(mock_args)
+        self.cert_dir = cert_dir  # QEMU layout: ca-cert.pem, server-cert.pem, server-key.pem
+        self.tls_profile = tls_profile
+        self.timeout = timeout
+        self.workdir = None
+        self.relays = []  # Userspace relay threads of the current run
+        self.sockets = []  # TLS and relay sockets of the current run, closed after it
+        self.results = []
+
+    def vm_command(self, name, qmp_path, incoming):
+        if self.mock:
+            command = [sys.executable, self.mock, '--qmp', qmp_path, '--name', name,
+                       '--memory', str(self.memory)]
+            if incoming:
+                return command + ['--incoming']
+            # Random pages and no dirtying: one pass of pure bulk data
+            return command + ['--dirty-rate', '0', '--zero-fraction', '0'] + self.mock_args
+        command = [self.qemu, '-name', name, '-m', f'{int(self.memory * 1024)}M', '-nographic',
+                   '-nodefaults', '-machine', 'accel=kvm:tcg',
+                   '-qmp', f'unix:{qmp_path},server=on,wait=off']
+        if incoming:
+            command += ['-incoming', 'defer']
+        return command + self.qemu_args
+
+    def create_vm(self, name, incoming):
+        qmp_path = os.path.join(self.workdir, f'{name}.qmp')
+        return VM(name, self.vm_command(name, qmp_path, incoming), qmp_path,
+                  os.path.join(self.workdir, f'{name}.log'))
+
+    def tls_contexts(self, ktls):
+        """Return (server, client) contexts set up like qemu-rec.py and qemu-send.py."""
+        server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        server_context.load_cert_chain(os.path.join(self.cert_dir, 'server-cert.pem'),
+                                       os.path.join(self.cert_dir, 'server-key.pem'))
+        server_context.num_tickets = 0
+        client_context = ssl.create_default_context()
+        client_context.check_hostname = False
+        client_context.verify_mode = ssl.CERT_NONE
+        for context in (server_context, client_context):
+            if ktls:
+                context.options |= getattr(ssl, 'OP_ENABLE_KTLS', 0)
+            apply_tls_profile(context, self.tls_profile)
+        return server_context, client_context
+
+    async def tls_pair(self, ktls):
+        """Connect a TLS client and server over loopback; return (client, server) SSLSockets."""
+        loop = asyncio.get_running_loop()
+        server_context, client_context = self.tls_contexts(ktls)
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        port = listener.getsockname()[1]
+
+        def accept():
+            connection, _ = listener.accept()
+            return server_context.wrap_socket(connection, server_side=True)
+
+        def connect():
+            return client_context.wrap_socket(socket.create_connection(('127.0.0.1', port)))
+
+        try:
+            server, client = await asyncio.gather(loop.run_in_executor(None, accept),
+                                                  loop.run_in_executor(None, connect))
+        finally:
+            listener.close()
+        return client, server
+
+    async def wait_for_completion(self, source, destination):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            info = await source.qmp.execute('query-migrate')
+            if info.get('status') in ('completed', 'failed', 'cancelled'):
+                break
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"migration still {info.get('status')} after {self.timeout}s")
+            await asyncio.sleep(0.2)
+        if info['status'] != 'completed':
+            raise RuntimeError(f"source migration {info['status']}: {info.get('error-desc', '')}")
+        # The destination may still be loading the last data
+        while (await destination.qmp.execute('query-migrate')).get('status') in ('setup', 'active'):
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"destination still loading after {self.timeout}s")
+            await asyncio.sleep(0.2)
+        return info
+
+    async def run_native(self, source, destination):
+        port = self.free_port()
+        for vm, endpoint in ((source, 'client'), (destination, 'server')):
+            await vm.qmp.execute('object-add', {
+                'qom-type': 'tls-creds-x509', 'id': 'tls0', 'dir': self.cert_dir,
+                'endpoint': endpoint, 'verify-peer': False,
+            })
+            await vm.qmp.execute('migrate-set-parameters', {'tls-creds': 'tls0'})
+        await destination.qmp.execute('migrate-incoming', {'uri': f'tcp:127.0.0.1:{port}'})
+        await source.qmp.execute('migrate', {'uri': f'tcp:127.0.0.1:{port}'})
+        return {'cipher': None, 'ktls': None}
+
+    async def run_userspace(self, source, destination):
+        loop = asyncio.get_running_loop()
+        client, server = await self.tls_pair(ktls=False)
+        source_path = os.path.join(self.workdir, 'source-relay.sock')
+        destination_path = os.path.join(self.workdir, 'destination-relay.sock')
+
+        await destination.qmp.execute('migrate-incoming', {'uri': f'unix:{destination_path}'})
+        destination_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        destination_socket.connect(destination_path)
+
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(source_path)
+        listener.listen(1)
+        listener.settimeout(self.timeout)
+        await source.qmp.execute('migrate', {'uri': f'unix:{source_path}'})
+        source_socket, _ = await loop.run_in_executor(None, listener.accept)
+        source_socket.settimeout(None)
+        listener.close()
+
+        def relay(reader, writer):
+            total = copy_relay(reader, writer)
+            writer.shutdown(socket.SHUT_WR)
+            return total
+
+        self.relays = [loop.run_in_executor(None, relay, source_socket, client),
+                       loop.run_in_executor(None, relay, server, destination_socket)]
+        self.sockets = [source_socket, destination_socket, client, server]
+        return {'cipher': client.cipher()[0], 'ktls': None}
+
+    async def run_ktls(self, source, destination):
+        client, server = await self.tls_pair(ktls=True)
+        self.sockets = [client, server]
+        client_status = probe_ktls(client)
+        server_status = probe_ktls(server)
+        if not client_status['tx'] or not server_status['rx']:
+            # Handing these to QEMU would put plaintext on the wire
+            raise RuntimeError(f"kTLS not active (source TX {client_status['tx'] or 'userspace'}, "
+                               f"destination RX {server_status['rx'] or 'userspace'})")
+        for vm, tls_socket in ((destination, server), (source, client)):
+            vm.qmp.send_fd_scm(tls_socket.fileno())
+            await vm.qmp.execute('getfd', {'fdname': 'migfd'})
+        await destination.qmp.execute('migrate-incoming', {'uri': 'fd:migfd'})
+        await source.qmp.execute('migrate', {'uri': 'fd:migfd'})
+        return {'cipher': client_status['cipher'],
+                'ktls': {'tx': client_status['tx'], 'rx': server_status['rx']}}
+
+    @staticmethod
+    def free_port():
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.bind(('127.0.0.1', 0))
+            return sock.getsockname()[1]
+
+    async def run_mode(self, mode):
+        source = self.create_vm(f'{mode}-source', incoming=False)
+        destination = self.create_vm(f'{mode}-destination', incoming=True)
+        self.relays = []
+        self.sockets = []
+        try:
+            await source.start()
+            await destination.start()
+            await source.qmp.execute('migrate-set-parameters', {'max-bandwidth': 107374182400})
+
+            cpu_before = (source.cpu(), destination.cpu(), self_cpu(), host_busy())
+            start_time = time.monotonic()
+            session = await getattr(self, f'run_{mode}')(source, destination)
+            info = await self.wait_for_completion(source, destination)
+            await asyncio.gather(*self.relays)
+            elapsed = time.monotonic() - start_time
+            cpu_after = (source.cpu(), destination.cpu(), self_cpu(), host_busy())
+        except Exception as e:
+            logger.error(f"{mode}: skipped: {e}")
+            return {'mode': mode, 'skipped': str(e)}
+        finally:
+            for sock in self.sockets:
+                sock.close()
+            await source.stop()
+            await destination.stop()
+
+        sent = info.get('ram', {}).get('transferred', 0)
+        seconds = info.get('total-time', elapsed * 1000) / 1000
+        gigabytes = sent / 1e9 or float('nan')
+        source_cpu, destination_cpu, relay_cpu, host_cpu = (after - before for before, after in
+                                                            zip(cpu_before, cpu_after))
+        result = {
+            'mode': mode,
+            **session,
+            'bytes': sent,
+            'seconds': seconds,
+            'mbps': sent / (seconds * 1024 * 1024),
+            'downtime_ms': info.get('downtime'),
+            'source_cpu_s_per_gb': source_cpu / gigabytes,
+            'destination_cpu_s_per_gb': destination_cpu / gigabytes,
+            'relay_cpu_s_per_gb': relay_cpu / gigabytes,
+            'host_cpu_s_per_gb': host_cpu / gigabytes,
+        }
+        logger.info(f"{mode:<9} {result['cipher'] or 'QEMU/GnuTLS':<24} | {result['mbps']:>9.2f} MBps | "
+                    f"QEMU {result['source_cpu_s_per_gb'] + result['destination_cpu_s_per_gb']:.3f} | "
+                    f"relay {result['relay_cpu_s_per_gb']:.3f} | "
+                    f"host {result['host_cpu_s_per_gb']:.3f} CPU-s/GB")
+        return result
+
+    async def run(self, modes):
+        self.workdir = tempfile.mkdtemp(prefix='tls-bench-')
+        logger.info(f"{os.cpu_count()} CPUs | {ssl.OPENSSL_VERSION} | "
+                    f"{'mock ' + self.mock if self.mock else self.qemu} | {self.memory} GiB | "
+                    f"profile {self.tls_profile}")
+        try:
+            for mode in modes:
+                self.results.append(await self.run_mode(mode))
+        finally:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+        self.log_summary()
+
+    def log_summary(self):
+        completed = [r for r in self.results if 'skipped' not in r]
+        logger.info("=" * 60)
+        logger.info("TLS MIGRATION BENCHMARK (cheapest first):")
+        # On a dedicated migration path the CPU is the bottleneck, so rank by host CPU per GB
+        for result in sorted(completed, key=lambda r: r['host_cpu_s_per_gb']):
+            logger.info(f"{result['mode']:<9} {result['mbps']:>9.2f} MBps | "
+                        f"{result['host_cpu_s_per_gb']:.3f} host CPU-s/GB | {result['seconds']:.2f}s")
+        for result in self.results:
+            if 'skipped' in result:
+                logger.info(f"{result['mode']:<9} skipped: {result['skipped']}")
+        logger.info("=" * 60)
+
+    def export_json(self, path):
+        with open(path, 'w') as f:
+            json.dump({'openssl': ssl.OPENSSL_VERSION, 'cpus': os.cpu_count(), 'memory_gib': self.memory,
+                       'mock': bool(self.mock), 'tls_profile': self.tls_profile,
+                       'tls_stat': read_tls_stat(), 'results': self.results}, f, indent=2)
+        logger.info(f"Results written to {path}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare QEMU native TLS, userspace TLS and kTLS fd hand-off')
+    parser.add_argument('--modes', default=','.join(MODES), help=f'Comma separated (default: {",".join(MODES)})')
+    parser.add_argument('--qemu', default='qemu-system-x86_64', help='QEMU binary')
+    parser.add_argument('--qemu-args', default='', help='Extra QEMU arguments, e.g. a guest that dirties memory')
+    parser.add_argument('--mock', help='Run mock-qemu.py from this path instead of QEMU')
+    parser.add_argument('--mock-args', default='', help='Extra arguments for the source mock')
+    parser.add_argument('--memory', type=float, default=1.0, help='Guest RAM in GiB (default: 1)')
+    parser.add_argument('--cert-dir', default='/etc/pki/qemu',
+                        help='ca-cert.pem, server-cert.pem and server-key.pem, as QEMU expects them')
+    parser.add_argument('--tls-profile', default='default', choices=TLS_PROFILES,
+                        help='TLS profile for the userspace and ktls modes')
+    parser.add_argument('--timeout', type=float, default=300, help='Seconds allowed per migration')
+    parser.add_argument('--export', help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    modes = [m.strip() for m in args.modes.split(',')]
+    unknown = [m for m in modes if m not in MODES]
+    if unknown:
+        parser.error(f"unknown modes: {', '.join(unknown)}")
+    benchmark = TLSMigrationBenchmark(args.qemu, args.memory, args.qemu_args.split(), args.mock,
+                                      args.mock_args.split(), args.cert_dir, args.tls_profile, args.timeout)
+    asyncio.run(benchmark.run(modes))
+    if args.export:
+        benchmark.export_json(args.export)
+
+if __name__ == "__main__":
+    main()
@@ -14,8 +14,34 @@ def run_command(cmd, check=True):
         sys.exit(1)
     return result
 
-def generate_certificates(cert_dir="certs", server_cn="localhost", validity_days=365):
-    """Generate CA, server, and client certificates."""
+# Key profiles: openssl genpkey options, signing digest and key usage for leaf certificates.
+# Ed25519 signs the message directly, so it takes no digest option.
+KEY_PROFILES = {
+    "rsa2048": (["-algorithm", "RSA", "-pkeyopt", "rsa_keygen_bits:2048"], ["-sha256"],
+                "digitalSignature, keyEncipherment"),
+    "rsa3072": (["-algorithm", "RSA", "-pkeyopt", "rsa_keygen_bits:3072"], ["-sha256"],
+                "digitalSignature, keyEncipherment"),
+    "rsa4096": (["-algorithm", "RSA", "-pkeyopt", "rsa_keygen_bits:4096"], ["-sha256"],
+                "digitalSignature, keyEncipherment"),
+    "ecdsa-p256": (["-algorithm", "EC", "-pkeyopt", "ec_paramgen_curve:P-256"], ["-sha256"],
+                   "digitalSignature"),
+    "ecdsa-p384": (["-algorithm", "EC", "-pkeyopt", "ec_paramgen_curve:P-384"], ["-sha384"],
+                   "digitalSignature"),
+    "ed25519": (["-algorithm", "ED25519"], [], "digitalSignature"),
+}
+
+def generate_key(key_file, key_type):
+    """Generate a private key for the given profile."""
+    genpkey_opts, _, _ = KEY_PROFILES[key_type]
+    run_command(["openssl", "genpkey"] + genpkey_opts + ["-out", key_file])
+
+def generate_certificates(cert_dir="certs", server_cn="localhost", validity_days=365, key_type="rsa4096"):
+    """Generate CA, server, and client certificates.
+
+    File names do not depend on key_type, so every create_ssl_context that
+    loads them picks up the new keys without changes.
+    """
+    _, digest, key_usage = KEY_PROFILES[key_type]
     
     # Create certificate directory
     cert_path = Path(cert_dir)
@@ -23,45 +49,42 @@ def generate_certificates(cert_dir="certs", server_cn="localhost", validity_days
     
     os.chdir(cert_path)
     
-    print(f"Generating certificates in {cert_path.absolute()}")
+    print(f"Generating {key_type} certificates in {cert_path.absolute()}")
     
     # 1. Generate CA private key
     print("\n1. Generating CA private key...")
-    run_command([
-        "openssl", "genrsa", "-out", "ca-key.pem", "4096"
-    ])
+    generate_key("ca-key.pem", key_type)
     
     # 2. Generate CA certificate
     print("\n2. Generating CA certificate...")
     run_command([
         "openssl", "req", "-new", "-x509", "-days", str(validity_days),
-        "-key", "ca-key.pem", "-sha256", "-out", "ca.pem",
+        "-key", "ca-key.pem"] + digest + ["-out", "ca.pem",
         "-subj", "/C=US/ST=CA/L=San Francisco/O=Migration/CN=Migration CA"
     ])
     
     # 3. Generate server private key
     print("\n3. Generating server private key...")
-    run_command([
-        "openssl", "genrsa", "-out", "server-key.pem", "4096"
-    ])
+    generate_key("server-key.pem", key_type)
     
     # 4. Generate server certificate signing request
     print("\n4. Generating server CSR...")
     run_command([
-        "openssl", "req", "-subj", f"/C=US/ST=CA/L=San Francisco/O=Migration/CN={server_cn}",
-        "-sha256", "-new", "-key", "server-key.pem", "-out", "server.csr"
+        "openssl", "req", "-subj", f"/C=US/ST=CA/L=San Francisco/O=Migration/CN={server_cn}"] + digest + [
+        "-new", "-key", "server-key.pem", "-out", "server.csr"
     ])
     
     # 5. Create server extensions file
     print("\n5. Creating server extensions...")
     with open("server-extfile.cnf", "w") as f:
         f.write(f"subjectAltName = DNS:{server_cn},IP:127.0.0.1,IP:0.0.0.0\n")
+        f.write(f"keyUsage = critical, {key_usage}\n")
         f.write("extendedKeyUsage = serverAuth\n")
     
     # 6. Generate server certificate signed by CA
     print("\n6. Generating server certificate...")
     run_command([
-        "openssl", "x509", "-req", "-days", str(validity_days), "-sha256",
+        "openssl", "x509", "-req", "-days", str(validity_days)] + digest + [
         "-in", "server.csr", "-CA", "ca.pem", "-CAkey", "ca-key.pem",
         "-out", "server-cert.pem", "-extfile", "server-extfile.cnf",
         "-CAcreateserial"
@@ -69,26 +92,24 @@ def generate_certificates(cert_dir="certs", server_cn="localhost", validity_days
     
     # 7. Generate client private key
     print("\n7. Generating client private key...")
-    run_command([
-        "openssl", "genrsa", "-out", "client-key.pem", "4096"
-    ])
+    generate_key("client-key.pem", key_type)
     
     # 8. Generate client certificate signing request
     print("\n8. Generating client CSR...")
     run_command([
         "openssl", "req", "-subj", "/C=US/ST=CA/L=San Francisco/O=Migration/CN=migration-client",
-        "-new", "-key", "client-key.pem", "-out", "client.csr"
-    ])
+        "-new", "-key", "client-key.pem", "-out", "client.csr"] + digest)
     
     # 9. Create client extensions file
     print("\n9. Creating client extensions...")
     with open("client-extfile.cnf", "w") as f:
+        f.write(f"keyUsage = critical, {key_usage}\n")
         f.write("extendedKeyUsage = clientAuth\n")
     
     # 10. Generate client certificate signed by CA
     print("\n10. Generating client certificate...")
     run_command([
-        "openssl", "x509", "-req", "-days", str(validity_days), "-sha256",
+        "openssl", "x509", "-req", "-days", str(validity_days)] + digest + [
         "-in", "client.csr", "-CA", "ca.pem", "-CAkey", "ca-key.pem",
         "-out", "client-cert.pem", "-extfile", "client-extfile.cnf",
         "-CAcreateserial"
@@ -135,6 +156,8 @@ def main():
     parser.add_argument("--cert-dir", default="certs", help="Directory to store certificates")
     parser.add_argument("--server-cn", default="localhost", help="Server common name")
     parser.add_argument("--validity-days", type=int, default=365, help="Certificate validity in days")
+    parser.add_argument("--key-type", choices=sorted(KEY_PROFILES), default="rsa4096",
+                        help="Key algorithm for CA, server and client (ecdsa-p256 has the cheapest handshakes)")
     
     args = parser.parse_args()
     
@@ -145,7 +168,7 @@ def main():
         print("Error: OpenSSL is not installed or not in PATH")
         sys.exit(1)
     
-    generate_certificates(args.cert_dir, args.server_cn, args.validity_days)
+    generate_certificates(args.cert_dir, args.server_cn, args.validity_days, args.key_type)
 
 if __name__ == "__main__":
     main()
@@ -1,99 +1,34 @@
 import asyncio
 import tempfile
 import os
-from qemu.qmp import QMPClient
+import sys
+# Shared with the migrate-proxy scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'migrate-proxy'))
+from qmp_migration import migrate_vm
 
 #!/usr/bin/env python3
 
-async def execute_and_monitor_migration(qmp_client, destination_uri):
-    """
-    Execute the migration command and monitor its progress.
-    
-    Args:
-        qmp_client: An instance of QMPClient connected to the QEMU QMP socket.
-        destination_uri: The destination URI for migration.
-    """
-    # Enable multifd migration capability
-    print("Enabling multifd migration capability")
-    await qmp_client.execute('migrate-set-capabilities', {
-        'capabilities': [{'capability': 'multifd', 'state': True}]
-    })
-
-    # Set multifd channels
-    print("Setting multifd channels to 2")
-    await qmp_client.execute('migrate-set-parameters', {
-        'multifd-channels': 2
-    })
-
-    # Start migration
-    print(f"Starting migration to: {destination_uri}")
-    migrate_result = await qmp_client.execute('migrate', {
-        'uri': destination_uri
-    })
-    print(f"Migration command result: {migrate_result}")
-    
-    # Monitor migration progress
-    while True:
-        migration_info = await qmp_client.execute('query-migrate')
-        status = migration_info.get('status', 'unknown')
-        
-        print(f"Migration status: {status}")
-        
-        if status == 'completed':
-            print("Migration completed successfully!")
-            break
-        elif status == 'failed':
-            print("Migration failed!")
-            break
-        elif status == 'cancelled':
-            print("Migration was cancelled!")
-            break
-        elif status == 'active':
-            # Show progress if available
-            if 'ram' in migration_info:
-                ram_info = migration_info['ram']
-                transferred = ram_info.get('transferred', 0)
-                total = ram_info.get('total', 0)
-                if total > 0:
-                    progress = (transferred / total) * 100
-                    print(f"Migration progress: {progress:.2f}%")
-        
-        # Wait before checking again
-        await asyncio.sleep(1)
-
-async def migrate_vm_websocket_forwarded(qmp_socket_path, websocket_unix_socket_path=None):
+async def migrate_vm_websocket_forwarded(qmp_socket_path, websocket_unix_socket_path=None, sample_interval=0.1, stats_path=None,
+                                         autotune=None, postcopy=None, preflight=None):
     """
     Migrate a QEMU VM using WebSocket-forwarded unix socket.
     
     Args:
         qmp_socket_path: Path to QEMU QMP socket
         websocket_unix_socket_path: Path to unix socket that forwards to WebSocket
+        sample_interval: Seconds between query-migrate samples
+        stats_path: Optional path to export migration statistics to as JSON
+        autotune: MigrationAutotuner keyword arguments, or None for the fixed multifd setup
+        postcopy: PostcopyPolicy keyword arguments, or None to migrate in precopy only
+        preflight: ConvergencePredictor keyword arguments, or None to skip the prediction
     """
     
     if websocket_unix_socket_path is None:
         websocket_unix_socket_path = "/tmp/qemu_migration_source.sock"
     
-    destination_uri = f"unix:{websocket_unix_socket_path}"
-    
-    qmp_client = QMPClient()
-    
-    try:
-        # Connect to QEMU QMP socket
-        await qmp_client.connect(qmp_socket_path)
-        
-        print(f"Connected to QMP socket: {qmp_socket_path}")
-        
-        # Check VM status
-        result = await qmp_client.execute('query-status')
-        print(f"VM Status: {result}")
-        
-        # Execute and monitor migration
-        await execute_and_monitor_migration(qmp_client, destination_uri)
-            
-    except Exception as e:
-        print(f"Error during migration: {e}")
-    finally:
-        await qmp_client.disconnect()
+    # multifd-channels must match unix-receive-websocket.py
+    await migrate_vm(qmp_socket_path, f"unix:{websocket_unix_socket_path}", 2, sample_interval, stats_path,
+                     autotune, postcopy, preflight)
 
 async def main():
     # Default QMP socket path - adjust as needed
@@ -102,7 +37,27 @@ async def main():
     # WebSocket-forwarded unix socket path (created by websocket-migration-client.py)
     websocket_unix_socket = "/tmp/qemu_migration_source.sock"
     
-    await migrate_vm_websocket_forwarded(qmp_socket, websocket_unix_socket)
+    # query-migrate sampling period, and where to export the statistics (None to skip)
+    sample_interval = 0.1
+    stats_path = None
+    
+    # Pick multifd channels, compression and downtime from measurements instead of
+    # the fixed setup. link_rate is in bytes/s; probe_address is a (host, port) TCP
+    # sink on the destination, e.g. `nc -lk 5201 > /dev/null`. Set the destination's
+    # multifd_channels/multifd_compression to the printed plan.
+    autotune = None  # e.g. {'probe_address': ('192.168.1.100', 5201), 'max_downtime': 2000}
+    
+    # Switch to postcopy when precopy stops converging; set postcopy = True on the
+    # destination too. Keys are PostcopyPolicy arguments, {} for the defaults.
+    postcopy = None  # e.g. {'max_passes': 10, 'max_precopy_seconds': 600}
+    
+    # Predict passes, volume and downtime before migrating, apply the best candidate
+    # parameters, and if nothing converges start in postcopy, reschedule or migrate
+    # anyway ('on_nonconvergence'). Takes link_rate or probe_address like autotune.
+    preflight = None  # e.g. {'probe_address': ('192.168.1.100', 5201), 'on_nonconvergence': 'postcopy'}
+    
+    await migrate_vm_websocket_forwarded(qmp_socket, websocket_unix_socket, sample_interval, stats_path, autotune,
+                                         postcopy, preflight)
 
 if __name__ == "__main__":
     asyncio.run(main())
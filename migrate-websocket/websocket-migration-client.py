@@ -4,16 +4,22 @@ import ssl
 import os
 import logging
 import uuid
+from websocket_common import apply_tls_profile, load_websocket_tuning
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class MigrationWebSocketClient:
-    def __init__(self, server_url, unix_socket_path=None, cert_dir='certs'):
+    def __init__(self, server_url, unix_socket_path=None, cert_dir='certs', tls_profile='default'):
         self.server_url = server_url
         self.unix_socket_path = unix_socket_path or '/tmp/qemu_migration_source.sock'
         self.cert_dir = cert_dir
+        self.tls_profile = tls_profile
         self.active_connections = {}  # Track active connections
+        # Calibrated websockets limits and frame size for this host, if any
+        self.connection_options, frame_size = load_websocket_tuning(websockets.connect)
+        self.frame_size = frame_size or 8192
+        self.ready = asyncio.Event()  # Set once QEMU can connect to the unix socket
         
     def create_ssl_context(self):
         """Create SSL context for secure WebSocket connection."""
@@ -37,7 +43,9 @@ class MigrationWebSocketClient:
         ssl_context.check_hostname = False  # Set to True if using proper hostname
         ssl_context.verify_mode = ssl.CERT_REQUIRED
         
-        logger.info("SSL context created with client certificate authentication")
+        apply_tls_profile(ssl_context, self.tls_profile)
+        
+        logger.info(f"SSL context created ({self.tls_profile} profile) with client certificate authentication")
         return ssl_context
         
     async def start_unix_server(self):
@@ -57,6 +65,7 @@ class MigrationWebSocketClient:
             logger.info(f"Unix socket server started at {self.unix_socket_path}")
             logger.info("Waiting for QEMU connections...")
             logger.info("Supporting multiple concurrent QEMU connections")
+            self.ready.set()
             
             # Serve the unix socket
             async with unix_server:
@@ -84,7 +93,8 @@ class MigrationWebSocketClient:
             # Create WebSocket connection for this QEMU connection
             websocket = await websockets.connect(
                 self.server_url,
-                ssl=ssl_context
+                ssl=ssl_context,
+                **self.connection_options
             )
             logger.info(f"WebSocket connection {connection_id} established to {self.server_url}")
             
@@ -144,7 +154,7 @@ class MigrationWebSocketClient:
         total_bytes = 0
         try:
             while True:
-                data = await unix_reader.read(8192)
+                data = await unix_reader.read(self.frame_size)
                 if not data:
                     logger.info(f"Unix->WebSocket [{connection_id}]: Connection closed by peer")
                     break
@@ -187,8 +197,9 @@ async def main():
     server_url = 'wss://10.117.30.218:8766'  # Changed to wss:// and port 8766
     unix_socket_path = '/tmp/qemu_migration_source.sock'
     cert_dir = 'certs'
+    tls_profile = 'default'  # See TLS_PROFILES in websocket_common.py; use the same profile on both ends
     
-    client = MigrationWebSocketClient(server_url, unix_socket_path, cert_dir)
+    client = MigrationWebSocketClient(server_url, unix_socket_path, cert_dir, tls_profile)
     
     try:
         await client.start_unix_server()
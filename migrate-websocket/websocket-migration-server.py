@@ -4,18 +4,24 @@ import ssl
 import os
 import logging
 import uuid
+from websocket_common import apply_tls_profile, load_websocket_tuning
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class MigrationWebSocketServer:
-    def __init__(self, host='0.0.0.0', port=8766, unix_socket_path=None, cert_dir='certs'):
+    def __init__(self, host='0.0.0.0', port=8766, unix_socket_path=None, cert_dir='certs', tls_profile='default'):
         self.host = host
         self.port = port
         self.unix_socket_path = unix_socket_path or '/tmp/qemu_migration_dest.sock'
         self.cert_dir = cert_dir
+        self.tls_profile = tls_profile
         self.server = None
         self.active_connections = {}  # Track active WebSocket connections
+        # Calibrated websockets limits and frame size for this host, if any
+        self.connection_options, frame_size = load_websocket_tuning(websockets.serve)
+        self.frame_size = frame_size or 8192
+        self.ready = asyncio.Event()  # Set once the server is listening
         
     def create_ssl_context(self):
         """Create SSL context for secure WebSocket connections."""
@@ -35,7 +41,9 @@ class MigrationWebSocketServer:
         ssl_context.verify_mode = ssl.CERT_REQUIRED
         ssl_context.load_verify_locations(ca_file)
         
-        logger.info("SSL context created with client certificate verification")
+        apply_tls_profile(ssl_context, self.tls_profile)
+        
+        logger.info(f"SSL context created ({self.tls_profile} profile) with client certificate verification")
         return ssl_context
         
     async def handle_client(self, websocket):
@@ -157,7 +165,7 @@ class MigrationWebSocketServer:
         total_bytes = 0
         try:
             while True:
-                data = await unix_reader.read(8192)
+                data = await unix_reader.read(self.frame_size)
                 if not data:
                     logger.info(f"Unix->WebSocket [{connection_id}]: Connection closed by peer")
                     break
@@ -188,13 +196,15 @@ class MigrationWebSocketServer:
             handler,
             self.host,
             self.port,
-            ssl=ssl_context
+            ssl=ssl_context,
+            **self.connection_options
         )
         
         logger.info(f"Secure Migration WebSocket server listening on wss://{self.host}:{self.port}")
         logger.info(f"Will create unix socket connections with base path: {self.unix_socket_path}")
         logger.info("Client certificate authentication enabled")
         logger.info("Supporting multiple concurrent WebSocket connections")
+        self.ready.set()
         
         await self.server.wait_closed()
     
@@ -210,8 +220,9 @@ async def main():
     port = 8766  # Changed from 8765 to 8766 for secure WebSocket
     unix_socket_path = '/tmp/qemu_migration_dest.sock'
     cert_dir = 'certs'
+    tls_profile = 'default'  # See TLS_PROFILES in websocket_common.py; use the same profile on both ends
     
-    server = MigrationWebSocketServer(host, port, unix_socket_path, cert_dir)
+    server = MigrationWebSocketServer(host, port, unix_socket_path, cert_dir, tls_profile)
     
     try:
         await server.start()
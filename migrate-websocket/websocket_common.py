@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""Helpers shared by websocket-migration-client.py and websocket-migration-server.py.
+
+The proxy-perf websocket scripts import this module from ../../migrate-websocket.
+"""
+import inspect
+import json
+import logging
+import os
+import socket
+import ssl
+
+logger = logging.getLogger(__name__)
+
+# TLS profiles: (minimum version, maximum version, TLS 1.2 cipher string).
+# Python's ssl module cannot restrict TLS 1.3 suites, so those are left to OpenSSL.
+TLS_PROFILES = {
+    'default': (None, None, None),
+    'tls13': (ssl.TLSVersion.TLSv1_3, ssl.TLSVersion.TLSv1_3, None),
+    'tls12-aes128-gcm': (ssl.TLSVersion.TLSv1_2, ssl.TLSVersion.TLSv1_2,
+                         'ECDHE-ECDSA-AES128-GCM-SHA256:ECDHE-RSA-AES128-GCM-SHA256'),
+    'tls12-aes256-gcm': (ssl.TLSVersion.TLSv1_2, ssl.TLSVersion.TLSv1_2,
+                         'ECDHE-ECDSA-AES256-GCM-SHA384:ECDHE-RSA-AES256-GCM-SHA384'),
+    'tls12-chacha20': (ssl.TLSVersion.TLSv1_2, ssl.TLSVersion.TLSv1_2,
+                       'ECDHE-ECDSA-CHACHA20-POLY1305:ECDHE-RSA-CHACHA20-POLY1305'),
+}
+
+def apply_tls_profile(ssl_context, profile):
+    """Restrict an SSL context to the versions and ciphers of a TLS_PROFILES entry."""
+    minimum, maximum, ciphers = TLS_PROFILES[profile]
+    if minimum:
+        ssl_context.minimum_version = minimum
+    if maximum:
+        ssl_context.maximum_version = maximum
+    if ciphers:
+        ssl_context.set_ciphers(ciphers)
+
+# Written per host by proxy-perf/websocket/calibrate.py
+WEBSOCKET_TUNING_FILE = os.environ.get('WEBSOCKET_TUNING_FILE',
+                                       os.path.expanduser('~/.config/migrate/websocket-tuning.json'))
+
+def load_websocket_tuning(target):
+    """Return (connection options, frame size) from the calibration file.
+
+    Falls back to the library defaults ({}, None) when the host has not been
+    calibrated. Options that target (websockets.connect or websockets.serve)
+    does not accept in the installed websockets version are dropped.
+    """
+    try:
+        with open(WEBSOCKET_TUNING_FILE) as f:
+            tuning = json.load(f)
+    except FileNotFoundError:
+        return {}, None
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring websockets tuning file {WEBSOCKET_TUNING_FILE}: {e}")
+        return {}, None
+
+    supported = inspect.signature(target).parameters
+    options = {key: value for key, value in tuning.get('connection', {}).items() if key in supported}
+    if tuning.get('host') != socket.gethostname():
+        logger.warning(f"{WEBSOCKET_TUNING_FILE} was calibrated on {tuning.get('host')}, not this host")
+    logger.info(f"Loaded websockets tuning from {WEBSOCKET_TUNING_FILE}: "
+                f"frame size {tuning.get('frame_size')} | {options}")
+    return options, tuning.get('frame_size')
@@ -0,0 +1,646 @@
+#!/usr/bin/env python3
+"""Stand-in for a QEMU instance's QMP monitor and migration stream.
+
+Answers the QMP commands the migration scripts in this repository use and
+moves a synthetic RAM stream over unix, tcp or passed-in fd sockets, so the
+proxies and QMP scripts can be benchmarked without VMs. As a source it
+generates precopy passes (and postcopy on request) from the configured memory
+size, dirty rate and zero-page fraction, split over the multifd channels; as
+a destination it consumes and verifies such a stream.
+
+The stream is not QEMU's wire format. It is sized like one: zero pages
+cost a 12-byte header, normal pages a header plus the page.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import struct
+import time
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Stream records: header (address | flags, length) followed by `length` bytes
+RECORD = struct.Struct('!QI')
+FLAG_ZERO = 0x02  # Zero page, no data
+FLAG_PAGE = 0x08  # Run of normal pages starting at the address
+FLAG_EOS = 0x10  # End of a pass; address carries the pass number
+FLAG_COMPLETE = 0x200  # Last record on a channel; length is the channel's byte count before it
+FLAG_HELLO = 0x400  # First record on a channel; address carries the index, length the channel count
+FLAG_POSTCOPY = 0x800  # The guest now runs on the destination
+FLAG_MASK = 0xfff
+
+RUN_PAGES = 128  # Pages per multifd packet
+DATA_POOL = 4 * 1024 * 1024  # Random bytes that normal pages are sliced from
+QEMU_DEFAULT_BANDWIDTH = 128 * 1024 * 1024  # QEMU's max-bandwidth default
+
+class QMPError(Exception):
+    def __init__(self, desc, error_class='GenericError'):
+        super().__init__(desc)
+        self.error_class = error_class
+
+class StreamGenerator:
+    """Source side: send RAM in passes until the dirty set fits in downtime-limit."""
+    def __init__(self, vm, writers):
+        self.vm = vm
+        self.writers = writers  # Index 0 is the main channel, then the multifd channels
+        self.channel_bytes = [0] * len(writers)
+        self.pool = os.urandom(DATA_POOL)
+        self.next_channel = 0
+        self.postcopy_requested = False
+        self.cancelled = False
+
+    async def write(self, index, data):
+        writer = self.writers[index]
+        writer.write(data)
+        self.channel_bytes[index] += len(data)
+        self.vm.stats['transferred'] += len(data)
+        if self.vm.phase == 'postcopy':
+            self.vm.stats['postcopy-bytes'] += len(data)
+        elif self.vm.phase == 'downtime':
+            self.vm.stats['downtime-bytes'] += len(data)
+        else:
+            self.vm.stats['precopy-bytes'] += len(data)
+        if index:
+            self.vm.stats['multifd-bytes'] += len(data)
+        await writer.drain()
+        await self.pace()
+
+    async def pace(self):
+        """Hold the average rate to max-bandwidth, like QEMU's rate limiter."""
+        limit = self.vm.parameters['max-bandwidth']
+        if self.vm.phase != 'precopy' or not limit:
+            return
+        ahead = self.vm.stats['precopy-bytes'] / limit - (time.monotonic() - self.vm.start_time)
+        if ahead > 0.001:
+            await asyncio.sleep(ahead)
+
+    async def send_run(self, first_page, pages):
+        """Send one run: zero pages on the main channel, the rest as a packet on a data channel."""
+        zero = round(pages * self.vm.zero_fraction)
+        if zero:
+            records = b''.join(RECORD.pack(((first_page + i) * self.vm.page_size) | FLAG_ZERO, 0)
+                               for i in range(zero))
+            await self.write(0, records)
+            self.vm.stats['duplicate'] += zero
+        normal = pages - zero
+        if normal:
+            length = normal * self.vm.page_size
+            offset = random.randrange(0, DATA_POOL - length + 1, self.vm.page_size)
+            index = 0
+            if len(self.writers) > 1:
+                index = 1 + self.next_channel
+                self.next_channel = (self.next_channel + 1) % (len(self.writers) - 1)
+            await self.write(index, RECORD.pack(((first_page + zero) * self.vm.page_size) | FLAG_PAGE, length))
+            await self.write(index, memoryview(self.pool)[offset:offset + length])
+            self.vm.stats['normal'] += normal
+            self.vm.stats['normal-bytes'] += length
+        self.vm.stats['remaining'] = max(0, self.vm.stats['remaining'] - pages * self.vm.page_size)
+
+    async def send_pages(self, count):
+        """Send `count` pages in runs at random addresses (pass 1 sends all RAM in order)."""
+        total_pages = self.vm.memory // self.vm.page_size
+        sequential = count >= total_pages
+        sent = 0
+        while sent < count and not self.cancelled:
+            pages = min(RUN_PAGES, count - sent)
+            first = sent if sequential else random.randrange(0, max(1, total_pages - pages))
+            await self.send_run(first, pages)
+            sent += pages
+            if self.postcopy_requested and self.vm.phase == 'precopy':
+                return sent
+        return sent
+
+    async def run(self):
+        vm = self.vm
+        total_pages = vm.memory // vm.page_size
+        for index in range(len(self.writers)):
+            await self.write(index, RECORD.pack(index << 12 | FLAG_HELLO, len(self.writers)))
+
+        to_send = total_pages
+        while not self.cancelled:
+            vm.stats['dirty-sync-count'] += 1
+            vm.stats['remaining'] = to_send * vm.page_size
+            vm.event('MIGRATION_PASS', {'pass': vm.stats['dirty-sync-count']}, migration=True)
+            pass_start = time.monotonic()
+            pass_bytes = vm.stats['transferred']
+            sent = await self.send_pages(to_send)
+            await self.write(0, RECORD.pack(vm.stats['dirty-sync-count'] << 12 | FLAG_EOS, 0))
+            elapsed = max(time.monotonic() - pass_start, 1e-6)
+            bandwidth = (vm.stats['transferred'] - pass_bytes) / elapsed
+            vm.bandwidth = bandwidth
+
+            # Pages dirtied while this pass ran, plus any it did not get to
+            dirty = min(total_pages, int(vm.dirty_rate / vm.page_size * elapsed) + (to_send - sent))
+            vm.stats['dirty-pages-rate'] = int(vm.dirty_rate / vm.page_size)
+            switchover_bandwidth = vm.parameters.get('avail-switchover-bandwidth') or bandwidth
+            vm.expected_downtime = int(dirty * vm.page_size / switchover_bandwidth * 1000)
+
+            if self.postcopy_requested:
+                await self.postcopy(dirty)
+                break
+            if vm.expected_downtime <= vm.parameters['downtime-limit']:
+                await self.switchover(dirty)
+                break
+            to_send = dirty
+
+        if not self.cancelled:
+            for index in range(len(self.writers)):
+                await self.write(index, RECORD.pack(FLAG_COMPLETE, self.channel_bytes[index]))
+
+    async def switchover(self, dirty):
+        vm = self.vm
+        vm.stop_guest()
+        vm.set_status('device')
+        vm.phase = 'downtime'
+        downtime_start = time.monotonic()
+        vm.stats['remaining'] = dirty * vm.page_size
+        await self.send_pages(dirty)
+        vm.downtime = int((time.monotonic() - downtime_start) * 1000)
+
+    async def postcopy(self, dirty):
+        """Switch to the destination now and send the rest once; nothing is redirtied."""
+        vm = self.vm
+        vm.stop_guest()
+        vm.set_status('postcopy-active')
+        vm.phase = 'postcopy'
+        vm.downtime = 1
+        vm.stats['remaining'] = dirty * vm.page_size
+        await self.write(0, RECORD.pack(FLAG_POSTCOPY, 0))
+        await self.send_pages(dirty)
+
+class StreamConsumer:
+    """Destination side: read every channel, count pages and check byte counts."""
+    def __init__(self, vm):
+        self.vm = vm
+        self.channels = None  # Announced by the first HELLO
+        self.completed = 0
+        self.failed = None
+        self.done = asyncio.Event()
+
+    async def consume(self, reader):
+        vm = self.vm
+        received = 0
+        try:
+            while True:
+                header = await reader.readexactly(RECORD.size)
+                address, length = RECORD.unpack(header)
+                flags = address & FLAG_MASK
+                if flags == FLAG_COMPLETE:
+                    if length != received:
+                        raise ValueError(f"channel byte count {received} != announced {length}")
+                    break
+                received += RECORD.size
+                if flags == FLAG_HELLO:
+                    if self.channels is None:
+                        self.channels = length
+                        vm.set_status('active')
+                elif flags == FLAG_PAGE:
+                    await reader.readexactly(length)
+                    received += length
+                    vm.stats['normal'] += length // vm.page_size
+                elif flags == FLAG_ZERO:
+                    vm.stats['duplicate'] += 1
+                elif flags == FLAG_EOS:
+                    vm.stats['dirty-sync-count'] = address >> 12
+                elif flags == FLAG_POSTCOPY:
+                    vm.set_status('postcopy-active')
+                    vm.run_state = 'running'
+                    vm.event('RESUME')
+                else:
+                    raise ValueError(f"unknown record flags {flags:#x}")
+                vm.stats['transferred'] += RECORD.size + (length if flags == FLAG_PAGE else 0)
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError) as e:
+            self.failed = str(e)
+            logger.error(f"Incoming stream broken: {e}")
+            self.done.set()
+            return
+        self.completed += 1
+        if self.channels and self.completed == self.channels:
+            self.done.set()
+
+class MockVM:
+    """One mock QEMU: QMP state, migration parameters and statistics."""
+    def __init__(self, name, memory, dirty_rate, zero_fraction, page_size=4096, incoming=False):
+        self.name = name
+        self.memory = memory
+        self.dirty_rate = dirty_rate  # Bytes/s
+        self.zero_fraction = zero_fraction
+        self.page_size = page_size
+        self.run_state = 'inmigrate' if incoming else 'running'
+        self.capabilities = {'multifd': False, 'events': False, 'postcopy-ram': False}
+        self.parameters = {
+            'multifd-channels': 2,
+            'multifd-compression': 'none',
+            'max-bandwidth': QEMU_DEFAULT_BANDWIDTH,
+            'downtime-limit': 300,
+            'avail-switchover-bandwidth': 0,
+        }
+        self.clients = []  # QMP connections that receive events
+        self.fds = {}  # getfd name -> fd
+        self.fdsets = {}  # fdset id -> [fd, ...]
+        self.dirty_rate_measured = 0  # When the running calc-dirty-rate finishes
+        self.reset_migration()
+
+    def reset_migration(self):
+        self.status = 'none'
+        self.phase = 'precopy'
+        self.start_time = None
+        self.end_time = None
+        self.downtime = None
+        self.bandwidth = 0
+        self.expected_downtime = 0
+        self.generator = None
+        self.tasks = []
+        self.stats = {key: 0 for key in (
+            'transferred', 'remaining', 'duplicate', 'normal', 'normal-bytes', 'dirty-pages-rate',
+            'dirty-sync-count', 'precopy-bytes', 'postcopy-bytes', 'downtime-bytes', 'multifd-bytes')}
+
+    # --- events and state -------------------------------------------------
+
+    def event(self, name, data=None, migration=False):
+        # QEMU only emits migration events with the 'events' capability
+        if migration and not self.capabilities['events']:
+            return
+        now = time.time()
+        message = {'event': name, 'timestamp': {'seconds': int(now), 'microseconds': int(now % 1 * 1e6)}}
+        if data is not None:
+            message['data'] = data
+        for client in list(self.clients):
+            client.send(message)
+
+    def set_status(self, status):
+        if status == self.status:
+            return
+        self.status = status
+        logger.info(f"[{self.name}] migration {status}")
+        self.event('MIGRATION', {'status': status}, migration=True)
+        if status in ('completed', 'failed', 'cancelled'):
+            self.end_time = time.monotonic()
+
+    def stop_guest(self):
+        self.run_state = 'finish-migrate'
+        self.event('STOP')
+
+    # --- channels ---------------------------------------------------------
+
+    def parse_address(self, uri=None, channels=None):
+        """Return (kind, target) from a migration URI or a 'channels' main channel."""
+        if channels:
+            main = [c for c in channels if c.get('channel-type') == 'main']
+            if len(main) != 1:
+                raise QMPError("exactly one 'main' channel is required")
+            addr = main[0]['addr']
+            if addr.get('transport') != 'socket':
+                raise QMPError(f"transport {addr.get('transport')} is not supported by the mock")
+            if addr['type'] == 'unix':
+                return 'unix', addr['path']
+            if addr['type'] == 'inet':
+                return 'tcp', (addr['host'], int(addr['port']))
+            if addr['type'] == 'fd':
+                return 'fd', addr['str']
+            raise QMPError(f"socket type {addr['type']} is not supported by the mock")
+        if uri.startswith('unix:'):
+            return 'unix', uri[5:]
+        if uri.startswith('tcp:'):
+            host, port = uri[4:].rsplit(':', 1)
+            return 'tcp', (host or '0.0.0.0', int(port))
+        if uri.startswith('fd:'):
+            return 'fd', uri[3:]
+        raise QMPError(f"unsupported migration URI {uri}")
+
+    def take_fd(self, name):
+        """Resolve a getfd name or /dev/fdset/N path; named fds are consumed, like in QEMU."""
+        if name.startswith('/dev/fdset/'):
+            fdset = self.fdsets.get(int(name.rsplit('/', 1)[1]))
+            if not fdset:
+                raise QMPError(f"fdset {name} is empty")
+            return os.dup(fdset[0])
+        if name.isdigit():
+            return int(name)
+        if name not in self.fds:
+            raise QMPError(f"file descriptor named '{name}' has not been found")
+        return self.fds.pop(name)
+
+    def channel_count(self):
+        return 1 + (self.parameters['multifd-channels'] if self.capabilities['multifd'] else 0)
+
+    async def open_channels(self, kind, target):
+        count = self.channel_count()
+        if kind == 'fd':
+            sock = socket.socket(fileno=self.take_fd(target))
+            if count > 1:
+                raise QMPError("multifd needs a connectable address; an fd carries one channel")
+            return [(await asyncio.open_connection(sock=sock))[1]]
+        writers = []
+        for _ in range(count):
+            if kind == 'unix':
+                _, writer = await asyncio.open_unix_connection(target)
+            else:
+                _, writer = await asyncio.open_connection(*target)
+            writers.append(writer)
+        return writers
+
+    # --- outgoing ---------------------------------------------------------
+
+    async def migrate(self, kind, target):
+        self.reset_migration()
+        self.start_time = time.monotonic()
+        self.set_status('setup')
+        try:
+            writers = await self.open_channels(kind, target)
+            self.generator = StreamGenerator(self, writers)
+            self.set_status('active')
+            await self.generator.run()
+            for writer in writers:
+                writer.close()
+            if self.generator.cancelled:
+                self.set_status('cancelled')
+                self.run_state = 'running'
+                self.event('RESUME')
+            else:
+                self.stats['remaining'] = 0
+                self.run_state = 'postmigrate'
+                self.set_status('completed')
+        except (OSError, QMPError) as e:
+            logger.error(f"[{self.name}] outgoing migration failed: {e}")
+            self.set_status('failed')
+            if self.run_state != 'running':
+                self.run_state = 'running'
+                self.event('RESUME')
+
+    # --- incoming ---------------------------------------------------------
+
+    async def migrate_incoming(self, kind, target):
+        self.reset_migration()
+        self.start_time = time.monotonic()
+        self.run_state = 'inmigrate'
+        consumer = StreamConsumer(self)
+
+        async def on_connection(reader, writer):
+            await consumer.consume(reader)
+            writer.close()
+
+        server = None
+        if kind == 'fd':
+            sock = socket.socket(fileno=self.take_fd(target))
+            if sock.getsockopt(socket.SOL_SOCKET, socket.SO_ACCEPTCONN):
+                server = await asyncio.start_server(on_connection, sock=sock)
+            else:
+                reader, writer = await asyncio.open_connection(sock=sock)
+                self.tasks.append(asyncio.create_task(on_connection(reader, writer)))
+        elif kind == 'unix':
+            if os.path.exists(target):
+                os.unlink(target)
+            server = await asyncio.start_unix_server(on_connection, target)
+        else:
+            server = await asyncio.start_server(on_connection, *target)
+        self.set_status('setup')
+        self.tasks.append(asyncio.create_task(self.finish_incoming(consumer, server, kind, target)))
+
+    async def finish_incoming(self, consumer, server, kind, target):
+        await consumer.done.wait()
+        if server:
+            server.close()
+        if kind == 'unix' and os.path.exists(target):
+            os.unlink(target)
+        if consumer.failed:
+            self.set_status('failed')
+            return
+        resumed = self.run_state == 'running'  # Already, if postcopy ran
+        self.run_state = 'running'
+        self.set_status('completed')
+        if not resumed:
+            self.event('RESUME')
+
+    # --- QMP commands -----------------------------------------------------
+
+    def cmd_qmp_capabilities(self, args):
+        return {}
+
+    def cmd_query_status(self, args):
+        return {'status': self.run_state, 'running': self.run_state == 'running', 'singlestep': False}
+
+    def cmd_query_memory_size_summary(self, args):
+        return {'base-memory': self.memory, 'plugged-memory': 0}
+
+    def cmd_migrate_set_capabilities(self, args):
+        for entry in args.get('capabilities', []):
+            if entry['capability'] not in self.capabilities:
+                logger.info(f"[{self.name}] ignoring capability {entry['capability']}")
+            self.capabilities[entry['capability']] = entry['state']
+        return {}
+
+    def cmd_query_migrate_capabilities(self, args):
+        return [{'capability': name, 'state': state} for name, state in self.capabilities.items()]
+
+    def cmd_migrate_set_parameters(self, args):
+        if self.status in ('setup', 'active') and {'multifd-channels', 'multifd-compression'} & set(args):
+            raise QMPError("multifd parameters cannot be changed during migration")
+        self.parameters.update(args)
+        return {}
+
+    def cmd_query_migrate_parameters(self, args):
+        return dict(self.parameters)
+
+    def cmd_calc_dirty_rate(self, args):
+        self.dirty_rate_measured = time.monotonic() + args.get('calc-time', 1)
+        return {}
+
+    def cmd_query_dirty_rate(self, args):
+        if time.monotonic() < self.dirty_rate_measured:
+            return {'status': 'measuring'}
+        return {'status': 'measured', 'dirty-rate': int(self.dirty_rate / (1024 * 1024))}
+
+    def cmd_getfd(self, args, fds=()):
+        if not fds:
+            raise QMPError("no file descriptor supplied via SCM_RIGHTS")
+        self.fds[args['fdname']] = fds[-1]
+        return {}
+
+    def cmd_add_fd(self, args, fds=()):
+        if not fds:
+            raise QMPError("no file descriptor supplied via SCM_RIGHTS")
+        fdset_id = args.get('fdset-id', max(self.fdsets, default=-1) + 1)
+        self.fdsets.setdefault(fdset_id, []).append(fds[-1])
+        return {'fdset-id': fdset_id, 'fd': fds[-1]}
+
+    def cmd_remove_fd(self, args):
+        for fd in self.fdsets.pop(args['fdset-id'], []):
+            os.close(fd)
+        return {}
+
+    def cmd_migrate(self, args):
+        if self.status in ('setup', 'active', 'device', 'postcopy-active'):
+            raise QMPError("There's a migration process in progress")
+        kind, target = self.parse_address(args.get('uri'), args.get('channels'))
+        self.tasks.append(asyncio.create_task(self.migrate(kind, target)))
+        return {}
+
+    async def cmd_migrate_incoming(self, args):
+        kind, target = self.parse_address(args.get('uri'), args.get('channels'))
+        # Listening before returning is what lets callers connect right away
+        await self.migrate_incoming(kind, target)
+        return {}
+
+    def cmd_migrate_start_postcopy(self, args):
+        if not self.capabilities['postcopy-ram']:
+            raise QMPError("Enable postcopy with migrate_set_capability before the start of migration")
+        if not self.generator or self.status != 'active':
+            raise QMPError("Postcopy must be started after migration has been started")
+        self.generator.postcopy_requested = True
+        return {}
+
+    def cmd_migrate_cancel(self, args):
+        if self.generator:
+            self.generator.cancelled = True
+            self.set_status('cancelling')
+        return {}
+
+    def cmd_query_migrate(self, args):
+        if self.status == 'none':
+            return {}
+        info = {'status': self.status}
+        end = self.end_time or time.monotonic()
+        info['total-time'] = int((end - self.start_time) * 1000)
+        if self.generator:
+            info['setup-time'] = 0
+            info['expected-downtime'] = self.expected_downtime
+            if self.downtime is not None and self.status == 'completed':
+                info['downtime'] = self.downtime
+            ram = dict(self.stats)
+            ram['total'] = self.memory
+            ram['page-size'] = self.page_size
+            ram['mbps'] = round(self.bandwidth * 8 / 1e6, 3)
+            ram['pages-per-second'] = int(self.bandwidth / self.page_size)
+            info['ram'] = ram
+        return info
+
+    async def execute(self, command, args, fds):
+        handler = getattr(self, 'cmd_' + command.replace('-', '_'), None)
+        if handler is None:
+            raise QMPError(f"The command {command} has not been found", 'CommandNotFound')
+        result = handler(args, fds) if command in ('getfd', 'add-fd') else handler(args)
+        if asyncio.iscoroutine(result):
+            result = await result
+        return result
+
+class QMPConnection:
+    """One QMP client on a raw socket, so SCM_RIGHTS file descriptors can be received."""
+    def __init__(self, vm, sock):
+        self.vm = vm
+        self.sock = sock
+        self.lock = asyncio.Lock()
+        self.pending_fds = []
+
+    def send(self, message):
+        # Ordered by the FIFO lock; events may be sent from any task
+        asyncio.get_running_loop().create_task(self.write(message))
+
+    async def write(self, message):
+        async with self.lock:
+            try:
+                await asyncio.get_running_loop().sock_sendall(self.sock, json.dumps(message).encode() + b'\r\n')
+            except OSError:
+                pass
+
+    async def recvmsg(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                return self.sock.recvmsg(65536, socket.CMSG_SPACE(16 * 4))
+            except BlockingIOError:
+                ready = loop.create_future()
+                loop.add_reader(self.sock.fileno(), ready.set_result, None)
+                try:
+                    await ready
+                finally:
+                    loop.remove_reader(self.sock.fileno())
+
+    async def serve(self):
+        self.vm.clients.append(self)
+        await self.write({'QMP': {'version': {'qemu': {'major': 9, 'minor': 0, 'micro': 0}, 'package': 'mock'},
+                                  'capabilities': []}})
+        decoder = json.JSONDecoder()
+        buffer = ''
+        try:
+            while True:
+                buffer = buffer.lstrip()
+                try:
+                    message, end = decoder.raw_decode(buffer)
+                except ValueError:
+                    try:
+                        data, ancdata, _, _ = await self.recvmsg()
+                    except ConnectionError:
+                        return
+                    if not data:
+                        return
+                    for level, kind, payload in ancdata:
+                        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+                            count = len(payload) // 4
+                            self.pending_fds.extend(struct.unpack(f'{count}i', payload[:count * 4]))
+                    buffer += data.decode()
+                    continue
+                buffer = buffer[end:]
+                await self.handle(message)
+        finally:
+            self.vm.clients.remove(self)
+            self.sock.close()
+
+    async def handle(self, message):
+        command = message.get('execute') or message.get('exec-oob')
+        fds, self.pending_fds = self.pending_fds, []
+        try:
+            response = {'return': await self.vm.execute(command, message.get('arguments', {}), fds)}
+        except QMPError as e:
+            response = {'error': {'class': e.error_class, 'desc': str(e)}}
+        except (KeyError, ValueError, OSError) as e:
+            response = {'error': {'class': 'GenericError', 'desc': f"{type(e).__name__}: {e}"}}
+        if 'id' in message:
+            response['id'] = message['id']
+        await self.write(response)
+
+async def serve(vm, qmp_path):
+    if os.path.exists(qmp_path):
+        os.unlink(qmp_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(qmp_path)
+    server.listen(8)
+    server.setblocking(False)
+    loop = asyncio.get_running_loop()
+    logger.info(f"[{vm.name}] QMP on {qmp_path} | {vm.memory / 2 ** 30:.2f} GiB RAM | "
+                f"dirty {vm.dirty_rate / (1024 * 1024):.1f} MB/s | zero pages {vm.zero_fraction:.0%}")
+    try:
+        while True:
+            sock, _ = await loop.sock_accept(server)
+            sock.setblocking(False)
+            loop.create_task(QMPConnection(vm, sock).serve())
+    finally:
+        server.close()
+        os.unlink(qmp_path)
+
+def main():
+    parser = argparse.ArgumentParser(description='Mock QEMU QMP monitor and migration stream for offline benchmarks')
+    parser.add_argument('--qmp', default='/tmp/qemu-monitor.sock', help='QMP unix socket to listen on')
+    parser.add_argument('--name', default='mock-vm', help='Name used in log lines')
+    parser.add_argument('--memory', type=float, default=1.0, help='Guest RAM in GiB (default: 1)')
+    parser.add_argument('--dirty-rate', type=float, default=50.0, help='Guest dirty rate in MB/s (default: 50)')
+    parser.add_argument('--zero-fraction', type=float, default=0.3,
+                        help='Fraction of pages that are zero (default: 0.3)')
+    parser.add_argument('--page-size', type=int, default=4096, help='Page size in bytes (default: 4096)')
+    parser.add_argument('--incoming', action='store_true', help='Start in the inmigrate state, like -incoming defer')
+    args = parser.parse_args()
+
+    vm = MockVM(args.name, int(args.memory * 2 ** 30), args.dirty_rate * 1024 * 1024, args.zero_fraction,
+                args.page_size, args.incoming)
+    try:
+        asyncio.run(serve(vm, args.qmp))
+    except KeyboardInterrupt:
+        logger.info(f"[{vm.name}] stopped")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,518 @@
+#!/usr/bin/env python3
+"""Helpers shared by the proxy-perf tcp and websocket benchmarks.
+
+The scripts in tcp/ and websocket/ import this module from the parent directory.
+"""
+import fcntl
+import logging
+import mmap
+import os
+import random
+import resource
+import socket
+import ssl
+import struct
+import threading
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+def cpu_hz():
+    """Best-effort nominal CPU frequency in Hz, or None if unknown."""
+    try:
+        with open('/sys/devices/system/cpu/cpu0/cpufreq/cpuinfo_max_freq') as f:
+            return int(f.read().strip()) * 1000
+    except (OSError, ValueError):
+        pass
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('cpu MHz'):
+                    return float(line.split(':')[1]) * 1e6
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+class CPUAccounting:
+    """CPU time, context switches and syscall counts accumulated since creation.
+
+    who is RUSAGE_SELF for the whole process, RUSAGE_THREAD for the calling
+    thread (create and report from that thread) or RUSAGE_CHILDREN for reaped
+    child processes.
+    """
+    def __init__(self, who=resource.RUSAGE_SELF):
+        self.who = who
+        self.start_time = time.time()
+        self.start = self.snapshot()
+
+    def snapshot(self):
+        usage = resource.getrusage(self.who)
+        counters = {
+            'user': usage.ru_utime,
+            'sys': usage.ru_stime,
+            'voluntary': usage.ru_nvcsw,
+            'involuntary': usage.ru_nivcsw,
+        }
+        # Read/write syscall counts are only exposed for our own process and threads
+        io_path = {resource.RUSAGE_SELF: '/proc/self/io',
+                   resource.RUSAGE_THREAD: '/proc/thread-self/io'}.get(self.who)
+        if io_path:
+            try:
+                with open(io_path) as f:
+                    for line in f:
+                        key, value = line.split(':')
+                        if key in ('syscr', 'syscw'):
+                            counters[key] = int(value)
+            except (OSError, ValueError):
+                pass
+        return counters
+
+    def log_report(self, total_bytes):
+        """Log CPU usage and cost per byte moved since creation."""
+        end = self.snapshot()
+        delta = {key: end[key] - self.start[key] for key in end if key in self.start}
+        wall_time = time.time() - self.start_time
+        cpu_time = delta['user'] + delta['sys']
+        core_pct = cpu_time / wall_time * 100 if wall_time > 0 else 0
+
+        logger.info(f"CPU: user {delta['user']:.2f}s | sys {delta['sys']:.2f}s | "
+                    f"total {cpu_time:.2f}s ({core_pct:.0f}% of one core)")
+        logger.info(f"Context switches: voluntary {delta['voluntary']} | "
+                    f"involuntary {delta['involuntary']}")
+        if 'syscr' in delta:
+            logger.info(f"Syscalls: read {delta['syscr']} | write {delta['syscw']}")
+        if total_bytes > 0 and cpu_time > 0:
+            cost = f"Cost: {cpu_time / (total_bytes / 1e9):.3f} CPU-s/GB"
+            hz = cpu_hz()
+            if hz:
+                cost += f" | {total_bytes / (cpu_time * hz):.3f} bytes/cycle (@ {hz / 1e9:.2f} GHz)"
+            logger.info(cost)
+
+# Linux socket option; not exported by every Python build
+SO_MAX_PACING_RATE = getattr(socket, 'SO_MAX_PACING_RATE', 47)
+
+class TokenBucketPacer:
+    """Token-bucket pacer that tracks send deadlines with a bounded burst.
+
+    Tokens accrue at the target rate from a monotonic clock, so time spent
+    sending and oversleeping is credited back instead of being lost.
+    """
+    def __init__(self, target_bps, burst_bytes, min_sleep=0.0005):
+        self.rate = float(target_bps)
+        self.burst = float(burst_bytes)
+        self.min_sleep = min_sleep
+        self.tokens = self.burst
+        self.last = time.perf_counter()
+        self.sleeps = 0
+        self.max_lateness = 0.0
+
+    def reserve(self, nbytes):
+        """Take tokens for nbytes and return how long to wait before the next send."""
+        now = time.perf_counter()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        self.tokens -= nbytes
+        if self.tokens >= 0:
+            return 0.0
+        delay = -self.tokens / self.rate
+        # Short debts are carried forward rather than slept off
+        return delay if delay >= self.min_sleep else 0.0
+
+    def wait(self, nbytes):
+        """Block until nbytes may be sent without exceeding the target rate."""
+        delay = self.reserve(nbytes)
+        if delay > 0:
+            deadline = time.perf_counter() + delay
+            time.sleep(delay)
+            self.sleeps += 1
+            self.max_lateness = max(self.max_lateness, time.perf_counter() - deadline)
+
+def set_kernel_pacing(sock, target_bps):
+    """Ask the kernel to pace the socket via SO_MAX_PACING_RATE (bytes/s)."""
+    rate = min(int(target_bps), 0xFFFFFFFE)  # 32-bit on older kernels; ~0U means unlimited
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_MAX_PACING_RATE, rate)
+        logger.info(f"Kernel pacing enabled: SO_MAX_PACING_RATE={rate} bytes/s")
+        return True
+    except OSError as e:
+        logger.warning(f"Kernel pacing unavailable, falling back to token bucket: {e}")
+        return False
+
+def log_pacing_stats(target_mbps, avg_mbps, interval_rates, pacer=None):
+    """Report achieved rate against target, and per-second rate jitter."""
+    if not target_mbps:
+        return
+    error_pct = (avg_mbps - target_mbps) / target_mbps * 100
+    logger.info(f"Target bandwidth: {target_mbps:.2f} MBps | "
+                f"Achieved: {avg_mbps:.2f} MBps ({error_pct:+.2f}%)")
+    if len(interval_rates) > 1:
+        mean = sum(interval_rates) / len(interval_rates)
+        jitter = (sum((r - mean) ** 2 for r in interval_rates) / (len(interval_rates) - 1)) ** 0.5
+        logger.info(f"Interval rate jitter: {jitter:.2f} MBps stddev | "
+                    f"Min: {min(interval_rates):.2f} MBps | Max: {max(interval_rates):.2f} MBps")
+    if pacer and pacer.sleeps:
+        logger.info(f"Pacer sleeps: {pacer.sleeps} | "
+                    f"Max wakeup lateness: {pacer.max_lateness * 1000:.3f} ms")
+
+TLS_VERSIONS = {
+    '1.2': ssl.TLSVersion.TLSv1_2,
+    '1.3': ssl.TLSVersion.TLSv1_3,
+}
+# Longer than HandshakePhase.IDLE_GAP, so each sender test gets its own server report
+HANDSHAKE_PHASE_PAUSE = 3.0
+
+class HandshakePhase:
+    """Handshake counts and server CPU for one burst of client activity.
+
+    A pause of more than IDLE_GAP seconds between handshakes ends the phase,
+    so each cell of a client-side benchmark matrix gets its own report.
+    """
+    IDLE_GAP = 2.0
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start_time = None
+        self.last_time = None
+        self.usage = resource.getrusage(resource.RUSAGE_SELF)
+        self.completed = 0
+        self.failed = 0
+        self.handshake_ns = 0
+        self.kinds = {}  # (TLS version, resumed) -> count
+
+    def record(self, version, resumed, elapsed_ns=0):
+        with self.lock:
+            now = time.time()
+            if self.start_time is None:
+                self.start_time = now
+            self.last_time = now
+            self.completed += 1
+            self.handshake_ns += elapsed_ns
+            key = (version, resumed)
+            self.kinds[key] = self.kinds.get(key, 0) + 1
+
+    def record_failure(self):
+        with self.lock:
+            self.failed += 1
+
+    def idle(self):
+        return self.last_time is not None and time.time() - self.last_time > self.IDLE_GAP
+
+    def log_report(self):
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        cpu_time = (usage.ru_utime - self.usage.ru_utime) + (usage.ru_stime - self.usage.ru_stime)
+        duration = max(self.last_time - self.start_time, 1e-9)
+        mix = " | ".join(f"{version} {'resumed' if resumed else 'full'}: {count}"
+                         for (version, resumed), count in sorted(self.kinds.items()))
+
+        logger.info("=" * 60)
+        logger.info("HANDSHAKE PHASE RESULTS:")
+        logger.info(f"Duration: {duration:.2f} seconds")
+        logger.info(f"Handshakes: {self.completed} ({self.completed / duration:.1f}/s) | Failed: {self.failed}")
+        logger.info(f"Mix: {mix}")
+        if self.handshake_ns:
+            logger.info(f"Avg server-side handshake: {self.handshake_ns / self.completed / 1e6:.2f} ms")
+        logger.info(f"Server CPU: {cpu_time:.2f}s | {cpu_time / self.completed * 1000:.3f} CPU-ms per handshake | "
+                    f"{cpu_time / duration * 100:.0f}% of one core")
+        logger.info("=" * 60)
+
+# First byte (TCP) or message (WebSocket) of a latency-test connection:
+# echo requests or sink a bulk stream
+ECHO_MODE = b'E'
+BULK_MODE = b'B'
+
+class LatencyHistogram:
+    """Log-linear latency histogram in the style of HdrHistogram.
+
+    Values are recorded in nanoseconds. Each power-of-two range is split into
+    linear sub-buckets, keeping relative error below 1% at any magnitude while
+    using a fixed, small amount of memory.
+    """
+    def __init__(self, sub_bucket_bits=8):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.sub_bucket_count = 1 << sub_bucket_bits
+        self.half_count = self.sub_bucket_count // 2
+        self.counts = [0] * (self.sub_bucket_count + (64 - sub_bucket_bits) * self.half_count)
+        self.total = 0
+        self.sum = 0
+        self.min = None
+        self.max = 0
+
+    def _index(self, value):
+        if value < self.sub_bucket_count:
+            return value
+        shift = value.bit_length() - self.sub_bucket_bits
+        return self.sub_bucket_count + (shift - 1) * self.half_count + (value >> shift) - self.half_count
+
+    def _value_at(self, index):
+        if index < self.sub_bucket_count:
+            return index
+        shift = (index - self.sub_bucket_count) // self.half_count + 1
+        sub_bucket = (index - self.sub_bucket_count) % self.half_count + self.half_count
+        # Middle of the bucket's value range
+        return (sub_bucket << shift) + (1 << shift) // 2
+
+    def record(self, value_ns):
+        value_ns = max(0, int(value_ns))
+        self.counts[self._index(value_ns)] += 1
+        self.total += 1
+        self.sum += value_ns
+        self.min = value_ns if self.min is None else min(self.min, value_ns)
+        self.max = max(self.max, value_ns)
+
+    def merge(self, other):
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.total += other.total
+        self.sum += other.sum
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percent):
+        if self.total == 0:
+            return 0
+        target = max(1, -(-self.total * percent // 100))  # ceil without floats
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self._value_at(index), self.max)
+        return self.max
+
+    def log_summary(self, title, duration_seconds):
+        """Log request rate and latency percentiles in microseconds."""
+        if self.total == 0:
+            logger.info(f"{title}: no samples recorded")
+            return
+        logger.info(f"{title}: {self.total} requests | "
+                    f"{self.total / duration_seconds:.0f} req/s")
+        logger.info(f"Latency (us): min {self.min / 1000:.1f} | "
+                    f"mean {self.sum / self.total / 1000:.1f} | "
+                    f"max {self.max / 1000:.1f}")
+        logger.info(f"Percentiles (us): "
+                    f"p50 {self.percentile(50) / 1000:.1f} | "
+                    f"p90 {self.percentile(90) / 1000:.1f} | "
+                    f"p99 {self.percentile(99) / 1000:.1f} | "
+                    f"p99.9 {self.percentile(99.9) / 1000:.1f}")
+
+PAGE_SIZE = 4096
+PAYLOAD_MAGIC = b'MPAY'
+
+class PayloadGenerator:
+    """Realistic migration-like payload, framed for end-to-end verification.
+
+    The stream starts with PAYLOAD_MAGIC and the block size, followed by
+    blocks of payload each trailed by their CRC-32, so a receiver can check
+    integrity at line rate without knowing how the data was generated.
+    """
+    MODES = ('random', 'zero', 'mixed', 'file')
+
+    def __init__(self, mode, image_path=None, block_size=1024 * 1024, cycle_size=64 * 1024 * 1024,
+                 mix=(0.4, 0.3, 0.3), seed=0):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown payload mode {mode!r}, expected one of {self.MODES}")
+        self.mode = mode
+        self.block_size = block_size
+        self.header = PAYLOAD_MAGIC + struct.pack('!I', block_size)
+        self.raw = self.generate(mode, image_path, cycle_size, mix, seed)
+
+        frames = []
+        for offset in range(0, len(self.raw), block_size):
+            block = self.raw[offset:offset + block_size]
+            frames.append(block)
+            frames.append(struct.pack('!I', zlib.crc32(block)))
+        self.stream = memoryview(b''.join(frames))
+        self.offset = 0
+
+    def generate(self, mode, image_path, cycle_size, mix, seed):
+        """Build one cycle of raw payload, a whole number of blocks long."""
+        cycle_size -= cycle_size % self.block_size
+        if mode == 'random':
+            return os.urandom(cycle_size)
+        if mode == 'zero':
+            return bytes(cycle_size)
+        if mode == 'file':
+            with open(image_path, 'rb') as f:
+                data = f.read(cycle_size)
+            if len(data) < self.block_size:
+                raise ValueError(f"Memory image {image_path} is smaller than one block")
+            return data[:len(data) - len(data) % self.block_size]
+
+        # Mixed pages: zero, incompressible and text-like compressible pages
+        rng = random.Random(seed)
+        zero_page = bytes(PAGE_SIZE)
+        zero_fraction, random_fraction, _ = mix
+        pages = []
+        for _ in range(cycle_size // PAGE_SIZE):
+            roll = rng.random()
+            if roll < zero_fraction:
+                pages.append(zero_page)
+            elif roll < zero_fraction + random_fraction:
+                pages.append(rng.randbytes(PAGE_SIZE))
+            else:
+                pattern = rng.randbytes(rng.choice((16, 64, 256)))
+                pages.append((pattern * (PAGE_SIZE // len(pattern) + 1))[:PAGE_SIZE])
+        return b''.join(pages)
+
+    def next_chunk(self, size):
+        """Return the next slice of the framed stream, wrapping at the end of the cycle."""
+        chunk = self.stream[self.offset:self.offset + size]
+        self.offset = (self.offset + len(chunk)) % len(self.stream)
+        return chunk
+
+    def log_profile(self):
+        """Log how much zero-page detection, dedup and compression could save."""
+        pages = [self.raw[i:i + PAGE_SIZE] for i in range(0, len(self.raw), PAGE_SIZE)]
+        zero_page = bytes(PAGE_SIZE)
+        nonzero_pages = [page for page in pages if page != zero_page]
+        zero_pages = len(pages) - len(nonzero_pages)
+        # Zero pages are skipped by QEMU anyway; dedup only matters for the rest
+        duplicate_pages = len(nonzero_pages) - len(set(nonzero_pages))
+        sample = self.raw[:16 * 1024 * 1024]
+        compressed = len(zlib.compress(sample, 1))
+
+        logger.info(f"Payload: {self.mode} | cycle {len(self.raw) / (1024*1024):.0f} MB | "
+                    f"block {self.block_size // 1024} KB + CRC-32")
+        logger.info(f"Payload profile: zero pages {zero_pages / len(pages) * 100:.1f}% | "
+                    f"duplicate non-zero pages {duplicate_pages / len(pages) * 100:.1f}% | "
+                    f"zlib-1 ratio {len(sample) / compressed:.2f}x")
+
+class PayloadVerifier:
+    """Check the CRC-32 of every block of a framed payload stream as it arrives."""
+    def __init__(self):
+        self.header = bytearray()
+        self.block_size = None
+        self.enabled = True
+        self.position = 0
+        self.crc = 0
+        self.trailer = bytearray()
+        self.blocks_ok = 0
+        self.blocks_corrupt = 0
+
+    def feed(self, data):
+        if not self.enabled:
+            return
+        data = memoryview(data)
+        if self.block_size is None:
+            needed = 8 - len(self.header)
+            self.header += data[:needed]
+            data = data[needed:]
+            if len(self.header) < 8:
+                return
+            if bytes(self.header[:4]) != PAYLOAD_MAGIC:
+                logger.error("Stream has no payload header, integrity verification disabled")
+                self.enabled = False
+                return
+            self.block_size = struct.unpack('!I', self.header[4:])[0]
+
+        while data:
+            if self.position < self.block_size:
+                take = min(self.block_size - self.position, len(data))
+                self.crc = zlib.crc32(data[:take], self.crc)
+                self.position += take
+                data = data[take:]
+                continue
+            take = 4 - len(self.trailer)
+            self.trailer += data[:take]
+            data = data[take:]
+            if len(self.trailer) == 4:
+                if struct.unpack('!I', self.trailer)[0] == self.crc:
+                    self.blocks_ok += 1
+                else:
+                    self.blocks_corrupt += 1
+                    if self.blocks_corrupt <= 10:
+                        logger.error(f"Corrupt block #{self.blocks_ok + self.blocks_corrupt}")
+                self.position = 0
+                self.crc = 0
+                self.trailer.clear()
+
+    def log_report(self):
+        if not self.enabled:
+            return
+        logger.info(f"Integrity: {self.blocks_ok} blocks verified | "
+                    f"{self.blocks_corrupt} corrupt")
+
+class StreamRecorder:
+    """Write a received stream to disk in large writes, plus a timing index.
+
+    Data is gathered in a page-aligned 8 MB buffer so it can be written with
+    O_DIRECT. The index file (<path>.idx) holds (byte offset, seconds since
+    the first byte) pairs, letting a replay follow the original timing.
+    """
+    BUFFER_SIZE = 8 * 1024 * 1024
+    INDEX_INTERVAL = 0.001
+
+    def __init__(self, path, direct=False):
+        self.path = path
+        flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+        try:
+            self.fd = os.open(path, flags | (os.O_DIRECT if direct else 0), 0o644)
+        except OSError as e:
+            if not direct:
+                raise
+            logger.warning(f"O_DIRECT not supported for {path} ({e}), using buffered writes")
+            self.fd = os.open(path, flags, 0o644)
+        self.buffer = mmap.mmap(-1, self.BUFFER_SIZE)
+        self.fill = 0
+        self.total_bytes = 0
+        self.index = open(path + '.idx', 'wb')
+        self.start_time = None
+        self.last_index_time = 0.0
+
+    def write(self, data):
+        now = time.perf_counter()
+        if self.start_time is None:
+            self.start_time = now
+        view = memoryview(data)
+        while view:
+            take = min(len(view), self.BUFFER_SIZE - self.fill)
+            self.buffer[self.fill:self.fill + take] = view[:take]
+            self.fill += take
+            view = view[take:]
+            if self.fill == self.BUFFER_SIZE:
+                self._write_out(memoryview(self.buffer))
+                self.fill = 0
+        self.total_bytes += len(data)
+        if now - self.last_index_time >= self.INDEX_INTERVAL:
+            self.index.write(struct.pack('!Qd', self.total_bytes, now - self.start_time))
+            self.last_index_time = now
+
+    def _write_out(self, view):
+        while view:
+            written = os.write(self.fd, view)
+            view = view[written:]
+
+    def close(self):
+        if self.fill:
+            # The tail is not block aligned, so write it without O_DIRECT
+            fcntl.fcntl(self.fd, fcntl.F_SETFL, fcntl.fcntl(self.fd, fcntl.F_GETFL) & ~os.O_DIRECT)
+            self._write_out(memoryview(self.buffer)[:self.fill])
+        if self.start_time is not None:
+            self.index.write(struct.pack('!Qd', self.total_bytes, time.perf_counter() - self.start_time))
+        self.index.close()
+        self.buffer.close()
+        os.close(self.fd)
+        logger.info(f"Recorded {self.total_bytes / (1024*1024):.2f} MB to {self.path}")
+
+REPLAY_SLICE = 1024 * 1024
+
+def load_replay_schedule(record_path, size, paced):
+    """Return (end offset, seconds since start) pairs to replay a recording.
+
+    Paced replays follow the timing index written by the recorder; otherwise
+    the whole file is due immediately.
+    """
+    if not paced:
+        return [(size, 0.0)]
+    try:
+        with open(record_path + '.idx', 'rb') as f:
+            index = f.read()
+    except OSError as e:
+        logger.warning(f"No timing index for {record_path} ({e}), replaying unpaced")
+        return [(size, 0.0)]
+    entry_size = struct.calcsize('!Qd')
+    schedule = [struct.unpack_from('!Qd', index, pos)
+                for pos in range(0, len(index) - entry_size + 1, entry_size)]
+    return [(min(offset, size), at) for offset, at in schedule] or [(size, 0.0)]
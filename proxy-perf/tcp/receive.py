@@ -3,7 +3,18 @@ import ssl
 import time
 import logging
 import os
+import sys
+import resource
 import threading
+import multiprocessing
+import signal
+from concurrent.futures import ThreadPoolExecutor
+# Helpers shared by the tcp and websocket benchmarks
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from perf_common import BULK_MODE, ECHO_MODE, CPUAccounting, HandshakePhase, PayloadVerifier, StreamRecorder
+# TLS profiles shared with the migrate-websocket proxies
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'migrate-websocket'))
+from websocket_common import TLS_PROFILES, apply_tls_profile
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -14,7 +25,10 @@ class TCPReceiver:
         self.port = port
         self.cert_dir = cert_dir
         self.buffer_size = 8192
-        
+        self.drain_buffer_size = 256 * 1024  # recv_into buffer for the multi-process server
+        self.verify_payload = False  # Check CRC-32 framed payloads from the senders
+        self.tls_profile = 'default'  # Key into TLS_PROFILES
+
     def create_ssl_context(self):
         """Create SSL context for secure TCP server."""
         ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
@@ -30,6 +44,7 @@ class TCPReceiver:
         ssl_context.load_cert_chain(cert_file, key_file)
         ssl_context.verify_mode = ssl.CERT_REQUIRED
         ssl_context.load_verify_locations(ca_file)
+        apply_tls_profile(ssl_context, self.tls_profile)
         
         return ssl_context
     
@@ -45,7 +60,7 @@ class TCPReceiver:
             unix_sock.close()
             return None
         
-    def handle_client_unix(self, ssl_sock, client_addr, unix_socket_path):
+    def handle_client_unix(self, ssl_sock, client_addr, unix_socket_path, preamble=b''):
         """Handle incoming TCP connection and forward data to Unix socket."""
         logger.info(f"Client connected from {client_addr}")
         
@@ -57,7 +72,13 @@ class TCPReceiver:
             return
         
         try:
+            if preamble:
+                unix_sock.sendall(preamble)
+
             start_time = time.time()
+            # Several connections run at once, each in its own thread
+            cpu = CPUAccounting(resource.RUSAGE_THREAD)
+            verifier = PayloadVerifier() if self.verify_payload else None
             bytes_received = 0
             chunks_received = 0
             last_report_time = start_time
@@ -71,6 +92,8 @@ class TCPReceiver:
                     
                     # Forward data to Unix socket
                     unix_sock.sendall(data)
+                    if verifier:
+                        verifier.feed(data)
                     
                     bytes_received += len(data)
                     chunks_received += 1
@@ -118,18 +141,23 @@ class TCPReceiver:
                 logger.info(f"Chunks received: {chunks_received}")
                 logger.info(f"Average bandwidth: {avg_mbps:.2f} MBps")
                 logger.info(f"Average throughput: {total_mb/total_time:.2f} MB/s")
+                cpu.log_report(bytes_received)
+                if verifier:
+                    verifier.log_report()
                 logger.info("=" * 60)
             
             logger.info(f"Client {client_addr} disconnected")
             unix_sock.close()
             ssl_sock.close()
         
-    def handle_client(self, ssl_sock, client_addr):
+    def handle_client(self, ssl_sock, client_addr, recorder=None):
         """Handle incoming TCP connection and measure receive bandwidth."""
         logger.info(f"Client connected from {client_addr}")
         
         try:
             start_time = time.time()
+            cpu = CPUAccounting(resource.RUSAGE_THREAD)
+            verifier = PayloadVerifier() if self.verify_payload else None
             bytes_received = 0
             chunks_received = 0
             last_report_time = start_time
@@ -140,6 +168,10 @@ class TCPReceiver:
                     data = ssl_sock.recv(self.buffer_size)
                     if not data:
                         break
+                    if verifier:
+                        verifier.feed(data)
+                    if recorder:
+                        recorder.write(data)
                         
                     bytes_received += len(data)
                     chunks_received += 1
@@ -183,14 +215,89 @@ class TCPReceiver:
                 logger.info(f"Chunks received: {chunks_received}")
                 logger.info(f"Average bandwidth: {avg_mbps:.2f} MBps")
                 logger.info(f"Average throughput: {total_mb/total_time:.2f} MB/s")
+                cpu.log_report(bytes_received)
+                if verifier:
+                    verifier.log_report()
                 logger.info("=" * 60)
             
             logger.info(f"Client {client_addr} disconnected")
+            if recorder:
+                recorder.close()
             ssl_sock.close()
         
-    def start_server(self, unix_socket_path=None):
-        """Start the TCP server."""
-        ssl_context = self.create_ssl_context()
+    def recv_exact(self, sock, nbytes):
+        """Read exactly nbytes from sock."""
+        data = bytearray(nbytes)
+        view = memoryview(data)
+        received = 0
+        while received < nbytes:
+            count = sock.recv_into(view[received:])
+            if count == 0:
+                raise ConnectionError("peer closed the connection")
+            received += count
+        return data
+
+    def handle_client_latency(self, sock, client_addr, unix_socket_path=None):
+        """Serve a latency-test connection: echo requests or sink a bulk stream.
+
+        The first byte selects the mode. With unix_socket_path set, both are
+        relayed through the Unix socket so the whole hybrid chain is measured.
+        """
+        try:
+            mode = sock.recv(1)
+        except (ConnectionResetError, ssl.SSLError) as e:
+            logger.info(f"Client {client_addr} disconnected: {e}")
+            sock.close()
+            return
+
+        if mode == BULK_MODE:
+            if unix_socket_path:
+                self.handle_client_unix(sock, client_addr, unix_socket_path, preamble=BULK_MODE)
+            else:
+                self.handle_client(sock, client_addr)
+            return
+        if mode != ECHO_MODE:
+            logger.warning(f"Client {client_addr} sent unknown latency mode {mode!r}")
+            sock.close()
+            return
+
+        unix_sock = None
+        if unix_socket_path:
+            unix_sock = self.create_unix_socket_client(unix_socket_path)
+            if not unix_sock:
+                logger.error(f"Cannot relay requests for client {client_addr} - Unix socket connection failed")
+                sock.close()
+                return
+
+        round_trips = 0
+        try:
+            if unix_sock:
+                unix_sock.sendall(ECHO_MODE)
+            while True:
+                data = sock.recv(self.buffer_size)
+                if not data:
+                    break
+                if unix_sock:
+                    # Relay the request and wait for the same number of echoed bytes
+                    unix_sock.sendall(data)
+                    data = self.recv_exact(unix_sock, len(data))
+                sock.sendall(data)
+                round_trips += 1
+        except (ConnectionError, ssl.SSLError) as e:
+            logger.info(f"Client {client_addr} disconnected: {e}")
+        finally:
+            logger.info(f"Latency client {client_addr} disconnected after {round_trips} echoes")
+            if unix_sock:
+                unix_sock.close()
+            sock.close()
+
+    def start_server(self, unix_socket_path=None, latency=False, use_tls=True, record_path=None, direct_io=False):
+        """Start the TCP server.
+
+        With record_path set, each client's stream is written to
+        <record_path>.<n> for later replay.
+        """
+        ssl_context = self.create_ssl_context() if use_tls else None
         
         # Create server socket
         server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -199,29 +306,48 @@ class TCPReceiver:
         server_sock.listen(5)
         
         logger.info(f"TCP bandwidth test server listening on {self.host}:{self.port}")
+        if latency:
+            logger.info(f"Latency echo mode ({'TLS' if use_tls else 'plain TCP'})")
         if unix_socket_path:
             logger.info(f"Data will be forwarded to Unix socket: {unix_socket_path}")
+        if record_path:
+            logger.info(f"Recording client streams to {record_path}.<n>{' with O_DIRECT' if direct_io else ''}")
         logger.info("Waiting for client connections...")
         logger.info("Server supports multiple concurrent connections")
         
+        connection_count = 0
         try:
             while True:
                 client_sock, client_addr = server_sock.accept()
                 
                 # Wrap client socket with SSL
-                ssl_sock = ssl_context.wrap_socket(client_sock, server_side=True)
+                if ssl_context:
+                    ssl_sock = ssl_context.wrap_socket(client_sock, server_side=True)
+                else:
+                    ssl_sock = client_sock
                 
                 # Handle each client in a separate thread
-                if unix_socket_path:
+                if latency:
+                    ssl_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    client_thread = threading.Thread(
+                        target=self.handle_client_latency,
+                        args=(ssl_sock, client_addr, unix_socket_path),
+                        daemon=True
+                    )
+                elif unix_socket_path:
                     client_thread = threading.Thread(
                         target=self.handle_client_unix,
                         args=(ssl_sock, client_addr, unix_socket_path),
                         daemon=True
                     )
                 else:
+                    connection_count += 1
+                    recorder = None
+                    if record_path:
+                        recorder = StreamRecorder(f"{record_path}.{connection_count}", direct=direct_io)
                     client_thread = threading.Thread(
                         target=self.handle_client,
-                        args=(ssl_sock, client_addr),
+                        args=(ssl_sock, client_addr, recorder),
                         daemon=True
                     )
                 client_thread.start()
@@ -233,22 +359,295 @@ class TCPReceiver:
         finally:
             server_sock.close()
 
+    def handle_handshake(self, ssl_context, client_sock, phase):
+        """Complete one TLS handshake, reply with a single byte and close."""
+        ssl_sock = None
+        try:
+            ssl_sock = ssl_context.wrap_socket(client_sock, server_side=True, do_handshake_on_connect=False)
+            handshake_start = time.perf_counter_ns()
+            ssl_sock.do_handshake()
+            elapsed_ns = time.perf_counter_ns() - handshake_start
+            # Writing after the handshake also flushes TLS 1.3 session tickets to the client
+            ssl_sock.sendall(b'H')
+            phase.record(ssl_sock.version(), ssl_sock.session_reused, elapsed_ns)
+        except (ssl.SSLError, OSError) as e:
+            logger.debug(f"Handshake failed: {e}")
+            phase.record_failure()
+        finally:
+            (ssl_sock or client_sock).close()
+
+    def start_server_handshake(self, max_workers=None):
+        """Accept TLS handshakes as fast as possible and report rate and CPU per handshake."""
+        ssl_context = self.create_ssl_context()
+        max_workers = max_workers or 2 * (os.cpu_count() or 1)
+
+        server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server_sock.bind((self.host, self.port))
+        server_sock.listen(1024)
+        server_sock.settimeout(1.0)
+
+        logger.info(f"TLS handshake test server listening on {self.host}:{self.port}")
+        logger.info(f"Handshakes run on {max_workers} threads; OpenSSL releases the GIL while it computes")
+        logger.info("Waiting for client connections...")
+
+        # Handshake threads block in OpenSSL with the GIL released, so a thread pool scales
+        pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="handshake")
+        phase = HandshakePhase()
+        last_report_time = time.time()
+        last_report_count = 0
+        try:
+            while True:
+                try:
+                    client_sock, _ = server_sock.accept()
+                    client_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    pool.submit(self.handle_handshake, ssl_context, client_sock, phase)
+                except socket.timeout:
+                    pass
+
+                current_time = time.time()
+                if current_time - last_report_time >= 1.0:
+                    if phase.completed > last_report_count:
+                        logger.info(f"Handshakes: {phase.completed} | "
+                                    f"Interval: {(phase.completed - last_report_count) / (current_time - last_report_time):.1f}/s | "
+                                    f"Failed: {phase.failed}")
+                    last_report_time = current_time
+                    last_report_count = phase.completed
+                if phase.idle():
+                    phase.log_report()
+                    phase = HandshakePhase()
+                    last_report_count = 0
+
+        except KeyboardInterrupt:
+            logger.info("Shutting down server...")
+        finally:
+            server_sock.close()
+            pool.shutdown(wait=True)
+            if phase.completed:
+                phase.log_report()
+
+    def create_reuseport_socket(self):
+        """Create a listening socket that shares the port with the other worker processes."""
+        server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        server_sock.bind((self.host, self.port))
+        server_sock.listen(128)
+        return server_sock
+
+    def drain_client(self, ssl_context, client_sock, slot):
+        """Complete the TLS handshake and count decrypted bytes into slot until the client closes.
+
+        Returns the handshake duration in seconds, or None if the handshake failed.
+        """
+        try:
+            handshake_start = time.time()
+            ssl_sock = ssl_context.wrap_socket(client_sock, server_side=True)
+            handshake_time = time.time() - handshake_start
+        except (ssl.SSLError, OSError) as e:
+            logger.warning(f"TLS handshake failed: {e}")
+            client_sock.close()
+            return None
+
+        buffer = bytearray(self.drain_buffer_size)
+        try:
+            while True:
+                nbytes = ssl_sock.recv_into(buffer)
+                if nbytes == 0:
+                    break
+                slot[0] += nbytes
+        except (ConnectionResetError, ssl.SSLError, OSError):
+            pass
+        finally:
+            ssl_sock.close()
+        return handshake_time
+
+    def run_worker(self, worker_id, max_connections, bytes_counters, active_counters, handshake_counters):
+        """Worker process: accept on a SO_REUSEPORT socket and serve clients from a thread pool."""
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        ssl_context = self.create_ssl_context()
+        server_sock = self.create_reuseport_socket()
+
+        # Each connection writes only its own slot; the publisher thread sums them
+        slots = []
+        slots_lock = threading.Lock()
+        stats = {'finished_bytes': 0, 'handshakes': 0, 'handshake_time': 0.0}
+        limit = threading.BoundedSemaphore(max_connections)
+        pool = ThreadPoolExecutor(max_workers=max_connections, thread_name_prefix=f"worker{worker_id}")
+
+        def serve(client_sock):
+            slot = [0]
+            handshake_time = None
+            with slots_lock:
+                slots.append(slot)
+            try:
+                handshake_time = self.drain_client(ssl_context, client_sock, slot)
+            finally:
+                with slots_lock:
+                    slots.remove(slot)
+                    stats['finished_bytes'] += slot[0]
+                    if handshake_time is not None:
+                        stats['handshakes'] += 1
+                        stats['handshake_time'] += handshake_time
+                limit.release()
+
+        def publish():
+            while True:
+                with slots_lock:
+                    bytes_counters[worker_id] = stats['finished_bytes'] + sum(slot[0] for slot in slots)
+                    active_counters[worker_id] = len(slots)
+                    handshake_counters[2 * worker_id] = stats['handshakes']
+                    handshake_counters[2 * worker_id + 1] = stats['handshake_time']
+                time.sleep(0.25)
+
+        threading.Thread(target=publish, daemon=True).start()
+
+        while True:
+            # Bound concurrency: excess clients wait in the listen backlog
+            limit.acquire()
+            client_sock, _ = server_sock.accept()
+            client_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            pool.submit(serve, client_sock)
+
+    def start_server_multiprocess(self, num_workers=None, max_connections_per_worker=16):
+        """Spread TLS clients over worker processes sharing the port and report aggregate throughput."""
+        num_workers = num_workers or os.cpu_count() or 1
+        # Fail early on missing certificates rather than inside every worker
+        self.create_ssl_context()
+
+        # Worker CPU is collected from RUSAGE_CHILDREN once they are reaped
+        cpu = CPUAccounting(resource.RUSAGE_CHILDREN)
+        bytes_counters = multiprocessing.Array('d', num_workers, lock=False)
+        active_counters = multiprocessing.Array('i', num_workers, lock=False)
+        handshake_counters = multiprocessing.Array('d', 2 * num_workers, lock=False)
+
+        workers = []
+        for worker_id in range(num_workers):
+            worker = multiprocessing.Process(
+                target=self.run_worker,
+                args=(worker_id, max_connections_per_worker,
+                      bytes_counters, active_counters, handshake_counters),
+                daemon=True
+            )
+            worker.start()
+            workers.append(worker)
+
+        logger.info(f"TCP bandwidth test server listening on {self.host}:{self.port} (SO_REUSEPORT)")
+        logger.info(f"{num_workers} worker processes, up to {max_connections_per_worker} "
+                    f"connections each ({num_workers * max_connections_per_worker} total)")
+        logger.info("Waiting for client connections...")
+
+        start_time = None
+        last_data_time = None
+        last_report_time = time.time()
+        last_report_bytes = 0
+        peak_active = 0
+
+        try:
+            while True:
+                time.sleep(1.0)
+                current_time = time.time()
+                bytes_received = sum(bytes_counters)
+                active = sum(active_counters)
+                peak_active = max(peak_active, active)
+
+                if start_time is None:
+                    if bytes_received == 0:
+                        last_report_time = current_time
+                        continue
+                    start_time = last_report_time
+                if bytes_received > last_report_bytes:
+                    last_data_time = current_time
+
+                elapsed = current_time - start_time
+                interval_mbps = (bytes_received - last_report_bytes) / ((current_time - last_report_time) * 1024 * 1024)
+                total_mbps = bytes_received / (elapsed * 1024 * 1024)
+                per_worker = " ".join(f"{int(count)}" for count in active_counters)
+
+                logger.info(f"Time: {elapsed:.1f}s | "
+                            f"Received: {bytes_received / (1024*1024):.1f} MB | "
+                            f"Channels: {active} [{per_worker}] | "
+                            f"Interval: {interval_mbps:.2f} MBps | "
+                            f"Avg: {total_mbps:.2f} MBps")
+
+                last_report_time = current_time
+                last_report_bytes = bytes_received
+
+        except KeyboardInterrupt:
+            logger.info("Shutting down server...")
+        finally:
+            for worker in workers:
+                worker.terminate()
+            for worker in workers:
+                worker.join()
+
+            bytes_received = sum(bytes_counters)
+            handshakes = sum(handshake_counters[0::2])
+            handshake_time = sum(handshake_counters[1::2])
+            if start_time is not None:
+                # Idle time after the last client finished is not part of the measurement
+                total_time = last_data_time - start_time
+                total_mb = bytes_received / (1024 * 1024)
+
+                logger.info("=" * 60)
+                logger.info("MULTI-PROCESS SERVER FINAL RESULTS:")
+                logger.info(f"Duration: {total_time:.2f} seconds")
+                logger.info(f"Data received: {total_mb:.2f} MB")
+                logger.info(f"Peak concurrent channels: {peak_active}")
+                logger.info(f"Handshakes: {int(handshakes)} | "
+                            f"Avg handshake: {handshake_time / handshakes * 1000 if handshakes else 0:.2f} ms")
+                for worker_id in range(num_workers):
+                    logger.info(f"  Worker {worker_id}: {bytes_counters[worker_id] / (1024*1024):.2f} MB")
+                logger.info(f"Aggregate decrypt throughput: {total_mb/total_time:.2f} MBps")
+                cpu.log_report(bytes_received)
+                logger.info("=" * 60)
+
 def main():
     receiver = TCPReceiver()
+    tls_profile = input(f"TLS profile ({', '.join(TLS_PROFILES)}; default: default): ").strip() or 'default'
+    if tls_profile not in TLS_PROFILES:
+        print(f"Unknown TLS profile {tls_profile}, using default")
+        tls_profile = 'default'
+    receiver.tls_profile = tls_profile
     
     print("TCP Bandwidth Test - Receiver")
     print("Options:")
     print("1. Standard receive mode (measure only)")
     print("2. Unix socket output mode (forward data)")
+    print("3. Multi-process mode (SO_REUSEPORT, measure only)")
+    print("4. Latency echo mode (request/response)")
+    print("5. Record mode (write client streams to disk)")
+    print("6. TLS handshake mode (handshakes/sec and CPU per handshake)")
     
-    choice = input("Enter choice (1-2): ").strip()
+    choice = input("Enter choice (1-6): ").strip()
     
     unix_socket_path = None
     if choice == '2':
         unix_socket_path = input("Unix socket path (default: /tmp/tcp_receiver.sock): ").strip() or "/tmp/tcp_receiver.sock"
+    elif choice == '5':
+        record_path = input("Recording path prefix (default: /tmp/migration.stream): ").strip() or "/tmp/migration.stream"
+        direct_io = input("Use O_DIRECT writes? [y/N]: ").strip().lower() == 'y'
+    if choice in ('1', '2', '5'):
+        receiver.verify_payload = input("Verify payload integrity? [y/N]: ").strip().lower() == 'y'
+    elif choice == '4':
+        if input("Relay through Unix socket (hybrid chain)? [y/N]: ").strip().lower() == 'y':
+            unix_socket_path = input("Unix socket path (default: /tmp/tcp_receiver.sock): ").strip() or "/tmp/tcp_receiver.sock"
+        use_tls = input("Use TLS? [Y/n]: ").strip().lower() != 'n'
     
     try:
-        receiver.start_server(unix_socket_path=unix_socket_path)
+        if choice == '3':
+            num_workers = int(input(f"Worker processes (default {os.cpu_count()}): ") or os.cpu_count())
+            max_connections = int(input("Max connections per worker (default 16): ") or "16")
+            receiver.start_server_multiprocess(num_workers=num_workers, max_connections_per_worker=max_connections)
+        elif choice == '4':
+            receiver.start_server(unix_socket_path=unix_socket_path, latency=True, use_tls=use_tls)
+        elif choice == '6':
+            max_workers = int(input(f"Handshake threads (default {2 * (os.cpu_count() or 1)}): ") or 2 * (os.cpu_count() or 1))
+            receiver.start_server_handshake(max_workers=max_workers)
+        elif choice == '5':
+            receiver.start_server(record_path=record_path, direct_io=direct_io)
+        else:
+            receiver.start_server(unix_socket_path=unix_socket_path)
     except KeyboardInterrupt:
         logger.info("Server shutdown complete")
     except Exception as e:
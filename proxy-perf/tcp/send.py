@@ -3,12 +3,59 @@ import ssl
 import time
 import logging
 import os
+import sys
+import errno
+import mmap
 import threading
-import select
+import selectors
+# Helpers shared by the tcp and websocket benchmarks
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from perf_common import (BULK_MODE, ECHO_MODE, HANDSHAKE_PHASE_PAUSE, REPLAY_SLICE, TLS_VERSIONS,
+                         CPUAccounting, LatencyHistogram, PayloadGenerator, TokenBucketPacer,
+                         load_replay_schedule, log_pacing_stats, set_kernel_pacing)
+# TLS profiles shared with the migrate-websocket proxies
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'migrate-websocket'))
+from websocket_common import TLS_PROFILES, apply_tls_profile
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class PumpChannel:
+    """One Unix client forwarded to its own TLS connection by the pump."""
+    def __init__(self, channel_id, unix_sock, ssl_sock, buffer_size):
+        self.channel_id = channel_id
+        self.unix_sock = unix_sock
+        self.ssl_sock = ssl_sock
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self.pending_start = 0  # First byte of buffer not yet sent over TLS
+        self.pending_end = 0    # End of data read from the Unix socket
+        self.connected = False  # Set once the TLS handshake completes
+        self.bytes_sent = 0
+        self.reads = 0
+        self.start_time = time.time()
+        self.end_time = None
+
+    def flush(self):
+        """Send as much pending data as the TLS socket accepts without blocking."""
+        while self.pending_start < self.pending_end:
+            try:
+                sent = self.ssl_sock.send(self.view[self.pending_start:self.pending_end])
+            except (ssl.SSLWantWriteError, ssl.SSLWantReadError, BlockingIOError):
+                return False
+            self.pending_start += sent
+            self.bytes_sent += sent
+        self.pending_start = self.pending_end = 0
+        return True
+
+    def close(self):
+        self.end_time = time.time()
+        for sock in (self.unix_sock, self.ssl_sock):
+            try:
+                sock.close()
+            except:
+                pass
+
 class TCPSender:
     def __init__(self, server_host, server_port, cert_dir='../../migrate-websocket/certs'):
         self.server_host = server_host
@@ -16,7 +63,16 @@ class TCPSender:
         self.cert_dir = cert_dir
         self.chunk_size = 8192
         self.test_data = b'x' * self.chunk_size  # 8KB of data
-        
+        self.pump_buffer_size = 256 * 1024  # Per-channel read buffer for the pump
+        self.socket_buffer_size = 4 * 1024 * 1024  # SO_SNDBUF/SO_RCVBUF for pump sockets
+        self.payload = None  # Optional PayloadGenerator replacing test_data
+        self.tls_profile = 'default'  # Key into TLS_PROFILES
+
+    def use_payload(self, mode, image_path=None):
+        """Send a framed, verifiable payload instead of the constant test pattern."""
+        self.payload = PayloadGenerator(mode, image_path)
+        self.payload.log_profile()
+
     def create_ssl_context(self):
         """Create SSL context for secure TCP connection."""
         ssl_context = ssl.create_default_context(ssl.Purpose.SERVER_AUTH)
@@ -34,6 +90,7 @@ class TCPSender:
         ssl_context.load_verify_locations(ca_file)
         ssl_context.check_hostname = False
         ssl_context.verify_mode = ssl.CERT_REQUIRED
+        apply_tls_profile(ssl_context, self.tls_profile)
         
         return ssl_context
     
@@ -49,114 +106,530 @@ class TCPSender:
         logger.info(f"Unix domain socket server listening on {socket_path}")
         return unix_sock
         
-    def benchmark_send_unix(self, duration_seconds=30, unix_socket_path='/tmp/tcp_sender.sock', target_mbps=None):
-        """Send data from Unix domain socket and benchmark bandwidth."""
+    def create_pacer(self, sock, target_mbps, kernel_pacing=False):
+        """Set up rate limiting: kernel pacing if requested, otherwise a token bucket."""
+        if not target_mbps:
+            return None
+        target_bps = target_mbps * 1024 * 1024
+        if kernel_pacing and set_kernel_pacing(sock, target_bps):
+            return None
+        # Allow about 5 ms worth of burst, but never less than two chunks
+        burst_bytes = max(2 * self.chunk_size, target_bps * 0.005)
+        return TokenBucketPacer(target_bps, burst_bytes)
+
+    def create_pump_pacer(self, target_bps):
+        """Token bucket shared by all pump channels, with a burst of about 5 ms or two reads."""
+        return TokenBucketPacer(target_bps, max(2 * self.pump_buffer_size, target_bps * 0.005))
+
+    def set_socket_buffers(self, sock):
+        """Enlarge kernel send/receive buffers on a pump socket."""
+        for option in (socket.SO_SNDBUF, socket.SO_RCVBUF):
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, option, self.socket_buffer_size)
+            except OSError as e:
+                logger.warning(f"Could not set socket buffer size: {e}")
+
+    def open_pump_channel(self, unix_sock, channel_id):
+        """Start a non-blocking connect for a newly accepted Unix client's own TLS connection.
+
+        The channel's ssl_sock is a plain TCP socket until advance_pump_handshake()
+        wraps it once the connect completes.
+        """
+        tcp_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        tcp_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.set_socket_buffers(tcp_sock)
+        tcp_sock.setblocking(False)
+        error = tcp_sock.connect_ex((self.server_host, self.server_port))
+        if error not in (0, errno.EINPROGRESS):
+            tcp_sock.close()
+            raise OSError(error, os.strerror(error))
+
+        self.set_socket_buffers(unix_sock)
+        unix_sock.setblocking(False)
+        return PumpChannel(channel_id, unix_sock, tcp_sock, self.pump_buffer_size)
+
+    def advance_pump_handshake(self, ssl_context, channel):
+        """Take a pump channel's connect and TLS handshake as far as they go without blocking.
+
+        Returns the selector event to wait for next, or None once the handshake is done.
+        """
+        if not isinstance(channel.ssl_sock, ssl.SSLSocket):
+            error = channel.ssl_sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if error:
+                raise OSError(error, os.strerror(error))
+            channel.ssl_sock = ssl_context.wrap_socket(channel.ssl_sock, server_hostname=self.server_host,
+                                                       do_handshake_on_connect=False)
+        try:
+            channel.ssl_sock.do_handshake()
+        except ssl.SSLWantReadError:
+            return selectors.EVENT_READ
+        except ssl.SSLWantWriteError:
+            return selectors.EVENT_WRITE
+        channel.connected = True
+        return None
+
+    def benchmark_send_unix(self, duration_seconds=30, unix_socket_path='/tmp/tcp_sender.sock', max_channels=1,
+                            target_mbps=None, kernel_pacing=False):
+        """Forward up to max_channels Unix clients, each over its own TLS connection, using an epoll pump.
+
+        With target_mbps, kernel pacing caps each channel's connection at that
+        rate; the token bucket fallback caps all channels together.
+        """
         ssl_context = self.create_ssl_context()
-        
-        # Create Unix domain socket server
+        target_bps = target_mbps * 1024 * 1024 if target_mbps else None
+        pacer = None
+        if target_bps and not kernel_pacing:
+            pacer = self.create_pump_pacer(target_bps)
+
         unix_server = self.create_unix_socket_server(unix_socket_path)
-        
-        try:
-            # Create TCP socket and wrap with SSL
-            tcp_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            ssl_sock = ssl_context.wrap_socket(tcp_sock, server_hostname=self.server_host)
-            
-            # Connect to TCP server
-            ssl_sock.connect((self.server_host, self.server_port))
-            logger.info(f"Connected to TCP server {self.server_host}:{self.server_port}")
-            logger.info(f"Waiting for Unix socket connection on {unix_socket_path}")
-            logger.info(f"Starting bandwidth test for {duration_seconds} seconds")
-            
-            if target_mbps:
-                logger.info(f"Target bandwidth: {target_mbps} MBps")
-            
-            # Wait for Unix socket connection
-            unix_client, _ = unix_server.accept()
-            logger.info("Unix socket client connected")
-            
-            start_time = time.time()
-            bytes_sent = 0
-            chunks_sent = 0
-            last_report_time = start_time
-            last_report_bytes = 0
-            
-            # Calculate delay between sends if target bandwidth is specified
-            send_delay = 0
-            if target_mbps:
-                target_bps = target_mbps * 1024 * 1024
-                send_delay = self.chunk_size / target_bps
-            
-            # Set sockets to non-blocking for select
-            unix_client.setblocking(False)
-            
-            while time.time() - start_time < duration_seconds:
+        unix_server.listen(max_channels)
+        unix_server.setblocking(False)
+
+        sel = selectors.DefaultSelector()
+        sel.register(unix_server, selectors.EVENT_READ, None)
+        channels = {}
+        finished = []
+
+        def close_channel(channel):
+            for sock in (channel.unix_sock, channel.ssl_sock):
                 try:
-                    # Use select to check if data is available
-                    ready, _, _ = select.select([unix_client], [], [], 0.1)
-                    
-                    if ready:
-                        # Read data from Unix socket
-                        data = unix_client.recv(self.chunk_size)
-                        if not data:
-                            logger.warning("Unix socket client disconnected")
-                            break
-                        
-                        # Send data to TCP server
-                        ssl_sock.sendall(data)
-                        bytes_sent += len(data)
-                        chunks_sent += 1
-                        
-                        # Apply rate limiting if target bandwidth is set
-                        if send_delay > 0:
-                            time.sleep(send_delay)
-                    
-                    # Report progress every second
-                    current_time = time.time()
-                    if current_time - last_report_time >= 1.0:
-                        elapsed = current_time - start_time
-                        interval_bytes = bytes_sent - last_report_bytes
-                        interval_mbps = interval_bytes / (1024 * 1024)
-                        total_mbps = bytes_sent / (elapsed * 1024 * 1024) if elapsed > 0 else 0
-                        
-                        logger.info(f"Time: {elapsed:.1f}s | "
-                                  f"Sent: {bytes_sent / (1024*1024):.1f} MB | "
-                                  f"Chunks: {chunks_sent} | "
-                                  f"Interval: {interval_mbps:.2f} MBps | "
-                                  f"Avg: {total_mbps:.2f} MBps")
-                        
-                        last_report_time = current_time
-                        last_report_bytes = bytes_sent
-                        
-                except socket.error:
-                    # No data available, continue
+                    sel.unregister(sock)
+                except (KeyError, ValueError):
                     pass
-            
+            channel.close()
+            channels.pop(channel.channel_id, None)
+            finished.append(channel)
+            logger.info(f"Channel #{channel.channel_id}: closed after "
+                        f"{channel.bytes_sent / (1024*1024):.1f} MB")
+
+        def wait_for_tls(channel):
+            # Stop reading from Unix until the TLS socket drains the buffer
+            sel.unregister(channel.unix_sock)
+            sel.register(channel.ssl_sock, selectors.EVENT_WRITE, channel)
+
+        def resume_unix(channel):
+            sel.unregister(channel.ssl_sock)
+            sel.register(channel.unix_sock, selectors.EVENT_READ, channel)
+
+        def continue_handshake(channel):
+            # Wrapping replaces the socket object, so register again after each step
+            sel.unregister(channel.ssl_sock)
+            try:
+                event = self.advance_pump_handshake(ssl_context, channel)
+            except OSError as e:
+                logger.error(f"Channel #{channel.channel_id}: TLS connection failed: {e}")
+                channel.close()
+                channels.pop(channel.channel_id, None)
+                return
+            if event:
+                sel.register(channel.ssl_sock, event, channel)
+                return
+            channel.start_time = time.time()
+            logger.info(f"Channel #{channel.channel_id}: Unix client forwarded to "
+                        f"{self.server_host}:{self.server_port}")
+            sel.register(channel.unix_sock, selectors.EVENT_READ, channel)
+
+        logger.info(f"Pump using {type(sel).__name__} for up to {max_channels} channels")
+        logger.info(f"Waiting for Unix socket connections on {unix_socket_path}")
+        logger.info(f"Starting bandwidth test for {duration_seconds} seconds")
+        if target_mbps:
+            logger.info(f"Target bandwidth: {target_mbps} MBps")
+
+        next_channel_id = 0
+        start_time = time.time()
+        cpu = CPUAccounting()
+        last_report_time = start_time
+        last_report_bytes = 0
+        interval_rates = []
+
+        def total_sent():
+            return (sum(c.bytes_sent for c in channels.values()) +
+                    sum(c.bytes_sent for c in finished))
+
+        try:
+            while True:
+                current_time = time.time()
+                remaining = duration_seconds - (current_time - start_time)
+                if remaining <= 0:
+                    break
+                timeout = min(remaining, max(0.0, last_report_time + 1.0 - current_time))
+
+                for key, _ in sel.select(timeout):
+                    channel = key.data
+                    if channel is None:
+                        # New Unix client: give it a TLS connection of its own
+                        try:
+                            unix_client, _ = unix_server.accept()
+                        except BlockingIOError:
+                            continue
+                        if len(channels) >= max_channels:
+                            logger.warning("Channel limit reached, rejecting Unix client")
+                            unix_client.close()
+                            continue
+                        next_channel_id += 1
+                        try:
+                            channel = self.open_pump_channel(unix_client, next_channel_id)
+                        except OSError as e:
+                            logger.error(f"Channel #{next_channel_id}: TLS connection failed: {e}")
+                            unix_client.close()
+                            continue
+                        if target_bps and not pacer and not set_kernel_pacing(channel.ssl_sock, target_bps):
+                            pacer = self.create_pump_pacer(target_bps)
+                        # Connect and handshake in the loop; read from Unix once TLS is up
+                        channels[channel.channel_id] = channel
+                        sel.register(channel.ssl_sock, selectors.EVENT_WRITE, channel)
+                    elif not channel.connected:
+                        continue_handshake(channel)
+                    elif key.fileobj is channel.unix_sock:
+                        try:
+                            nbytes = channel.unix_sock.recv_into(channel.view)
+                        except BlockingIOError:
+                            continue
+                        except OSError as e:
+                            logger.error(f"Channel #{channel.channel_id}: Unix read error: {e}")
+                            close_channel(channel)
+                            continue
+                        if nbytes == 0:
+                            close_channel(channel)
+                            continue
+                        channel.reads += 1
+                        channel.pending_start, channel.pending_end = 0, nbytes
+                        try:
+                            if not channel.flush():
+                                wait_for_tls(channel)
+                        except OSError as e:
+                            logger.error(f"Channel #{channel.channel_id}: TLS send error: {e}")
+                            close_channel(channel)
+                            continue
+                        if pacer:
+                            pacer.wait(nbytes)
+                    else:
+                        try:
+                            if channel.flush():
+                                resume_unix(channel)
+                        except OSError as e:
+                            logger.error(f"Channel #{channel.channel_id}: TLS send error: {e}")
+                            close_channel(channel)
+
+                # Report progress every second
+                current_time = time.time()
+                if current_time - last_report_time >= 1.0:
+                    elapsed = current_time - start_time
+                    bytes_sent = total_sent()
+                    interval_mbps = (bytes_sent - last_report_bytes) / (1024 * 1024)
+                    total_mbps = bytes_sent / (elapsed * 1024 * 1024)
+                    interval_rates.append((bytes_sent - last_report_bytes) /
+                                          ((current_time - last_report_time) * 1024 * 1024))
+
+                    logger.info(f"Time: {elapsed:.1f}s | "
+                              f"Sent: {bytes_sent / (1024*1024):.1f} MB | "
+                              f"Channels: {len(channels)} active, {len(finished)} closed | "
+                              f"Interval: {interval_mbps:.2f} MBps | "
+                              f"Avg: {total_mbps:.2f} MBps")
+
+                    last_report_time = current_time
+                    last_report_bytes = bytes_sent
+
             # Final statistics
             total_time = time.time() - start_time
+            bytes_sent = total_sent()
             total_mb = bytes_sent / (1024 * 1024)
-            avg_mbps = bytes_sent / (total_time * 1024 * 1024) if total_time > 0 else 0
-            
+
             logger.info("=" * 60)
-            logger.info("FINAL RESULTS:")
+            logger.info("FINAL RESULTS (Unix pump):")
             logger.info(f"Duration: {total_time:.2f} seconds")
+            logger.info(f"Channels served: {len(channels) + len(finished)}")
+            for channel in sorted(list(channels.values()) + finished, key=lambda c: c.channel_id):
+                channel_time = (channel.end_time or time.time()) - channel.start_time
+                channel_mbps = channel.bytes_sent / (channel_time * 1024 * 1024) if channel_time > 0 else 0
+                avg_read = channel.bytes_sent / channel.reads if channel.reads else 0
+                logger.info(f"  Channel #{channel.channel_id}: "
+                            f"{channel.bytes_sent / (1024*1024):.2f} MB | "
+                            f"{channel_mbps:.2f} MBps | "
+                            f"Avg read: {avg_read / 1024:.1f} KB")
             logger.info(f"Data sent: {total_mb:.2f} MB")
-            logger.info(f"Chunks sent: {chunks_sent}")
-            logger.info(f"Average bandwidth: {avg_mbps:.2f} MBps")
-            logger.info(f"Average throughput: {total_mb/total_time:.2f} MB/s" if total_time > 0 else "N/A")
+            logger.info(f"Aggregate bandwidth: {total_mb/total_time:.2f} MBps" if total_time > 0 else "N/A")
+            log_pacing_stats(target_mbps, total_mb / total_time if total_time > 0 else 0, interval_rates, pacer)
+            cpu.log_report(bytes_sent)
             logger.info("=" * 60)
-            
+
         except Exception as e:
             logger.error(f"Error during benchmark: {e}")
         finally:
+            for channel in list(channels.values()):
+                channel.close()
+            sel.close()
             try:
-                unix_client.close()
                 unix_server.close()
                 os.unlink(unix_socket_path)
-                ssl_sock.close()
             except:
                 pass
-        
-    def benchmark_send(self, duration_seconds=30, target_mbps=None):
+
+    def open_connection(self, ssl_context=None):
+        """Connect to the server, over TLS unless ssl_context is None."""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if ssl_context:
+            sock = ssl_context.wrap_socket(sock, server_hostname=self.server_host)
+        sock.connect((self.server_host, self.server_port))
+        return sock
+
+    def run_latency_client(self, ssl_context, message_size, deadline, histogram):
+        """Issue back-to-back echo requests on one connection until the deadline."""
+        try:
+            sock = self.open_connection(ssl_context)
+        except Exception as e:
+            logger.error(f"Latency client failed to connect: {e}")
+            return
+
+        message = b'x' * message_size
+        response = bytearray(message_size)
+        view = memoryview(response)
+        try:
+            sock.sendall(ECHO_MODE)
+            while time.time() < deadline:
+                request_start = time.perf_counter_ns()
+                sock.sendall(message)
+                received = 0
+                while received < message_size:
+                    nbytes = sock.recv_into(view[received:])
+                    if nbytes == 0:
+                        raise ConnectionError("server closed the connection")
+                    received += nbytes
+                histogram.record(time.perf_counter_ns() - request_start)
+        except Exception as e:
+            logger.error(f"Latency client error: {e}")
+        finally:
+            sock.close()
+
+    def run_bulk_load(self, ssl_context, stop_event, bytes_sent):
+        """Stream bulk data alongside a latency test until stop_event is set."""
+        try:
+            sock = self.open_connection(ssl_context)
+            sock.sendall(BULK_MODE)
+            while not stop_event.is_set():
+                sock.sendall(self.test_data)
+                bytes_sent[0] += self.chunk_size
+            sock.close()
+        except Exception as e:
+            logger.error(f"Bulk load error: {e}")
+
+    def benchmark_latency(self, duration_seconds=10, message_size=64, concurrency=1, use_tls=True, with_load=False):
+        """Measure request/response latency against a receiver in latency echo mode."""
+        ssl_context = self.create_ssl_context() if use_tls else None
+        transport = "TLS" if use_tls else "plain TCP"
+        condition = "under load" if with_load else "idle"
+
+        logger.info(f"Starting latency test to {self.server_host}:{self.server_port} "
+                    f"({transport}, {condition}) for {duration_seconds} seconds")
+        logger.info(f"Message size: {message_size} bytes | Concurrency: {concurrency}")
+
+        stop_event = threading.Event()
+        bulk_bytes = [0]
+        bulk_thread = None
+        if with_load:
+            bulk_thread = threading.Thread(target=self.run_bulk_load,
+                                           args=(ssl_context, stop_event, bulk_bytes))
+            bulk_thread.start()
+            time.sleep(0.5)  # Let the bulk stream reach steady state
+
+        start_time = time.time()
+        bulk_start_bytes = bulk_bytes[0]
+        deadline = start_time + duration_seconds
+        histograms = [LatencyHistogram() for _ in range(concurrency)]
+        clients = [threading.Thread(target=self.run_latency_client,
+                                    args=(ssl_context, message_size, deadline, histogram))
+                   for histogram in histograms]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        total_time = time.time() - start_time
+        bulk_total = bulk_bytes[0] - bulk_start_bytes
+
+        stop_event.set()
+        if bulk_thread:
+            bulk_thread.join()
+
+        histogram = LatencyHistogram()
+        for client_histogram in histograms:
+            histogram.merge(client_histogram)
+
+        logger.info("=" * 60)
+        logger.info(f"LATENCY RESULTS ({transport}, {condition}):")
+        logger.info(f"Duration: {total_time:.2f} seconds")
+        logger.info(f"Message size: {message_size} bytes | Concurrency: {concurrency}")
+        histogram.log_summary("Round trips", total_time)
+        if with_load:
+            logger.info(f"Bulk load: {bulk_total / (total_time * 1024 * 1024):.2f} MBps")
+        logger.info("=" * 60)
+
+    def run_handshake_client(self, ssl_context, resume, deadline, histogram, counts):
+        """Open, handshake and close connections back to back until the deadline."""
+        session = None
+        while time.time() < deadline:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            try:
+                ssl_sock = ssl_context.wrap_socket(sock, server_hostname=self.server_host, session=session)
+            except Exception:
+                sock.close()
+                raise
+            try:
+                handshake_start = time.perf_counter_ns()
+                ssl_sock.connect((self.server_host, self.server_port))
+                histogram.record(time.perf_counter_ns() - handshake_start)
+                # Reading the reply also processes TLS 1.3 session tickets
+                ssl_sock.recv(1)
+                counts['resumed' if ssl_sock.session_reused else 'full'] += 1
+                if resume:
+                    session = ssl_sock.session
+            except (ssl.SSLError, OSError) as e:
+                counts['failed'] += 1
+                logger.debug(f"Handshake failed: {e}")
+                session = None
+            finally:
+                ssl_sock.close()
+
+    def benchmark_handshakes(self, duration_seconds=10, concurrency_levels=(1,), versions=('1.3',), resume_modes=(False,)):
+        """Measure TLS handshake rate and latency against a receiver in handshake mode.
+
+        Every combination of concurrency, TLS version and resumption runs as a
+        separate phase, with a pause in between so the receiver reports server
+        CPU per handshake for each one.
+        """
+        results = []
+        combinations = [(version, resume, concurrency) for version in versions
+                        for resume in resume_modes for concurrency in concurrency_levels]
+        for index, (version, resume, concurrency) in enumerate(combinations):
+            if index:
+                time.sleep(HANDSHAKE_PHASE_PAUSE)
+            ssl_context = self.create_ssl_context()
+            ssl_context.minimum_version = TLS_VERSIONS[version]
+            ssl_context.maximum_version = TLS_VERSIONS[version]
+            label = f"TLS {version} {'resumed' if resume else 'full'} x{concurrency}"
+            logger.info(f"Starting handshake test: {label} for {duration_seconds} seconds")
+
+            cpu = CPUAccounting()
+            start_time = time.time()
+            deadline = start_time + duration_seconds
+            histograms = [LatencyHistogram() for _ in range(concurrency)]
+            counts = [{'full': 0, 'resumed': 0, 'failed': 0} for _ in range(concurrency)]
+            clients = [threading.Thread(target=self.run_handshake_client,
+                                        args=(ssl_context, resume, deadline, histograms[i], counts[i]))
+                       for i in range(concurrency)]
+            for client in clients:
+                client.start()
+            for client in clients:
+                client.join()
+            total_time = time.time() - start_time
+
+            histogram = LatencyHistogram()
+            for client_histogram in histograms:
+                histogram.merge(client_histogram)
+            full = sum(c['full'] for c in counts)
+            resumed = sum(c['resumed'] for c in counts)
+            failed = sum(c['failed'] for c in counts)
+
+            logger.info("=" * 60)
+            logger.info(f"HANDSHAKE RESULTS ({label}):")
+            logger.info(f"Duration: {total_time:.2f} seconds")
+            logger.info(f"Handshakes: {full + resumed} ({(full + resumed) / total_time:.1f}/s) | "
+                        f"Full: {full} | Resumed: {resumed} | Failed: {failed}")
+            histogram.log_summary("TCP connect + TLS handshake", total_time)
+            cpu.log_report(0)
+            logger.info("=" * 60)
+            results.append((label, (full + resumed) / total_time, histogram.percentile(50), histogram.percentile(99)))
+
+        if len(results) > 1:
+            logger.info("=" * 60)
+            logger.info("HANDSHAKE MATRIX (client view, see receiver for server CPU per handshake):")
+            for label, rate, p50, p99 in results:
+                logger.info(f"{label:<26} {rate:>9.1f}/s | p50 {p50 / 1e6:.2f} ms | p99 {p99 / 1e6:.2f} ms")
+            logger.info("=" * 60)
+
+    def replay_stream(self, record_path, paced=False):
+        """Replay a recorded stream over TLS from an mmap of the recording."""
+        ssl_context = self.create_ssl_context()
+        sock = None
+        try:
+            sock = ssl_context.wrap_socket(socket.socket(socket.AF_INET, socket.SOCK_STREAM),
+                                           server_hostname=self.server_host)
+            sock.connect((self.server_host, self.server_port))
+            logger.info(f"Connected to {self.server_host}:{self.server_port}")
+
+            with open(record_path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                if size == 0:
+                    logger.error(f"Recording {record_path} is empty")
+                    return
+                # Release the view before the mapping, also when a send fails
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+                    mapped.madvise(mmap.MADV_SEQUENTIAL)
+                    schedule = load_replay_schedule(record_path, size, paced)
+
+                    logger.info(f"Replaying {size / (1024*1024):.2f} MB from {record_path}"
+                                f"{' at original timing' if paced else ''}")
+
+                    start_time = time.time()
+                    cpu = CPUAccounting()
+                    bytes_sent = 0
+                    sent = 0
+                    lateness = 0.0
+                    last_report_time = start_time
+                    last_report_bytes = 0
+
+                    for end_offset, due in schedule:
+                        delay = start_time + due - time.time()
+                        if delay > 0:
+                            time.sleep(delay)
+                        else:
+                            lateness = max(lateness, -delay)
+                        while sent < end_offset:
+                            count = min(REPLAY_SLICE, end_offset - sent)
+                            # TLS encrypts in userspace, so send straight from the mapping
+                            with view[sent:sent + count] as chunk:
+                                sock.sendall(chunk)
+                            sent += count
+                            bytes_sent = sent
+
+                            # Report progress every second
+                            current_time = time.time()
+                            if current_time - last_report_time >= 1.0:
+                                elapsed = current_time - start_time
+                                interval_mbps = (bytes_sent - last_report_bytes) / (1024 * 1024)
+                                total_mbps = bytes_sent / (elapsed * 1024 * 1024)
+
+                                logger.info(f"Time: {elapsed:.1f}s | "
+                                          f"Sent: {bytes_sent / (1024*1024):.1f} MB | "
+                                          f"Interval: {interval_mbps:.2f} MBps | "
+                                          f"Avg: {total_mbps:.2f} MBps")
+
+                                last_report_time = current_time
+                                last_report_bytes = bytes_sent
+
+            # Final statistics
+            total_time = time.time() - start_time
+            total_mb = bytes_sent / (1024 * 1024)
+
+            logger.info("=" * 60)
+            logger.info("REPLAY FINAL RESULTS:")
+            logger.info(f"Duration: {total_time:.2f} seconds")
+            logger.info(f"Data sent: {total_mb:.2f} MB")
+            logger.info(f"Average throughput: {total_mb/total_time:.2f} MB/s" if total_time > 0 else "N/A")
+            if paced:
+                logger.info(f"Recorded duration: {schedule[-1][1]:.2f} seconds | "
+                            f"Max schedule lateness: {lateness * 1000:.1f} ms")
+            cpu.log_report(bytes_sent)
+            logger.info("=" * 60)
+
+        except Exception as e:
+            logger.error(f"Error during replay: {e}")
+        finally:
+            if sock:
+                sock.close()
+
+    def benchmark_send(self, duration_seconds=30, target_mbps=None, kernel_pacing=False):
         """Send data continuously and benchmark bandwidth."""
         ssl_context = self.create_ssl_context()
         
@@ -175,28 +648,29 @@ class TCPSender:
                 logger.info(f"Target bandwidth: {target_mbps} MBps")
             
             start_time = time.time()
+            cpu = CPUAccounting()
             bytes_sent = 0
             chunks_sent = 0
             last_report_time = start_time
             last_report_bytes = 0
+            interval_rates = []
             
-            # Calculate delay between sends if target bandwidth is specified
-            send_delay = 0
-            if target_mbps:
-                # Convert MBps to bytes per second
-                target_bps = target_mbps * 1024 * 1024
-                # Calculate delay needed between chunks
-                send_delay = self.chunk_size / target_bps
+            # Pace sends if target bandwidth is specified
+            pacer = self.create_pacer(ssl_sock, target_mbps, kernel_pacing)
+            
+            if self.payload:
+                ssl_sock.sendall(self.payload.header)
             
             while time.time() - start_time < duration_seconds:
                 # Send data chunk
-                ssl_sock.sendall(self.test_data)
-                bytes_sent += self.chunk_size
+                chunk = self.payload.next_chunk(self.chunk_size) if self.payload else self.test_data
+                ssl_sock.sendall(chunk)
+                bytes_sent += len(chunk)
                 chunks_sent += 1
                 
                 # Apply rate limiting if target bandwidth is set
-                if send_delay > 0:
-                    time.sleep(send_delay)
+                if pacer:
+                    pacer.wait(len(chunk))
                 
                 # Report progress every second
                 current_time = time.time()
@@ -205,6 +679,7 @@ class TCPSender:
                     interval_bytes = bytes_sent - last_report_bytes
                     interval_mbps = interval_bytes / (1024 * 1024)  # Convert to MBps
                     total_mbps = bytes_sent / (elapsed * 1024 * 1024)
+                    interval_rates.append(interval_bytes / ((current_time - last_report_time) * 1024 * 1024))
                     
                     logger.info(f"Time: {elapsed:.1f}s | "
                               f"Sent: {bytes_sent / (1024*1024):.1f} MB | "
@@ -227,6 +702,8 @@ class TCPSender:
             logger.info(f"Chunks sent: {chunks_sent}")
             logger.info(f"Average bandwidth: {avg_mbps:.2f} MBps")
             logger.info(f"Average throughput: {total_mb/total_time:.2f} MB/s")
+            log_pacing_stats(target_mbps, avg_mbps, interval_rates, pacer)
+            cpu.log_report(bytes_sent)
             logger.info("=" * 60)
             
         except Exception as e:
@@ -237,10 +714,22 @@ class TCPSender:
             except:
                 pass
 
+def choose_payload(sender):
+    """Prompt for a payload mode; the default keeps the legacy b'x' stream."""
+    mode = input("Payload (x/random/zero/mixed/file, default x): ").strip() or 'x'
+    if mode != 'x':
+        image_path = input("Memory image path: ").strip() if mode == 'file' else None
+        sender.use_payload(mode, image_path)
+
 def main():
     server_host = '10.117.30.218'
     server_port = 8765
     sender = TCPSender(server_host, server_port)
+    tls_profile = input(f"TLS profile ({', '.join(TLS_PROFILES)}; default: default): ").strip() or 'default'
+    if tls_profile not in TLS_PROFILES:
+        print(f"Unknown TLS profile {tls_profile}, using default")
+        tls_profile = 'default'
+    sender.tls_profile = tls_profile
     
     print("TCP Bandwidth Test - Sender")
     print("Options:")
@@ -249,15 +738,22 @@ def main():
     print("3. Custom duration test")
     print("4. Unix socket input test (unlimited)")
     print("5. Unix socket input test (rate-limited)")
+    print("6. Multi-channel Unix socket pump (epoll)")
+    print("7. Latency test (request/response)")
+    print("8. Replay a recorded stream")
+    print("9. TLS handshake benchmark")
     
-    choice = input("Enter choice (1-5): ").strip()
+    choice = input("Enter choice (1-9): ").strip()
+    if choice in ('1', '2', '3'):
+        choose_payload(sender)
     
     if choice == '1':
         sender.benchmark_send(duration_seconds=30)
     elif choice == '2':
         target_mbps = float(input("Enter target bandwidth (MBps): "))
         duration = int(input("Enter duration (seconds, default 30): ") or "30")
-        sender.benchmark_send(duration_seconds=duration, target_mbps=target_mbps)
+        kernel_pacing = input("Use kernel pacing (SO_MAX_PACING_RATE)? [y/N]: ").strip().lower() == 'y'
+        sender.benchmark_send(duration_seconds=duration, target_mbps=target_mbps, kernel_pacing=kernel_pacing)
     elif choice == '3':
         duration = int(input("Enter duration (seconds): "))
         sender.benchmark_send(duration_seconds=duration)
@@ -269,7 +765,36 @@ def main():
         target_mbps = float(input("Enter target bandwidth (MBps): "))
         duration = int(input("Enter duration (seconds, default 30): ") or "30")
         socket_path = input("Unix socket path (default: /tmp/tcp_sender.sock): ").strip() or "/tmp/tcp_sender.sock"
-        sender.benchmark_send_unix(duration_seconds=duration, unix_socket_path=socket_path, target_mbps=target_mbps)
+        kernel_pacing = input("Use kernel pacing (SO_MAX_PACING_RATE)? [y/N]: ").strip().lower() == 'y'
+        sender.benchmark_send_unix(duration_seconds=duration, unix_socket_path=socket_path,
+                                   target_mbps=target_mbps, kernel_pacing=kernel_pacing)
+    elif choice == '6':
+        duration = int(input("Enter duration (seconds, default 30): ") or "30")
+        socket_path = input("Unix socket path (default: /tmp/tcp_sender.sock): ").strip() or "/tmp/tcp_sender.sock"
+        max_channels = int(input("Maximum Unix clients (default 64): ") or "64")
+        sender.benchmark_send_unix(duration_seconds=duration, unix_socket_path=socket_path, max_channels=max_channels)
+    elif choice == '7':
+        duration = int(input("Enter duration (seconds, default 10): ") or "10")
+        message_size = int(input("Message size in bytes (default 64): ") or "64")
+        concurrency = int(input("Concurrent connections (default 1): ") or "1")
+        use_tls = input("Use TLS? [Y/n]: ").strip().lower() != 'n'
+        with_load = input("Run a bulk stream alongside? [y/N]: ").strip().lower() == 'y'
+        sender.benchmark_latency(duration_seconds=duration, message_size=message_size,
+                                 concurrency=concurrency, use_tls=use_tls, with_load=with_load)
+    elif choice == '8':
+        record_path = input("Recording path (e.g. /tmp/migration.stream.1): ").strip()
+        paced = input("Pace to original timing? [y/N]: ").strip().lower() == 'y'
+        sender.replay_stream(record_path, paced=paced)
+    elif choice == '9':
+        duration = int(input("Seconds per test (default 10): ") or "10")
+        concurrency = input("Concurrency levels (default 1,8,32): ").strip() or "1,8,32"
+        versions = input("TLS versions (default 1.2,1.3): ").strip() or "1.2,1.3"
+        resume = input("Session resumption (full/resumed/both, default both): ").strip() or "both"
+        resume_modes = {'full': (False,), 'resumed': (True,)}.get(resume, (False, True))
+        sender.benchmark_handshakes(duration_seconds=duration,
+                                    concurrency_levels=[int(c) for c in concurrency.split(',')],
+                                    versions=[v.strip() for v in versions.split(',')],
+                                    resume_modes=resume_modes)
     else:
         print("Invalid choice, running default test")
         sender.benchmark_send(duration_seconds=30)
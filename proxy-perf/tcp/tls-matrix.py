@@ -0,0 +1,197 @@
+import socket
+import ssl
+import time
+import logging
+import os
+import sys
+import json
+import resource
+import signal
+# TLS profiles shared with the migrate-websocket proxies
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'migrate-websocket'))
+from websocket_common import TLS_PROFILES, apply_tls_profile
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def host_class():
+    """Classify the CPU by the crypto acceleration AES-GCM and ChaCha20 depend on."""
+    flags = set()
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                # 'flags' on x86, 'Features' on arm64
+                if line.startswith(('flags', 'Features')):
+                    flags = set(line.split(':', 1)[1].split())
+                    break
+    except OSError:
+        pass
+    if 'vaes' in flags and 'avx512f' in flags:
+        return 'x86-vaes-avx512'
+    if 'aes' in flags and 'pclmulqdq' in flags:
+        return 'x86-aesni'
+    if 'aes' in flags and 'pmull' in flags:
+        return 'arm64-aes'
+    return 'no-aes-accel'
+
+class TLSThroughputMatrix:
+    """Measure bulk TLS throughput for each profile over loopback.
+
+    Each run forks a receiver that decrypts and discards, while this process
+    encrypts and sends. Encrypt CPU comes from getrusage(), decrypt CPU from
+    the receiver's wait4() usage.
+    """
+    def __init__(self, cert_dir='../../migrate-websocket/certs', chunk_size=256 * 1024):
+        self.cert_dir = cert_dir
+        self.chunk_size = chunk_size
+        self.results = []
+
+    def create_contexts(self, profile):
+        """Return (server, client) contexts with mutual authentication and the given profile."""
+        files = {name: os.path.join(self.cert_dir, name) for name in
+                 ('ca.pem', 'server-cert.pem', 'server-key.pem', 'client-cert.pem', 'client-key.pem')}
+        if not all(os.path.exists(f) for f in files.values()):
+            raise FileNotFoundError(f"Certificate files not found in {self.cert_dir}")
+
+        server_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        server_context.load_cert_chain(files['server-cert.pem'], files['server-key.pem'])
+        server_context.verify_mode = ssl.CERT_REQUIRED
+        server_context.load_verify_locations(files['ca.pem'])
+
+        client_context = ssl.create_default_context(ssl.Purpose.SERVER_AUTH)
+        client_context.load_cert_chain(files['client-cert.pem'], files['client-key.pem'])
+        client_context.load_verify_locations(files['ca.pem'])
+        client_context.check_hostname = False
+        client_context.verify_mode = ssl.CERT_REQUIRED
+
+        apply_tls_profile(server_context, profile)
+        apply_tls_profile(client_context, profile)
+        return server_context, client_context
+
+    def run_receiver(self, server_context, server_sock):
+        """Child process: accept one client, decrypt until EOF, then exit."""
+        try:
+            client_sock, _ = server_sock.accept()
+            ssl_sock = server_context.wrap_socket(client_sock, server_side=True)
+            buffer = bytearray(self.chunk_size)
+            while ssl_sock.recv_into(buffer):
+                pass
+            os._exit(0)
+        except Exception as e:
+            logger.error(f"Receiver error: {e}")
+            os._exit(1)
+
+    def run_profile(self, profile, duration_seconds):
+        server_context, client_context = self.create_contexts(profile)
+
+        server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_sock.bind(('127.0.0.1', 0))
+        server_sock.listen(1)
+        port = server_sock.getsockname()[1]
+
+        pid = os.fork()
+        if pid == 0:
+            self.run_receiver(server_context, server_sock)
+        server_sock.close()
+
+        bytes_sent = 0
+        cipher = None
+        try:
+            sock = client_context.wrap_socket(socket.create_connection(('127.0.0.1', port)))
+            version = sock.version()
+            cipher = sock.cipher()[0]
+            chunk = memoryview(os.urandom(self.chunk_size))
+
+            usage_before = resource.getrusage(resource.RUSAGE_SELF)
+            start_time = time.time()
+            deadline = start_time + duration_seconds
+            while time.time() < deadline:
+                sock.sendall(chunk)
+                bytes_sent += self.chunk_size
+            sock.close()
+        except (ssl.SSLError, OSError) as e:
+            logger.error(f"{profile}: {e}")
+            # The receiver may still be blocked in accept() if the client never connected
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+            return None
+
+        _, status, receiver_usage = os.wait4(pid, 0)
+        # The receiver exits once it has decrypted everything, so this covers both ends
+        elapsed = time.time() - start_time
+        usage_after = resource.getrusage(resource.RUSAGE_SELF)
+        if os.waitstatus_to_exitcode(status) != 0:
+            logger.error(f"{profile}: receiver failed")
+            return None
+
+        encrypt_cpu = (usage_after.ru_utime - usage_before.ru_utime +
+                       usage_after.ru_stime - usage_before.ru_stime)
+        decrypt_cpu = receiver_usage.ru_utime + receiver_usage.ru_stime
+        gigabytes = bytes_sent / 1e9
+        result = {
+            'profile': profile,
+            'version': version,
+            'cipher': cipher,
+            'bytes': bytes_sent,
+            'seconds': elapsed,
+            'mbps': bytes_sent / (elapsed * 1024 * 1024),
+            'encrypt_cpu_s_per_gb': encrypt_cpu / gigabytes,
+            'decrypt_cpu_s_per_gb': decrypt_cpu / gigabytes,
+        }
+        logger.info(f"{profile:<17} {version} {cipher:<30} | {result['mbps']:>9.2f} MBps | "
+                    f"encrypt {result['encrypt_cpu_s_per_gb']:.3f} | "
+                    f"decrypt {result['decrypt_cpu_s_per_gb']:.3f} CPU-s/GB")
+        return result
+
+    def run_matrix(self, profiles, duration_seconds=5):
+        logger.info(f"Host class: {host_class()} | {os.cpu_count()} CPUs | {ssl.OPENSSL_VERSION}")
+        logger.info(f"Measuring {len(profiles)} profiles for {duration_seconds}s each, "
+                    f"{self.chunk_size // 1024} KB writes")
+        for profile in profiles:
+            result = self.run_profile(profile, duration_seconds)
+            if result:
+                self.results.append(result)
+        self.log_summary()
+
+    def log_summary(self):
+        if not self.results:
+            logger.error("No successful runs")
+            return
+        # On a dedicated migration path the CPU is the bottleneck, so rank by total CPU per GB
+        ranked = sorted(self.results, key=lambda r: r['encrypt_cpu_s_per_gb'] + r['decrypt_cpu_s_per_gb'])
+        best = ranked[0]
+        logger.info("=" * 60)
+        logger.info("TLS THROUGHPUT MATRIX (cheapest first):")
+        for result in ranked:
+            total = result['encrypt_cpu_s_per_gb'] + result['decrypt_cpu_s_per_gb']
+            logger.info(f"{result['profile']:<17} {result['cipher']:<30} "
+                        f"{result['mbps']:>9.2f} MBps | {total:.3f} CPU-s/GB")
+        logger.info(f"Recommended profile for {host_class()}: {best['profile']} ({best['cipher']})")
+        logger.info("=" * 60)
+
+    def export_json(self, path):
+        with open(path, 'w') as f:
+            json.dump({'host_class': host_class(), 'openssl': ssl.OPENSSL_VERSION,
+                       'results': self.results}, f, indent=2)
+        logger.info(f"Results written to {path}")
+
+def main():
+    cert_dir = input("Certificate directory (default: ../../migrate-websocket/certs): ").strip() or "../../migrate-websocket/certs"
+    profiles = [p for p in TLS_PROFILES if p != 'default']
+    selected = input(f"Profiles (comma separated, default: {','.join(profiles)}): ").strip()
+    if selected:
+        profiles = [p.strip() for p in selected.split(',')]
+    unknown = [p for p in profiles if p not in TLS_PROFILES]
+    if unknown:
+        logger.error(f"Unknown profiles: {', '.join(unknown)}")
+        return
+    duration = int(input("Seconds per profile (default: 5): ") or "5")
+    export_path = input("Export JSON to (leave empty to skip): ").strip()
+
+    matrix = TLSThroughputMatrix(cert_dir)
+    matrix.run_matrix(profiles, duration_seconds=duration)
+    if export_path:
+        matrix.export_json(export_path)
+
+if __name__ == "__main__":
+    main()
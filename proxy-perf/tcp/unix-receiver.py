@@ -4,6 +4,10 @@ import logging
 import os
 import signal
 import sys
+import threading
+# Helpers shared by the tcp and websocket benchmarks
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from perf_common import BULK_MODE, ECHO_MODE, CPUAccounting, PayloadVerifier, StreamRecorder
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -12,15 +16,17 @@ class UnixReceiver:
     def __init__(self, socket_path='/tmp/tcp_receiver.sock'):
         self.socket_path = socket_path
         self.chunk_size = 8192
+        self.socket_buffer = 0  # SO_RCVBUF to request; 0 keeps the kernel default
         self.running = True
+        self.verify_payload = False  # Check CRC-32 framed payloads from the senders
         
     def signal_handler(self, signum, frame):
         """Handle interrupt signal gracefully."""
         logger.info("Received interrupt signal, shutting down...")
         self.running = False
         
-    def receive_data(self, duration_seconds=40):
-        """Receive data continuously for specified duration."""
+    def receive_data(self, duration_seconds=40, record_path=None, direct_io=False):
+        """Receive data continuously for specified duration, optionally recording it to disk."""
         # Set up signal handler for graceful shutdown
         signal.signal(signal.SIGINT, self.signal_handler)
         signal.signal(signal.SIGTERM, self.signal_handler)
@@ -44,12 +50,21 @@ class UnixReceiver:
             
             logger.info(f"Starting data reception for {duration_seconds} seconds")
             logger.info(f"Expected chunk size: {self.chunk_size} bytes")
+            if self.socket_buffer:
+                client_sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.socket_buffer)
+                logger.info(f"SO_RCVBUF: {client_sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)} bytes")
             
             start_time = time.time()
+            cpu = CPUAccounting()
+            verifier = PayloadVerifier() if self.verify_payload else None
+            recorder = StreamRecorder(record_path, direct=direct_io) if record_path else None
             bytes_received = 0
             chunks_received = 0
             last_report_time = start_time
             last_report_bytes = 0
+            # Receive into one preallocated buffer instead of a new bytes object per call
+            buffer = bytearray(self.chunk_size)
+            view = memoryview(buffer)
             
             # Set socket timeout to avoid blocking indefinitely
             client_sock.settimeout(1.0)
@@ -57,12 +72,16 @@ class UnixReceiver:
             while self.running and (time.time() - start_time < duration_seconds):
                 try:
                     # Receive data chunk
-                    data = client_sock.recv(self.chunk_size)
-                    if not data:
+                    nbytes = client_sock.recv_into(buffer)
+                    if not nbytes:
                         logger.warning("Sender disconnected")
                         break
+                    if verifier:
+                        verifier.feed(view[:nbytes])
+                    if recorder:
+                        recorder.write(view[:nbytes])
                     
-                    bytes_received += len(data)
+                    bytes_received += nbytes
                     chunks_received += 1
                     
                     # Report progress every second
@@ -101,6 +120,11 @@ class UnixReceiver:
             logger.info(f"Chunks received: {chunks_received}")
             logger.info(f"Average bandwidth: {avg_mbps:.2f} MBps")
             logger.info(f"Average throughput: {total_mb/total_time:.2f} MB/s" if total_time > 0 else "N/A")
+            cpu.log_report(bytes_received)
+            if verifier:
+                verifier.log_report()
+            if recorder:
+                recorder.close()
             logger.info("=" * 60)
             
         except Exception as e:
@@ -114,12 +138,84 @@ class UnixReceiver:
             except:
                 pass
 
+    def handle_latency_client(self, client_sock, connection_id):
+        """Echo requests back to the sender, or count a bulk stream, until it disconnects."""
+        total_bytes = 0
+        mode = None
+        try:
+            mode = client_sock.recv(1)
+            if mode not in (ECHO_MODE, BULK_MODE):
+                logger.warning(f"Connection #{connection_id}: unknown latency mode {mode!r}")
+                return
+            buffer = bytearray(self.chunk_size)
+            view = memoryview(buffer)
+            while True:
+                nbytes = client_sock.recv_into(buffer)
+                if nbytes == 0:
+                    break
+                if mode == ECHO_MODE:
+                    client_sock.sendall(view[:nbytes])
+                total_bytes += nbytes
+        except Exception as e:
+            logger.error(f"Connection #{connection_id}: error: {e}")
+        finally:
+            kind = "echo" if mode == ECHO_MODE else "bulk"
+            logger.info(f"Connection #{connection_id} ({kind}) closed after "
+                        f"{total_bytes / (1024*1024):.2f} MB")
+            client_sock.close()
+
+    def serve_latency(self):
+        """Run an echo server for latency tests, one thread per connection."""
+        signal.signal(signal.SIGINT, self.signal_handler)
+        signal.signal(signal.SIGTERM, self.signal_handler)
+        
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.bind(self.socket_path)
+            sock.listen(64)
+            sock.settimeout(1.0)
+            logger.info(f"Unix latency echo server listening on {self.socket_path}")
+            
+            connection_id = 0
+            while self.running:
+                try:
+                    client_sock, _ = sock.accept()
+                except socket.timeout:
+                    continue
+                client_sock.settimeout(None)
+                connection_id += 1
+                threading.Thread(target=self.handle_latency_client,
+                                 args=(client_sock, connection_id), daemon=True).start()
+        finally:
+            sock.close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
 def main():
     socket_path = input("Unix socket path (default: /tmp/tcp_receiver.sock): ").strip() or "/tmp/tcp_receiver.sock"
-    duration = int(input("Duration in seconds (default: 40): ") or "40")
+    print("Options:")
+    print("1. Bandwidth receive mode")
+    print("2. Latency echo mode (request/response)")
+    print("3. Record mode (write stream to disk)")
+    choice = input("Enter choice (1-3): ").strip()
     
     receiver = UnixReceiver(socket_path)
-    receiver.receive_data(duration_seconds=duration)
+    if choice == '2':
+        receiver.serve_latency()
+    else:
+        duration = int(input("Duration in seconds (default: 40): ") or "40")
+        receiver.chunk_size = int(input("Receive buffer size in bytes (default: 8192): ") or "8192")
+        receiver.socket_buffer = int(input("SO_RCVBUF in bytes (default: 0 = kernel default): ") or "0")
+        receiver.verify_payload = input("Verify payload integrity? [y/N]: ").strip().lower() == 'y'
+        record_path = None
+        direct_io = False
+        if choice == '3':
+            record_path = input("Recording path (default: /tmp/migration.stream): ").strip() or "/tmp/migration.stream"
+            direct_io = input("Use O_DIRECT writes? [y/N]: ").strip().lower() == 'y'
+        receiver.receive_data(duration_seconds=duration, record_path=record_path, direct_io=direct_io)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -2,7 +2,14 @@ import socket
 import time
 import logging
 import os
+import sys
+import copy
+import resource
 import threading
+# Helpers shared by the tcp and websocket benchmarks
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from perf_common import (BULK_MODE, ECHO_MODE, REPLAY_SLICE, CPUAccounting, LatencyHistogram,
+                         PayloadGenerator, load_replay_schedule)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -12,6 +19,8 @@ class UnixSender:
         self.socket_path = socket_path
         self.chunk_size = 8192
         self.test_data = b'x' * self.chunk_size  # 8KB of test data
+        self.payload = None  # Optional PayloadGenerator replacing test_data
+        self.socket_buffer = 0  # SO_SNDBUF to request; 0 keeps the kernel default
         
     def send_data(self, duration_seconds=40):
         """Send data continuously for specified duration."""
@@ -19,6 +28,10 @@ class UnixSender:
             # Create Unix domain socket
             sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
             
+            if self.socket_buffer:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.socket_buffer)
+                logger.info(f"SO_SNDBUF: {sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF)} bytes")
+            
             # Connect to receiver
             logger.info(f"Connecting to Unix socket: {self.socket_path}")
             sock.connect(self.socket_path)
@@ -28,15 +41,21 @@ class UnixSender:
             logger.info(f"Chunk size: {self.chunk_size} bytes")
             
             start_time = time.time()
+            # main() may run several senders, each in its own thread
+            cpu = CPUAccounting(resource.RUSAGE_THREAD)
             bytes_sent = 0
             chunks_sent = 0
             last_report_time = start_time
             last_report_bytes = 0
             
+            if self.payload:
+                sock.sendall(self.payload.header)
+            
             while time.time() - start_time < duration_seconds:
                 # Send data chunk
-                sock.sendall(self.test_data)
-                bytes_sent += self.chunk_size
+                chunk = self.payload.next_chunk(self.chunk_size) if self.payload else self.test_data
+                sock.sendall(chunk)
+                bytes_sent += len(chunk)
                 chunks_sent += 1
                 
                 # Report progress every second
@@ -68,6 +87,7 @@ class UnixSender:
             logger.info(f"Chunks sent: {chunks_sent}")
             logger.info(f"Average bandwidth: {avg_mbps:.2f} MBps")
             logger.info(f"Average throughput: {total_mb/total_time:.2f} MB/s")
+            cpu.log_report(bytes_sent)
             logger.info("=" * 60)
             
         except Exception as e:
@@ -78,12 +98,217 @@ class UnixSender:
             except:
                 pass
 
+    def replay_stream(self, record_path, paced=False):
+        """Replay a recorded stream with os.sendfile, paced by its timing index if paced is set."""
+        sock = None
+        try:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self.socket_path)
+            logger.info(f"Connected to Unix socket: {self.socket_path}")
+
+            with open(record_path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                if size == 0:
+                    logger.error(f"Recording {record_path} is empty")
+                    return
+                schedule = load_replay_schedule(record_path, size, paced)
+
+                logger.info(f"Replaying {size / (1024*1024):.2f} MB from {record_path}"
+                            f"{' at original timing' if paced else ''}")
+
+                start_time = time.time()
+                cpu = CPUAccounting()
+                bytes_sent = 0
+                sent = 0
+                lateness = 0.0
+                last_report_time = start_time
+                last_report_bytes = 0
+
+                for end_offset, due in schedule:
+                    delay = start_time + due - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+                    else:
+                        lateness = max(lateness, -delay)
+                    while sent < end_offset:
+                        count = min(REPLAY_SLICE, end_offset - sent)
+                        # Plain socket: let the kernel copy from the page cache
+                        count = os.sendfile(sock.fileno(), f.fileno(), sent, count)
+                        if count == 0:
+                            break  # EOF: the file shrank after fstat
+                        sent += count
+                        bytes_sent = sent
+
+                        # Report progress every second
+                        current_time = time.time()
+                        if current_time - last_report_time >= 1.0:
+                            elapsed = current_time - start_time
+                            interval_mbps = (bytes_sent - last_report_bytes) / (1024 * 1024)
+                            total_mbps = bytes_sent / (elapsed * 1024 * 1024)
+
+                            logger.info(f"Time: {elapsed:.1f}s | "
+                                      f"Sent: {bytes_sent / (1024*1024):.1f} MB | "
+                                      f"Interval: {interval_mbps:.2f} MBps | "
+                                      f"Avg: {total_mbps:.2f} MBps")
+
+                            last_report_time = current_time
+                            last_report_bytes = bytes_sent
+                    if sent < end_offset:
+                        logger.warning(f"{record_path} ended at {sent} of {size} bytes")
+                        break
+
+            # Final statistics
+            total_time = time.time() - start_time
+            total_mb = bytes_sent / (1024 * 1024)
+
+            logger.info("=" * 60)
+            logger.info("REPLAY FINAL RESULTS:")
+            logger.info(f"Duration: {total_time:.2f} seconds")
+            logger.info(f"Data sent: {total_mb:.2f} MB")
+            logger.info(f"Average throughput: {total_mb/total_time:.2f} MB/s" if total_time > 0 else "N/A")
+            if paced:
+                logger.info(f"Recorded duration: {schedule[-1][1]:.2f} seconds | "
+                            f"Max schedule lateness: {lateness * 1000:.1f} ms")
+            cpu.log_report(bytes_sent)
+            logger.info("=" * 60)
+
+        except Exception as e:
+            logger.error(f"Error during replay: {e}")
+        finally:
+            if sock:
+                sock.close()
+
+    def run_latency_client(self, message_size, deadline, histogram):
+        """Issue back-to-back echo requests on one connection until the deadline."""
+        message = b'x' * message_size
+        response = bytearray(message_size)
+        view = memoryview(response)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+            sock.sendall(ECHO_MODE)
+            while time.time() < deadline:
+                request_start = time.perf_counter_ns()
+                sock.sendall(message)
+                received = 0
+                while received < message_size:
+                    nbytes = sock.recv_into(view[received:])
+                    if nbytes == 0:
+                        raise ConnectionError("receiver closed the connection")
+                    received += nbytes
+                histogram.record(time.perf_counter_ns() - request_start)
+        except Exception as e:
+            logger.error(f"Latency client error: {e}")
+        finally:
+            sock.close()
+
+    def run_bulk_load(self, stop_event, bytes_sent):
+        """Stream bulk data alongside a latency test until stop_event is set."""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+            sock.sendall(BULK_MODE)
+            while not stop_event.is_set():
+                sock.sendall(self.test_data)
+                bytes_sent[0] += self.chunk_size
+        except Exception as e:
+            logger.error(f"Bulk load error: {e}")
+        finally:
+            sock.close()
+
+    def measure_latency(self, duration_seconds=10, message_size=64, concurrency=1, with_load=False):
+        """Measure request/response latency against unix-receiver.py in latency echo mode."""
+        condition = "under load" if with_load else "idle"
+        logger.info(f"Starting latency test on {self.socket_path} ({condition}) for {duration_seconds} seconds")
+        logger.info(f"Message size: {message_size} bytes | Concurrency: {concurrency}")
+
+        stop_event = threading.Event()
+        bulk_bytes = [0]
+        bulk_thread = None
+        if with_load:
+            bulk_thread = threading.Thread(target=self.run_bulk_load, args=(stop_event, bulk_bytes))
+            bulk_thread.start()
+            time.sleep(0.5)  # Let the bulk stream reach steady state
+
+        start_time = time.time()
+        bulk_start_bytes = bulk_bytes[0]
+        deadline = start_time + duration_seconds
+        histograms = [LatencyHistogram() for _ in range(concurrency)]
+        clients = [threading.Thread(target=self.run_latency_client,
+                                    args=(message_size, deadline, histogram))
+                   for histogram in histograms]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        total_time = time.time() - start_time
+        bulk_total = bulk_bytes[0] - bulk_start_bytes
+
+        stop_event.set()
+        if bulk_thread:
+            bulk_thread.join()
+
+        histogram = LatencyHistogram()
+        for client_histogram in histograms:
+            histogram.merge(client_histogram)
+
+        logger.info("=" * 60)
+        logger.info(f"LATENCY RESULTS (Unix socket, {condition}):")
+        logger.info(f"Duration: {total_time:.2f} seconds")
+        logger.info(f"Message size: {message_size} bytes | Concurrency: {concurrency}")
+        histogram.log_summary("Round trips", total_time)
+        if with_load:
+            logger.info(f"Bulk load: {bulk_total / (total_time * 1024 * 1024):.2f} MBps")
+        logger.info("=" * 60)
+
 def main():
     socket_path = input("Unix socket path (default:/tmp/tcp_sender.sock): ").strip() or "/tmp/tcp_sender.sock"
+    print("Options:")
+    print("1. Bandwidth test")
+    print("2. Latency test (request/response against unix-receiver.py)")
+    print("3. Replay a recorded stream")
+    choice = input("Enter choice (1-3): ").strip()
+    
+    if choice == '3':
+        record_path = input("Recording path (default: /tmp/migration.stream): ").strip() or "/tmp/migration.stream"
+        paced = input("Pace to original timing? [y/N]: ").strip().lower() == 'y'
+        UnixSender(socket_path).replay_stream(record_path, paced=paced)
+        return
+    
+    if choice == '2':
+        duration = int(input("Duration in seconds (default: 10): ") or "10")
+        message_size = int(input("Message size in bytes (default 64): ") or "64")
+        concurrency = int(input("Concurrent connections (default 1): ") or "1")
+        with_load = input("Run a bulk stream alongside? [y/N]: ").strip().lower() == 'y'
+        UnixSender(socket_path).measure_latency(duration_seconds=duration, message_size=message_size,
+                                                concurrency=concurrency, with_load=with_load)
+        return
+    
     duration = int(input("Duration in seconds (default: 40): ") or "40")
+    connections = int(input("Parallel connections (default: 1): ") or "1")
+    chunk_size = int(input("Chunk size in bytes (default: 8192): ") or "8192")
+    socket_buffer = int(input("SO_SNDBUF in bytes (default: 0 = kernel default): ") or "0")
+    mode = input("Payload (x/random/zero/mixed/file, default x): ").strip() or 'x'
+    payload = None
+    if mode != 'x':
+        image_path = input("Memory image path: ").strip() if mode == 'file' else None
+        payload = PayloadGenerator(mode, image_path)
+        payload.log_profile()
     
-    sender = UnixSender(socket_path)
-    sender.send_data(duration_seconds=duration)
+    # Each connection becomes its own channel in send.py's multi-channel pump
+    threads = []
+    for _ in range(connections):
+        sender = UnixSender(socket_path)
+        sender.chunk_size = chunk_size
+        sender.test_data = b'x' * chunk_size
+        sender.socket_buffer = socket_buffer
+        # Connections share the generated payload but keep their own position in it
+        sender.payload = copy.copy(payload)
+        thread = threading.Thread(target=sender.send_data, args=(duration,))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
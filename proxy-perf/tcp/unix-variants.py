@@ -0,0 +1,253 @@
+import socket
+import time
+import logging
+import os
+import sys
+import fcntl
+import json
+import resource
+# Helpers shared by the tcp and websocket benchmarks
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from perf_common import cpu_hz
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Not exported by the fcntl module on every Python version
+F_SETPIPE_SZ = getattr(fcntl, 'F_SETPIPE_SZ', 1031)
+
+# name: (socket type, use socketpair, enlarge socket buffers, receive method)
+VARIANTS = {
+    'stream':        (socket.SOCK_STREAM,    False, False, 'recv'),
+    'stream-into':   (socket.SOCK_STREAM,    False, False, 'recv_into'),
+    'stream-bigbuf': (socket.SOCK_STREAM,    False, True,  'recv_into'),
+    'socketpair':    (socket.SOCK_STREAM,    True,  True,  'recv_into'),
+    'seqpacket':     (socket.SOCK_SEQPACKET, False, True,  'recv_into'),
+    'splice':        (socket.SOCK_STREAM,    False, True,  'splice'),
+}
+
+DEFAULT_CHUNK_SIZES = [4096, 8192, 65536, 262144, 1048576]
+
+class UnixVariantBenchmark:
+    """Sweep Unix socket transport variants over chunk sizes.
+
+    Each run forks a sender that writes a preallocated chunk in a loop while
+    this process receives. Sender CPU comes from wait4(), receiver CPU from
+    getrusage(), so both sides of the hop are costed separately.
+    """
+    def __init__(self, socket_path='/tmp/unix_variants.sock', socket_buffer=4 * 1024 * 1024):
+        self.socket_path = socket_path
+        self.socket_buffer = socket_buffer
+        self.results = []
+
+    def set_buffers(self, sock):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.socket_buffer)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.socket_buffer)
+
+    def run_sender(self, sock, chunk_size, duration_seconds):
+        """Child process: send one preallocated chunk repeatedly, then exit."""
+        chunk = memoryview(bytearray(b'x' * chunk_size))
+        deadline = time.time() + duration_seconds
+        try:
+            if sock.type == socket.SOCK_SEQPACKET:
+                # Each send is one record; a partial send is impossible
+                while time.time() < deadline:
+                    sock.send(chunk)
+            else:
+                while time.time() < deadline:
+                    sock.sendall(chunk)
+            sock.shutdown(socket.SHUT_WR)
+            os._exit(0)
+        except Exception as e:
+            logger.error(f"Sender error: {e}")
+            os._exit(1)
+
+    def receive(self, sock, method, chunk_size):
+        """Receive until EOF; return (bytes received, receive calls)."""
+        total = 0
+        calls = 0
+        if method == 'recv':
+            # Baseline: a new bytes object per call, as UnixReceiver used to do
+            while True:
+                data = sock.recv(chunk_size)
+                calls += 1
+                if not data:
+                    break
+                total += len(data)
+        elif method == 'recv_into':
+            buffer = bytearray(chunk_size)
+            while True:
+                nbytes = sock.recv_into(buffer)
+                calls += 1
+                if nbytes == 0:
+                    break
+                total += nbytes
+        else:
+            # Socket -> pipe -> /dev/null: the payload never reaches userspace,
+            # which is what a forwarding proxy would do with a second splice
+            read_fd, write_fd = os.pipe()
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            try:
+                try:
+                    fcntl.fcntl(write_fd, F_SETPIPE_SZ, max(chunk_size, 65536))
+                except OSError:
+                    pass  # Above /proc/sys/fs/pipe-max-size
+                flags = os.SPLICE_F_MOVE | os.SPLICE_F_MORE
+                while True:
+                    nbytes = os.splice(sock.fileno(), write_fd, chunk_size, flags=flags)
+                    calls += 1
+                    if nbytes == 0:
+                        break
+                    total += nbytes
+                    while nbytes:
+                        nbytes -= os.splice(read_fd, devnull, nbytes, flags=flags)
+                        calls += 1
+            finally:
+                os.close(read_fd)
+                os.close(write_fd)
+                os.close(devnull)
+        return total, calls
+
+    def connect(self, sock_type, use_pair, big_buffers):
+        """Return (receiver socket, sender socket) for one run."""
+        if use_pair:
+            receiver_sock, sender_sock = socket.socketpair(socket.AF_UNIX, sock_type)
+        else:
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            listener = socket.socket(socket.AF_UNIX, sock_type)
+            try:
+                listener.bind(self.socket_path)
+                listener.listen(1)
+                sender_sock = socket.socket(socket.AF_UNIX, sock_type)
+                sender_sock.connect(self.socket_path)
+                receiver_sock, _ = listener.accept()
+            finally:
+                listener.close()
+                os.unlink(self.socket_path)
+        if big_buffers:
+            self.set_buffers(sender_sock)
+            self.set_buffers(receiver_sock)
+        return receiver_sock, sender_sock
+
+    def run_variant(self, name, chunk_size, duration_seconds):
+        sock_type, use_pair, big_buffers, method = VARIANTS[name]
+        if sock_type == socket.SOCK_SEQPACKET and big_buffers and chunk_size > self.socket_buffer:
+            logger.warning(f"{name} @ {chunk_size}: record larger than socket buffer, skipped")
+            return None
+
+        receiver_sock, sender_sock = self.connect(sock_type, use_pair, big_buffers)
+        sndbuf = sender_sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF)
+
+        pid = os.fork()
+        if pid == 0:
+            receiver_sock.close()
+            self.run_sender(sender_sock, chunk_size, duration_seconds)
+        sender_sock.close()
+
+        usage_before = resource.getrusage(resource.RUSAGE_SELF)
+        start_time = time.time()
+        try:
+            total, calls = self.receive(receiver_sock, method, chunk_size)
+        except OSError as e:
+            logger.error(f"{name} @ {chunk_size}: {e}")
+            total, calls = 0, 0
+        elapsed = time.time() - start_time
+        usage_after = resource.getrusage(resource.RUSAGE_SELF)
+        receiver_sock.close()
+
+        _, status, sender_usage = os.wait4(pid, 0)
+        if os.waitstatus_to_exitcode(status) != 0 or total == 0:
+            logger.error(f"{name} @ {chunk_size}: run failed")
+            return None
+
+        receiver_cpu = (usage_after.ru_utime - usage_before.ru_utime +
+                        usage_after.ru_stime - usage_before.ru_stime)
+        sender_cpu = sender_usage.ru_utime + sender_usage.ru_stime
+        gigabytes = total / 1e9
+        result = {
+            'variant': name,
+            'chunk_size': chunk_size,
+            'socket_buffer': sndbuf,
+            'bytes': total,
+            'seconds': elapsed,
+            'mbps': total / (elapsed * 1024 * 1024),
+            'sender_cpu': sender_cpu,
+            'receiver_cpu': receiver_cpu,
+            'cpu_s_per_gb': (sender_cpu + receiver_cpu) / gigabytes,
+            'receive_calls': calls,
+        }
+        logger.info(f"{name:<14} chunk {chunk_size:>8} | {result['mbps']:>9.2f} MBps | "
+                    f"send {sender_cpu / elapsed * 100:>4.0f}% | "
+                    f"recv {receiver_cpu / elapsed * 100:>4.0f}% | "
+                    f"{result['cpu_s_per_gb']:.3f} CPU-s/GB | "
+                    f"{total / calls / 1024:.1f} KB/call")
+        return result
+
+    def run_sweep(self, variants, chunk_sizes, duration_seconds=3):
+        logger.info(f"Sweeping {len(variants)} variants x {len(chunk_sizes)} chunk sizes, "
+                    f"{duration_seconds}s each (large buffers: {self.socket_buffer} bytes requested)")
+        for name in variants:
+            for chunk_size in chunk_sizes:
+                result = self.run_variant(name, chunk_size, duration_seconds)
+                if result:
+                    self.results.append(result)
+        self.log_summary()
+
+    def log_summary(self):
+        if not self.results:
+            logger.error("No successful runs")
+            return
+        logger.info("=" * 60)
+        logger.info("UNIX VARIANT SWEEP RESULTS:")
+        for name in dict.fromkeys(r['variant'] for r in self.results):
+            runs = [r for r in self.results if r['variant'] == name]
+            best = max(runs, key=lambda r: r['mbps'])
+            logger.info(f"{name:<14} best {best['mbps']:>9.2f} MBps @ {best['chunk_size']} bytes | "
+                        f"{best['cpu_s_per_gb']:.3f} CPU-s/GB | "
+                        f"SO_SNDBUF {best['socket_buffer']}")
+
+        fastest = max(self.results, key=lambda r: r['mbps'])
+        cheapest = min(self.results, key=lambda r: r['cpu_s_per_gb'])
+        logger.info(f"Fastest: {fastest['variant']} with {fastest['chunk_size']}-byte chunks "
+                    f"({fastest['mbps']:.2f} MBps)")
+        cost = f"Cheapest: {cheapest['variant']} with {cheapest['chunk_size']}-byte chunks " \
+               f"({cheapest['cpu_s_per_gb']:.3f} CPU-s/GB"
+        hz = cpu_hz()
+        if hz:
+            cpu_time = cheapest['sender_cpu'] + cheapest['receiver_cpu']
+            cost += f", {cheapest['bytes'] / (cpu_time * hz):.3f} bytes/cycle"
+        logger.info(cost + ")")
+        logger.info("=" * 60)
+
+    def export_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.results, f, indent=2)
+        logger.info(f"Results written to {path}")
+
+def main():
+    print("Unix socket transport variants:")
+    for name, (sock_type, use_pair, big_buffers, method) in VARIANTS.items():
+        kind = "socketpair" if use_pair else ("SOCK_SEQPACKET" if sock_type == socket.SOCK_SEQPACKET else "SOCK_STREAM")
+        print(f"  {name:<14} {kind}, {method}{', large buffers' if big_buffers else ''}")
+
+    selected = input("Variants (comma separated, default: all): ").strip()
+    variants = [v.strip() for v in selected.split(',')] if selected else list(VARIANTS)
+    unknown = [v for v in variants if v not in VARIANTS]
+    if unknown:
+        logger.error(f"Unknown variants: {', '.join(unknown)}")
+        return
+
+    sizes = input(f"Chunk sizes in bytes (default: {','.join(map(str, DEFAULT_CHUNK_SIZES))}): ").strip()
+    chunk_sizes = [int(s) for s in sizes.split(',')] if sizes else DEFAULT_CHUNK_SIZES
+    duration = int(input("Seconds per run (default: 3): ") or "3")
+    socket_buffer = int(input("Large socket buffer size in bytes (default: 4194304): ") or "4194304")
+    export_path = input("Export JSON to (leave empty to skip): ").strip()
+
+    benchmark = UnixVariantBenchmark(socket_buffer=socket_buffer)
+    benchmark.run_sweep(variants, chunk_sizes, duration_seconds=duration)
+    if export_path:
+        benchmark.export_json(export_path)
+
+if __name__ == "__main__":
+    main()
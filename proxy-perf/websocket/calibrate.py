@@ -0,0 +1,193 @@
+import asyncio
+import websockets
+import ssl
+import time
+import logging
+import os
+import json
+import inspect
+import itertools
+import signal
+import socket
+import sys
+# The tuning file is read by websocket_common.load_websocket_tuning
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'migrate-websocket'))
+from websocket_common import WEBSOCKET_TUNING_FILE
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+# One connection per setting; the library's open/close lines drown the results
+logging.getLogger('websockets').setLevel(logging.WARNING)
+
+FRAME_SIZES = [16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024]
+WRITE_LIMITS = [32 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024]
+MAX_QUEUES = [16, 64]
+# Only the legacy implementation has a separate read buffer limit
+READ_LIMITS = [64 * 1024, 1024 * 1024]
+
+class WebSocketCalibrator:
+    """Sweep websockets buffer limits and frame size over loopback TLS.
+
+    Every setting runs against a freshly forked server with the same
+    options, so receive-side limits (max_queue, read_limit) are tested too.
+    Compression stays off: migration streams are bulk binary.
+    """
+    def __init__(self, cert_dir='../../migrate-websocket/certs', port=18766):
+        self.cert_dir = cert_dir
+        self.port = port
+        self.results = []
+        self.supports_read_limit = 'read_limit' in inspect.signature(websockets.connect).parameters
+
+    def create_ssl_contexts(self):
+        """Return (server, client) contexts with mutual certificate authentication."""
+        files = {name: os.path.join(self.cert_dir, name) for name in
+                 ('ca.pem', 'server-cert.pem', 'server-key.pem', 'client-cert.pem', 'client-key.pem')}
+        if not all(os.path.exists(f) for f in files.values()):
+            raise FileNotFoundError(f"Certificate files not found in {self.cert_dir}")
+
+        server_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        server_context.load_cert_chain(files['server-cert.pem'], files['server-key.pem'])
+        server_context.verify_mode = ssl.CERT_REQUIRED
+        server_context.load_verify_locations(files['ca.pem'])
+
+        client_context = ssl.create_default_context(ssl.Purpose.SERVER_AUTH)
+        client_context.load_cert_chain(files['client-cert.pem'], files['client-key.pem'])
+        client_context.load_verify_locations(files['ca.pem'])
+        client_context.check_hostname = False
+        client_context.verify_mode = ssl.CERT_REQUIRED
+        return server_context, client_context
+
+    def settings(self):
+        """Yield (frame size, connection options) for every point of the sweep."""
+        read_limits = READ_LIMITS if self.supports_read_limit else [None]
+        for frame_size, write_limit, max_queue, read_limit in itertools.product(
+                FRAME_SIZES, WRITE_LIMITS, MAX_QUEUES, read_limits):
+            options = {
+                'compression': None,
+                'max_size': max(frame_size, 2 ** 20),
+                'max_queue': max_queue,
+                'write_limit': write_limit,
+            }
+            if read_limit:
+                options['read_limit'] = read_limit
+            yield frame_size, options
+
+    def run_server(self, ssl_context, options):
+        """Child process: sink every message until terminated."""
+        async def sink(websocket):
+            try:
+                async for _ in websocket:
+                    pass
+            except websockets.exceptions.ConnectionClosed:
+                pass
+
+        async def serve():
+            async with websockets.serve(sink, '127.0.0.1', self.port, ssl=ssl_context, **options):
+                await asyncio.Future()
+
+        signal.signal(signal.SIGTERM, lambda *_: os._exit(0))
+        try:
+            asyncio.run(serve())
+        finally:
+            os._exit(0)
+
+    async def run_client(self, ssl_context, frame_size, options, duration_seconds):
+        """Send frames back to back; return (bytes sent, seconds until the server had them all)."""
+        url = f"wss://127.0.0.1:{self.port}"
+        for _ in range(50):
+            try:
+                websocket = await websockets.connect(url, ssl=ssl_context, **options)
+                break
+            except OSError:
+                await asyncio.sleep(0.1)
+        else:
+            raise ConnectionError(f"calibration server on {url} did not come up")
+
+        frame = os.urandom(frame_size)
+        bytes_sent = 0
+        start_time = time.time()
+        deadline = start_time + duration_seconds
+        while time.time() < deadline:
+            await websocket.send(frame)
+            bytes_sent += frame_size
+        # The close handshake completes only after the server has read everything
+        await websocket.close()
+        return bytes_sent, time.time() - start_time
+
+    def run_point(self, frame_size, options, duration_seconds):
+        server_context, client_context = self.create_ssl_contexts()
+        pid = os.fork()
+        if pid == 0:
+            self.run_server(server_context, options)
+
+        try:
+            bytes_sent, elapsed = asyncio.run(self.run_client(client_context, frame_size, options, duration_seconds))
+        except Exception as e:
+            logger.error(f"frame {frame_size} {options}: {e}")
+            bytes_sent, elapsed = 0, 0
+        finally:
+            os.kill(pid, signal.SIGTERM)
+            _, _, server_usage = os.wait4(pid, 0)
+        if not bytes_sent:
+            return None
+
+        result = {
+            'frame_size': frame_size,
+            'connection': options,
+            'mbps': bytes_sent / (elapsed * 1024 * 1024),
+            'server_cpu_s_per_gb': (server_usage.ru_utime + server_usage.ru_stime) / (bytes_sent / 1e9),
+        }
+        limits = " | ".join(f"{key} {value}" for key, value in options.items() if key != 'compression')
+        logger.info(f"frame {frame_size:>8} | {limits} | {result['mbps']:>8.2f} MBps | "
+                    f"server {result['server_cpu_s_per_gb']:.3f} CPU-s/GB")
+        return result
+
+    def calibrate(self, duration_seconds=2):
+        points = list(self.settings())
+        logger.info(f"Calibrating websockets {websockets.__version__} on {socket.gethostname()}: "
+                    f"{len(points)} settings, {duration_seconds}s each")
+        for frame_size, options in points:
+            result = self.run_point(frame_size, options, duration_seconds)
+            if result:
+                self.results.append(result)
+        if not self.results:
+            logger.error("No successful runs")
+            return None
+
+        ranked = sorted(self.results, key=lambda r: r['mbps'], reverse=True)
+        logger.info("=" * 60)
+        logger.info("WEBSOCKET CALIBRATION - TOP SETTINGS:")
+        for result in ranked[:5]:
+            logger.info(f"frame {result['frame_size']:>8} | {result['connection']} | {result['mbps']:.2f} MBps")
+        baseline = [r for r in self.results if r['frame_size'] == min(FRAME_SIZES)
+                    and r['connection']['write_limit'] == min(WRITE_LIMITS)]
+        if baseline:
+            logger.info(f"Best vs smallest frame and write limit: "
+                        f"{ranked[0]['mbps'] / max(r['mbps'] for r in baseline):.2f}x")
+        logger.info("=" * 60)
+        return ranked[0]
+
+    def save(self, best):
+        tuning = {
+            'host': socket.gethostname(),
+            'websockets': websockets.__version__,
+            'calibrated': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'frame_size': best['frame_size'],
+            'connection': best['connection'],
+            'mbps': round(best['mbps'], 2),
+        }
+        os.makedirs(os.path.dirname(WEBSOCKET_TUNING_FILE), exist_ok=True)
+        with open(WEBSOCKET_TUNING_FILE, 'w') as f:
+            json.dump(tuning, f, indent=2)
+        logger.info(f"Optimum written to {WEBSOCKET_TUNING_FILE}")
+
+def main():
+    cert_dir = input("Certificate directory (default: ../../migrate-websocket/certs): ").strip() or "../../migrate-websocket/certs"
+    duration = int(input("Seconds per setting (default: 2): ") or "2")
+    calibrator = WebSocketCalibrator(cert_dir)
+    best = calibrator.calibrate(duration_seconds=duration)
+    if best and input(f"Save optimum to {WEBSOCKET_TUNING_FILE}? [Y/n]: ").strip().lower() != 'n':
+        calibrator.save(best)
+
+if __name__ == "__main__":
+    main()
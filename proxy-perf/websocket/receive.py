@@ -4,6 +4,13 @@ import ssl
 import time
 import logging
 import os
+import sys
+# Helpers shared by the tcp and websocket benchmarks
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from perf_common import BULK_MODE, ECHO_MODE, CPUAccounting, HandshakePhase, PayloadVerifier
+# Shared with the migrate-websocket proxy scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'migrate-websocket'))
+from websocket_common import TLS_PROFILES, apply_tls_profile, load_websocket_tuning
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -13,6 +20,19 @@ class WebSocketReceiver:
         self.host = host
         self.port = port
         self.cert_dir = cert_dir
+        self.verify_payload = False  # Check CRC-32 framed payloads from the senders
+        self.tls_profile = 'default'  # Key into TLS_PROFILES
+        self.unix_socket_path = None  # Forward received data here instead of only counting it
+        self.coalesce_size = 256 * 1024  # Gather messages into writes of this size for the Unix hop
+        self.coalesce_delay = 0.001  # Flush a partial batch after this long
+        # Calibrated websockets limits for this host, if calibrate.py has been run
+        self.connection_options, _ = load_websocket_tuning(websockets.serve)
+        # All connections share one event loop, so CPU is accounted per transfer:
+        # from the first connection until the last concurrent one closes
+        self.active_clients = 0
+        self.transfer_clients = 0
+        self.transfer_bytes = 0
+        self.transfer_cpu = None
         
     def create_ssl_context(self):
         """Create SSL context for secure WebSocket server."""
@@ -29,16 +49,39 @@ class WebSocketReceiver:
         ssl_context.load_cert_chain(cert_file, key_file)
         ssl_context.verify_mode = ssl.CERT_REQUIRED
         ssl_context.load_verify_locations(ca_file)
+        apply_tls_profile(ssl_context, self.tls_profile)
         
         return ssl_context
         
+    def begin_transfer(self):
+        """Start CPU accounting when the first of a group of concurrent connections arrives."""
+        if self.active_clients == 0:
+            self.transfer_cpu = CPUAccounting()
+            self.transfer_clients = 0
+            self.transfer_bytes = 0
+        self.active_clients += 1
+        self.transfer_clients += 1
+        
+    def end_transfer(self, bytes_received):
+        """Add a closed connection's bytes; report the server CPU once the last one closes."""
+        self.active_clients -= 1
+        self.transfer_bytes += bytes_received
+        if self.active_clients == 0 and self.transfer_bytes > 0:
+            logger.info("=" * 60)
+            logger.info(f"TRANSFER COMPLETE - {self.transfer_clients} connection(s), "
+                        f"{self.transfer_bytes / (1024 * 1024):.2f} MB in total")
+            self.transfer_cpu.log_report(self.transfer_bytes)
+            logger.info("=" * 60)
+        
     async def handle_client(self, websocket):
         """Handle incoming WebSocket connection and measure receive bandwidth."""
         client_addr = websocket.remote_address
         logger.info(f"Client connected from {client_addr}")
+        self.begin_transfer()
         
         try:
             start_time = time.time()
+            verifier = PayloadVerifier() if self.verify_payload else None
             bytes_received = 0
             chunks_received = 0
             last_report_time = start_time
@@ -46,6 +89,8 @@ class WebSocketReceiver:
             
             async for message in websocket:
                 if isinstance(message, bytes):
+                    if verifier:
+                        verifier.feed(message)
                     bytes_received += len(message)
                     chunks_received += 1
                     
@@ -84,22 +129,206 @@ class WebSocketReceiver:
                 logger.info(f"Chunks received: {chunks_received}")
                 logger.info(f"Average bandwidth: {avg_mbps:.2f} MBps")
                 logger.info(f"Average throughput: {total_mb/total_time:.2f} MB/s")
+                if verifier:
+                    verifier.log_report()
                 logger.info("=" * 60)
             
             logger.info(f"Client {client_addr} disconnected")
+            self.end_transfer(bytes_received)
         
-    async def start_server(self):
+    async def handle_client_unix(self, websocket):
+        """Forward a WebSocket stream to a Unix socket with coalesced, pipelined writes.
+
+        Messages are gathered until coalesce_size bytes or coalesce_delay
+        seconds, then written without waiting; drain() only blocks once the
+        transport buffer is full. Time spent waiting on each hop is reported
+        to show which one limits the pipeline.
+        """
+        client_addr = websocket.remote_address
+        logger.info(f"Client connected from {client_addr}")
+        try:
+            _, writer = await asyncio.open_unix_connection(self.unix_socket_path)
+        except OSError as e:
+            logger.error(f"Cannot forward data for client {client_addr} - Unix socket connection failed: {e}")
+            await websocket.close()
+            return
+        writer.transport.set_write_buffer_limits(high=4 * self.coalesce_size)
+        logger.info(f"Connected to Unix domain socket {self.unix_socket_path}")
+
+        loop = asyncio.get_running_loop()
+        pending = bytearray()
+        flush_timer = None
+        stats = {'writes': 0}
+
+        def flush():
+            nonlocal pending, flush_timer
+            if flush_timer:
+                flush_timer.cancel()
+                flush_timer = None
+            if pending:
+                writer.write(pending)
+                pending = bytearray()
+                stats['writes'] += 1
+
+        self.begin_transfer()
+        start_time = time.time()
+        verifier = PayloadVerifier() if self.verify_payload else None
+        bytes_received = 0
+        chunks_received = 0
+        websocket_wait = 0.0
+        unix_wait = 0.0
+        last_report_time = start_time
+        last_report_bytes = 0
+        try:
+            while True:
+                wait_start = time.perf_counter()
+                try:
+                    message = await websocket.recv()
+                except websockets.exceptions.ConnectionClosed:
+                    break
+                websocket_wait += time.perf_counter() - wait_start
+                if not isinstance(message, bytes):
+                    continue
+                if verifier:
+                    verifier.feed(message)
+                pending += message
+                bytes_received += len(message)
+                chunks_received += 1
+
+                if len(pending) >= self.coalesce_size:
+                    flush()
+                    wait_start = time.perf_counter()
+                    await writer.drain()
+                    unix_wait += time.perf_counter() - wait_start
+                elif flush_timer is None:
+                    flush_timer = loop.call_later(self.coalesce_delay, flush)
+
+                # Report progress every second
+                current_time = time.time()
+                if current_time - last_report_time >= 1.0:
+                    elapsed = current_time - start_time
+                    interval_mbps = (bytes_received - last_report_bytes) / (1024 * 1024)
+                    forwarded = bytes_received - len(pending) - writer.transport.get_write_buffer_size()
+                    logger.info(f"Time: {elapsed:.1f}s | "
+                                f"Received: {bytes_received / (1024*1024):.1f} MB | "
+                                f"Forwarded: {forwarded / (1024*1024):.1f} MB | "
+                                f"Interval: {interval_mbps:.2f} MBps | "
+                                f"Avg: {bytes_received / (elapsed * 1024 * 1024):.2f} MBps")
+                    last_report_time = current_time
+                    last_report_bytes = bytes_received
+
+            flush()
+            wait_start = time.perf_counter()
+            await writer.drain()
+            unix_wait += time.perf_counter() - wait_start
+        except Exception as e:
+            logger.error(f"Error forwarding data to Unix socket: {e}")
+        finally:
+            if flush_timer:
+                flush_timer.cancel()
+            writer.close()
+            if bytes_received > 0:
+                total_time = time.time() - start_time
+                total_mb = bytes_received / (1024 * 1024)
+
+                logger.info("=" * 60)
+                logger.info(f"CLIENT {client_addr} DISCONNECTED - FINAL RESULTS:")
+                logger.info(f"Duration: {total_time:.2f} seconds")
+                logger.info(f"Data forwarded: {total_mb:.2f} MB")
+                logger.info(f"Messages received: {chunks_received} | Unix writes: {stats['writes']} "
+                            f"(avg {bytes_received / max(stats['writes'], 1) / 1024:.1f} KB)")
+                logger.info(f"Average throughput: {total_mb/total_time:.2f} MB/s")
+                logger.info(f"WebSocket hop: waiting for data {websocket_wait / total_time * 100:.1f}% of the time")
+                logger.info(f"Unix hop: blocked on drain {unix_wait / total_time * 100:.1f}% of the time")
+                if verifier:
+                    verifier.log_report()
+                logger.info("=" * 60)
+            logger.info(f"Client {client_addr} disconnected")
+            self.end_transfer(bytes_received)
+
+    async def handle_client_latency(self, websocket):
+        """Serve a latency-test connection: echo messages or count a bulk stream.
+
+        The first message selects the mode, as in the TCP receiver.
+        """
+        client_addr = websocket.remote_address
+        try:
+            mode = await websocket.recv()
+        except websockets.exceptions.ConnectionClosed:
+            return
+        
+        if mode == BULK_MODE:
+            await self.handle_client(websocket)
+            return
+        if mode != ECHO_MODE:
+            logger.warning(f"Client {client_addr} sent unknown latency mode {mode!r}")
+            return
+        
+        echoes = 0
+        try:
+            async for message in websocket:
+                await websocket.send(message)
+                echoes += 1
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            logger.info(f"Latency client {client_addr} disconnected after {echoes} echoes")
+        
+    async def handle_client_handshake(self, websocket):
+        """Count a completed TLS + WebSocket handshake, reply with one byte and close."""
+        ssl_object = websocket.transport.get_extra_info('ssl_object')
+        try:
+            await websocket.send(b'H')
+        except websockets.exceptions.ConnectionClosed:
+            self.handshake_phase.record_failure()
+            return
+        self.handshake_phase.record(ssl_object.version(), ssl_object.session_reused)
+        
+    async def report_handshakes(self):
+        """Log the handshake rate every second and a phase summary after each idle gap."""
+        last_report_count = 0
+        while True:
+            await asyncio.sleep(1.0)
+            phase = self.handshake_phase
+            if phase.completed > last_report_count:
+                logger.info(f"Handshakes: {phase.completed} | "
+                            f"Interval: {phase.completed - last_report_count}/s | "
+                            f"Failed: {phase.failed}")
+            last_report_count = phase.completed
+            if phase.idle():
+                phase.log_report()
+                self.handshake_phase = HandshakePhase()
+                last_report_count = 0
+        
+    async def start_server(self, latency=False, handshake=False):
         """Start the WebSocket server."""
         ssl_context = self.create_ssl_context()
         
+        if handshake:
+            handler = self.handle_client_handshake
+            self.handshake_phase = HandshakePhase()
+            asyncio.create_task(self.report_handshakes())
+        elif self.unix_socket_path:
+            handler = self.handle_client_unix
+        else:
+            handler = self.handle_client_latency if latency else self.handle_client
         server = await websockets.serve(
-            self.handle_client,
+            handler,
             self.host,
             self.port,
-            ssl=ssl_context
+            ssl=ssl_context,
+            backlog=1024 if handshake else 100,
+            # Bulk senders pick their own message size; do not cap it at the 1 MiB default
+            **{**self.connection_options, 'max_size': None}
         )
         
         logger.info(f"WebSocket bandwidth test server listening on wss://{self.host}:{self.port}")
+        if latency:
+            logger.info("Latency echo mode (request/response)")
+        if handshake:
+            logger.info("Handshake mode: reporting handshakes/sec and server CPU per handshake")
+        elif self.unix_socket_path:
+            logger.info(f"Data will be forwarded to Unix socket: {self.unix_socket_path}")
         logger.info("Waiting for client connections...")
         logger.info("Server supports multiple concurrent connections")
         
@@ -107,9 +336,26 @@ class WebSocketReceiver:
 
 async def main():
     receiver = WebSocketReceiver()
+    tls_profile = input(f"TLS profile ({', '.join(TLS_PROFILES)}; default: default): ").strip() or 'default'
+    if tls_profile not in TLS_PROFILES:
+        print(f"Unknown TLS profile {tls_profile}, using default")
+        tls_profile = 'default'
+    receiver.tls_profile = tls_profile
+    
+    print("Options:")
+    print("1. Bandwidth mode (measure only)")
+    print("2. Latency echo mode (request/response)")
+    print("3. TLS handshake mode (handshakes/sec and CPU per handshake)")
+    print("4. Unix socket output mode (forward data)")
+    choice = input("Enter choice (1-4): ").strip()
+    if choice == '4':
+        receiver.unix_socket_path = input("Unix socket path (default: /tmp/tcp_receiver.sock): ").strip() or "/tmp/tcp_receiver.sock"
+        receiver.coalesce_size = int(input("Coalesced write size in bytes (default 262144): ") or "262144")
+    if choice not in ('2', '3'):
+        receiver.verify_payload = input("Verify payload integrity? [y/N]: ").strip().lower() == 'y'
     
     try:
-        await receiver.start_server()
+        await receiver.start_server(latency=(choice == '2'), handshake=(choice == '3'))
     except KeyboardInterrupt:
         logger.info("Shutting down server...")
     except Exception as e:
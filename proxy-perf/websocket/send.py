@@ -4,17 +4,47 @@ import ssl
 import time
 import logging
 import os
+import sys
+import copy
+# Helpers shared by the tcp and websocket benchmarks
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from perf_common import (BULK_MODE, ECHO_MODE, HANDSHAKE_PHASE_PAUSE, TLS_VERSIONS, CPUAccounting,
+                         LatencyHistogram, PayloadGenerator, TokenBucketPacer, log_pacing_stats,
+                         set_kernel_pacing)
+# Shared with the migrate-websocket proxy scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'migrate-websocket'))
+from websocket_common import TLS_PROFILES, apply_tls_profile, load_websocket_tuning
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class AsyncTokenBucketPacer(TokenBucketPacer):
+    """TokenBucketPacer whose wait() sleeps on the event loop."""
+    async def wait(self, nbytes):
+        """Sleep until nbytes may be sent without exceeding the target rate."""
+        delay = self.reserve(nbytes)
+        if delay > 0:
+            deadline = time.perf_counter() + delay
+            await asyncio.sleep(delay)
+            self.sleeps += 1
+            self.max_lateness = max(self.max_lateness, time.perf_counter() - deadline)
+
 class WebSocketSender:
     def __init__(self, server_url, cert_dir='../../migrate-websocket/certs'):
         self.server_url = server_url
         self.cert_dir = cert_dir
-        self.chunk_size = 8192
-        self.test_data = b'x' * self.chunk_size  # 8KB of data
+        # Calibrated websockets limits for this host, if calibrate.py has been run
+        self.connection_options, frame_size = load_websocket_tuning(websockets.connect)
+        self.chunk_size = frame_size or 8192
+        self.test_data = b'x' * self.chunk_size  # 8KB of data unless calibrated
+        self.payload = None  # Optional PayloadGenerator replacing test_data
+        self.tls_profile = 'default'  # Key into TLS_PROFILES
         
+    def use_payload(self, mode, image_path=None):
+        """Send a framed, verifiable payload instead of the constant test pattern."""
+        self.payload = PayloadGenerator(mode, image_path)
+        self.payload.log_profile()
+
     def create_ssl_context(self):
         """Create SSL context for secure WebSocket connection."""
         ssl_context = ssl.create_default_context(ssl.Purpose.SERVER_AUTH)
@@ -32,15 +62,29 @@ class WebSocketSender:
         ssl_context.load_verify_locations(ca_file)
         ssl_context.check_hostname = False
         ssl_context.verify_mode = ssl.CERT_REQUIRED
+        apply_tls_profile(ssl_context, self.tls_profile)
         
         return ssl_context
         
-    async def benchmark_send(self, duration_seconds=30, target_mbps=None):
+    def create_pacer(self, websocket, target_mbps, kernel_pacing=False):
+        """Set up rate limiting: kernel pacing if requested, otherwise a token bucket."""
+        if not target_mbps:
+            return None
+        target_bps = target_mbps * 1024 * 1024
+        if kernel_pacing:
+            sock = websocket.transport.get_extra_info('socket')
+            if sock is not None and set_kernel_pacing(sock, target_bps):
+                return None
+        # Allow about 5 ms worth of burst, but never less than two chunks
+        burst_bytes = max(2 * self.chunk_size, target_bps * 0.005)
+        return AsyncTokenBucketPacer(target_bps, burst_bytes)
+
+    async def benchmark_send(self, duration_seconds=30, target_mbps=None, kernel_pacing=False):
         """Send data continuously and benchmark bandwidth."""
         ssl_context = self.create_ssl_context()
         
         try:
-            async with websockets.connect(self.server_url, ssl=ssl_context) as websocket:
+            async with websockets.connect(self.server_url, ssl=ssl_context, **self.connection_options) as websocket:
                 logger.info(f"Connected to {self.server_url}")
                 logger.info(f"Starting bandwidth test for {duration_seconds} seconds")
                 logger.info(f"Chunk size: {self.chunk_size} bytes")
@@ -49,28 +93,29 @@ class WebSocketSender:
                     logger.info(f"Target bandwidth: {target_mbps} MBps")
                 
                 start_time = time.time()
+                cpu = CPUAccounting()
                 bytes_sent = 0
                 chunks_sent = 0
                 last_report_time = start_time
                 last_report_bytes = 0
+                interval_rates = []
                 
-                # Calculate delay between sends if target bandwidth is specified
-                send_delay = 0
-                if target_mbps:
-                    # Convert MBps to bytes per second
-                    target_bps = target_mbps * 1024 * 1024
-                    # Calculate delay needed between chunks
-                    send_delay = self.chunk_size / target_bps
+                # Pace sends if target bandwidth is specified
+                pacer = self.create_pacer(websocket, target_mbps, kernel_pacing)
+                
+                if self.payload:
+                    await websocket.send(self.payload.header)
                 
                 while time.time() - start_time < duration_seconds:
                     # Send data chunk
-                    await websocket.send(self.test_data)
-                    bytes_sent += self.chunk_size
+                    chunk = self.payload.next_chunk(self.chunk_size) if self.payload else self.test_data
+                    await websocket.send(chunk)
+                    bytes_sent += len(chunk)
                     chunks_sent += 1
                     
                     # Apply rate limiting if target bandwidth is set
-                    if send_delay > 0:
-                        await asyncio.sleep(send_delay)
+                    if pacer:
+                        await pacer.wait(len(chunk))
                     
                     # Report progress every second
                     current_time = time.time()
@@ -79,6 +124,7 @@ class WebSocketSender:
                         interval_bytes = bytes_sent - last_report_bytes
                         interval_mbps = interval_bytes / (1024 * 1024)  # Convert to MBps
                         total_mbps = bytes_sent / (elapsed * 1024 * 1024)
+                        interval_rates.append(interval_bytes / ((current_time - last_report_time) * 1024 * 1024))
                         
                         logger.info(f"Time: {elapsed:.1f}s | "
                                   f"Sent: {bytes_sent / (1024*1024):.1f} MB | "
@@ -101,32 +147,281 @@ class WebSocketSender:
                 logger.info(f"Chunks sent: {chunks_sent}")
                 logger.info(f"Average bandwidth: {avg_mbps:.2f} MBps")
                 logger.info(f"Average throughput: {total_mb/total_time:.2f} MB/s")
+                log_pacing_stats(target_mbps, avg_mbps, interval_rates, pacer)
+                cpu.log_report(bytes_sent)
                 logger.info("=" * 60)
                 
         except Exception as e:
             logger.error(f"Error during benchmark: {e}")
 
+    async def run_pipelined_connection(self, ssl_context, message_size, write_limit, deadline, counters, index, payload):
+        """Send back-to-back messages on one connection until the deadline.
+
+        send() only waits when the transport buffer is above write_limit, so
+        messages are pipelined instead of paying one round of the event loop each.
+        """
+        chunk = b'x' * message_size
+        try:
+            # Explicit arguments of this mode win over calibrated options
+            options = {**self.connection_options, 'compression': None,
+                       'max_size': None, 'write_limit': write_limit}
+            async with websockets.connect(self.server_url, ssl=ssl_context, **options) as websocket:
+                if payload:
+                    await websocket.send(payload.header)
+                while time.time() < deadline:
+                    message = payload.next_chunk(message_size) if payload else chunk
+                    await websocket.send(message)
+                    counters[index] += len(message)
+        except Exception as e:
+            logger.error(f"Connection {index}: error during benchmark: {e}")
+
+    async def benchmark_send_pipelined(self, duration_seconds=30, connections=4, message_size=1024 * 1024,
+                                       write_limit=4 * 1024 * 1024):
+        """Measure aggregate WebSocket throughput over several pipelined connections.
+
+        Compression is disabled and reporting matches TCPSender, so the result
+        can be set directly against a raw TLS run with the same payload.
+        """
+        ssl_context = self.create_ssl_context()
+        logger.info(f"Starting pipelined test to {self.server_url} for {duration_seconds} seconds")
+        logger.info(f"Connections: {connections} | Message size: {message_size} bytes | "
+                    f"Write limit: {write_limit} bytes | Compression: off")
+
+        start_time = time.time()
+        cpu = CPUAccounting()
+        deadline = start_time + duration_seconds
+        counters = [0] * connections
+        tasks = [asyncio.create_task(self.run_pipelined_connection(
+                     ssl_context, message_size, write_limit, deadline, counters, index,
+                     # Connections share the generated payload but keep their own position in it
+                     copy.copy(self.payload)))
+                 for index in range(connections)]
+
+        last_report_time = start_time
+        last_report_bytes = 0
+        interval_rates = []
+        while not all(task.done() for task in tasks):
+            await asyncio.wait(tasks, timeout=1.0)
+            current_time = time.time()
+            bytes_sent = sum(counters)
+            if current_time - last_report_time >= 1.0:
+                elapsed = current_time - start_time
+                interval_rate = (bytes_sent - last_report_bytes) / ((current_time - last_report_time) * 1024 * 1024)
+                interval_rates.append(interval_rate)
+                logger.info(f"Time: {elapsed:.1f}s | "
+                            f"Sent: {bytes_sent / (1024*1024):.1f} MB | "
+                            f"Interval: {interval_rate:.2f} MBps | "
+                            f"Avg: {bytes_sent / (elapsed * 1024 * 1024):.2f} MBps")
+                last_report_time = current_time
+                last_report_bytes = bytes_sent
+
+        total_time = time.time() - start_time
+        bytes_sent = sum(counters)
+        total_mb = bytes_sent / (1024 * 1024)
+        messages = bytes_sent // message_size
+        # Client frames carry a 4-byte mask plus a 2-10 byte header
+        frame_overhead = messages * (4 + (2 if message_size < 126 else 4 if message_size < 65536 else 10))
+
+        logger.info("=" * 60)
+        logger.info("PIPELINED FINAL RESULTS:")
+        logger.info(f"Duration: {total_time:.2f} seconds")
+        logger.info(f"Data sent: {total_mb:.2f} MB in {messages} messages")
+        for index, count in enumerate(counters):
+            logger.info(f"  Connection {index}: {count / (total_time * 1024 * 1024):.2f} MBps")
+        logger.info(f"Average throughput: {total_mb / total_time:.2f} MB/s")
+        logger.info(f"WebSocket framing overhead: {frame_overhead / max(bytes_sent, 1) * 100:.3f}%")
+        if interval_rates:
+            logger.info(f"Interval MBps: min {min(interval_rates):.2f} | max {max(interval_rates):.2f}")
+        cpu.log_report(bytes_sent)
+        logger.info("=" * 60)
+
+    async def run_latency_client(self, ssl_context, message_size, deadline, histogram):
+        """Issue back-to-back echo requests on one connection until the deadline."""
+        message = b'x' * message_size
+        try:
+            async with websockets.connect(self.server_url, ssl=ssl_context, **self.connection_options) as websocket:
+                await websocket.send(ECHO_MODE)
+                while time.time() < deadline:
+                    request_start = time.perf_counter_ns()
+                    await websocket.send(message)
+                    await websocket.recv()
+                    histogram.record(time.perf_counter_ns() - request_start)
+        except Exception as e:
+            logger.error(f"Latency client error: {e}")
+
+    async def run_bulk_load(self, ssl_context, stop_event, bytes_sent):
+        """Stream bulk data alongside a latency test until stop_event is set."""
+        try:
+            async with websockets.connect(self.server_url, ssl=ssl_context, **self.connection_options) as websocket:
+                await websocket.send(BULK_MODE)
+                while not stop_event.is_set():
+                    await websocket.send(self.test_data)
+                    bytes_sent[0] += self.chunk_size
+        except Exception as e:
+            logger.error(f"Bulk load error: {e}")
+
+    async def benchmark_latency(self, duration_seconds=10, message_size=64, concurrency=1, with_load=False):
+        """Measure request/response latency against a receiver in latency echo mode."""
+        ssl_context = self.create_ssl_context()
+        condition = "under load" if with_load else "idle"
+
+        logger.info(f"Starting latency test to {self.server_url} ({condition}) for {duration_seconds} seconds")
+        logger.info(f"Message size: {message_size} bytes | Concurrency: {concurrency}")
+
+        stop_event = asyncio.Event()
+        bulk_bytes = [0]
+        bulk_task = None
+        if with_load:
+            bulk_task = asyncio.create_task(self.run_bulk_load(ssl_context, stop_event, bulk_bytes))
+            await asyncio.sleep(0.5)  # Let the bulk stream reach steady state
+
+        start_time = time.time()
+        bulk_start_bytes = bulk_bytes[0]
+        deadline = start_time + duration_seconds
+        histograms = [LatencyHistogram() for _ in range(concurrency)]
+        await asyncio.gather(*(self.run_latency_client(ssl_context, message_size, deadline, histogram)
+                               for histogram in histograms))
+        total_time = time.time() - start_time
+        bulk_total = bulk_bytes[0] - bulk_start_bytes
+
+        stop_event.set()
+        if bulk_task:
+            await bulk_task
+
+        histogram = LatencyHistogram()
+        for client_histogram in histograms:
+            histogram.merge(client_histogram)
+
+        logger.info("=" * 60)
+        logger.info(f"LATENCY RESULTS (WebSocket, {condition}):")
+        logger.info(f"Duration: {total_time:.2f} seconds")
+        logger.info(f"Message size: {message_size} bytes | Concurrency: {concurrency}")
+        histogram.log_summary("Round trips", total_time)
+        if with_load:
+            logger.info(f"Bulk load: {bulk_total / (total_time * 1024 * 1024):.2f} MBps")
+        logger.info("=" * 60)
+
+    async def run_handshake_client(self, ssl_context, deadline, histogram, counts):
+        """Open, handshake and close connections back to back until the deadline."""
+        while time.time() < deadline:
+            try:
+                handshake_start = time.perf_counter_ns()
+                async with websockets.connect(self.server_url, ssl=ssl_context, **self.connection_options) as websocket:
+                    histogram.record(time.perf_counter_ns() - handshake_start)
+                    await websocket.recv()
+                counts['full'] += 1
+            except Exception as e:
+                counts['failed'] += 1
+                logger.debug(f"Handshake failed: {e}")
+
+    async def benchmark_handshakes(self, duration_seconds=10, concurrency_levels=(1,), versions=('1.3',)):
+        """Measure TLS + WebSocket handshake rate and latency against a receiver in handshake mode.
+
+        asyncio cannot hand a saved TLS session to a new connection, so only
+        full handshakes are measured here; the TCP sender covers resumption.
+        """
+        results = []
+        combinations = [(version, concurrency) for version in versions for concurrency in concurrency_levels]
+        for index, (version, concurrency) in enumerate(combinations):
+            if index:
+                await asyncio.sleep(HANDSHAKE_PHASE_PAUSE)
+            ssl_context = self.create_ssl_context()
+            ssl_context.minimum_version = TLS_VERSIONS[version]
+            ssl_context.maximum_version = TLS_VERSIONS[version]
+            label = f"TLS {version} full x{concurrency}"
+            logger.info(f"Starting handshake test: {label} for {duration_seconds} seconds")
+
+            cpu = CPUAccounting()
+            start_time = time.time()
+            deadline = start_time + duration_seconds
+            histograms = [LatencyHistogram() for _ in range(concurrency)]
+            counts = [{'full': 0, 'failed': 0} for _ in range(concurrency)]
+            await asyncio.gather(*(self.run_handshake_client(ssl_context, deadline, histograms[i], counts[i])
+                                   for i in range(concurrency)))
+            total_time = time.time() - start_time
+
+            histogram = LatencyHistogram()
+            for client_histogram in histograms:
+                histogram.merge(client_histogram)
+            full = sum(c['full'] for c in counts)
+            failed = sum(c['failed'] for c in counts)
+
+            logger.info("=" * 60)
+            logger.info(f"HANDSHAKE RESULTS ({label}):")
+            logger.info(f"Duration: {total_time:.2f} seconds")
+            logger.info(f"Handshakes: {full} ({full / total_time:.1f}/s) | Failed: {failed}")
+            histogram.log_summary("TCP connect + TLS + WebSocket handshake", total_time)
+            cpu.log_report(0)
+            logger.info("=" * 60)
+            results.append((label, full / total_time, histogram.percentile(50), histogram.percentile(99)))
+
+        if len(results) > 1:
+            logger.info("=" * 60)
+            logger.info("HANDSHAKE MATRIX (client view, see receiver for server CPU per handshake):")
+            for label, rate, p50, p99 in results:
+                logger.info(f"{label:<26} {rate:>9.1f}/s | p50 {p50 / 1e6:.2f} ms | p99 {p99 / 1e6:.2f} ms")
+            logger.info("=" * 60)
+
+def choose_payload(sender):
+    """Prompt for a payload mode; the default keeps the legacy b'x' stream."""
+    mode = input("Payload (x/random/zero/mixed/file, default x): ").strip() or 'x'
+    if mode != 'x':
+        image_path = input("Memory image path: ").strip() if mode == 'file' else None
+        sender.use_payload(mode, image_path)
+
 async def main():
     server_url = 'wss://10.117.30.218:8766'
     sender = WebSocketSender(server_url)
+    tls_profile = input(f"TLS profile ({', '.join(TLS_PROFILES)}; default: default): ").strip() or 'default'
+    if tls_profile not in TLS_PROFILES:
+        print(f"Unknown TLS profile {tls_profile}, using default")
+        tls_profile = 'default'
+    sender.tls_profile = tls_profile
     
     print("WebSocket Bandwidth Test - Sender")
     print("Options:")
     print("1. Unlimited bandwidth test (30 seconds)")
     print("2. Rate-limited bandwidth test")
     print("3. Custom duration test")
+    print("4. Latency test (request/response)")
+    print("5. TLS handshake benchmark")
+    print("6. Pipelined multi-connection test")
     
-    choice = input("Enter choice (1-3): ").strip()
+    choice = input("Enter choice (1-6): ").strip()
+    if choice in ('1', '2', '3', '6'):
+        choose_payload(sender)
     
     if choice == '1':
         await sender.benchmark_send(duration_seconds=30)
     elif choice == '2':
         target_mbps = float(input("Enter target bandwidth (MBps): "))
         duration = int(input("Enter duration (seconds, default 30): ") or "30")
-        await sender.benchmark_send(duration_seconds=duration, target_mbps=target_mbps)
+        kernel_pacing = input("Use kernel pacing (SO_MAX_PACING_RATE)? [y/N]: ").strip().lower() == 'y'
+        await sender.benchmark_send(duration_seconds=duration, target_mbps=target_mbps, kernel_pacing=kernel_pacing)
     elif choice == '3':
         duration = int(input("Enter duration (seconds): "))
         await sender.benchmark_send(duration_seconds=duration)
+    elif choice == '4':
+        duration = int(input("Enter duration (seconds, default 10): ") or "10")
+        message_size = int(input("Message size in bytes (default 64): ") or "64")
+        concurrency = int(input("Concurrent connections (default 1): ") or "1")
+        with_load = input("Run a bulk stream alongside? [y/N]: ").strip().lower() == 'y'
+        await sender.benchmark_latency(duration_seconds=duration, message_size=message_size,
+                                       concurrency=concurrency, with_load=with_load)
+    elif choice == '5':
+        duration = int(input("Seconds per test (default 10): ") or "10")
+        concurrency = input("Concurrency levels (default 1,8,32): ").strip() or "1,8,32"
+        versions = input("TLS versions (default 1.2,1.3): ").strip() or "1.2,1.3"
+        await sender.benchmark_handshakes(duration_seconds=duration,
+                                          concurrency_levels=[int(c) for c in concurrency.split(',')],
+                                          versions=[v.strip() for v in versions.split(',')])
+    elif choice == '6':
+        duration = int(input("Enter duration (seconds, default 30): ") or "30")
+        connections = int(input("Connections (default 4): ") or "4")
+        message_size = int(input("Message size in bytes (default 1048576): ") or "1048576")
+        write_limit = int(input("Write buffer limit in bytes (default 4194304): ") or "4194304")
+        await sender.benchmark_send_pipelined(duration_seconds=duration, connections=connections,
+                                              message_size=message_size, write_limit=write_limit)
     else:
         print("Invalid choice, running default test")
         await sender.benchmark_send(duration_seconds=30)